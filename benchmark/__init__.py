@@ -0,0 +1,4 @@
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Benchmarks of utils I/O and geometry hot paths on synthetic fixtures.
+"""
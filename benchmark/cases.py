@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Benchmark cases of utils I/O and geometry hot paths.
+
+Each case is set up on a synthetic scene and returns the function to time and the amount of work
+of one call, reported as throughput in the unit of the case.
+"""
+
+from __future__ import print_function
+
+import os
+
+import numpy as np
+
+from utils.io import (read_corr, CorrFile, read_mask, MaskFile, read_kpt, load_pfm, read_cams,
+                      pack_kpts, KeypointStore)
+from utils.camera import CameraSet
+from utils.geom import (interpolate_depth, warp, warp_batch, grid_positions, relative_pose,
+                        scale_intrinsics, undist_points, get_epipolar_dist_mat)
+from utils.patch_extractor import PatchExtractor
+from utils.mask import render_masks
+from utils.matches import CorrJoin
+from utils.corr_columns import convert_corr, CorrColumns
+from utils.spatial import KeypointIndex, kpt_positions
+
+CASES = []
+
+
+def case(name, unit):
+    """Register a benchmark case.
+    Args:
+        name: case name.
+        unit: unit of work, e.g., MB, records, points.
+    """
+    def _register(setup):
+        CASES.append((name, unit, setup))
+        return setup
+    return _register
+
+
+def _path(root, *args):
+    return os.path.join(root, *args)
+
+
+def _basename(idx):
+    return str(idx).zfill(8)
+
+
+@case('read_corr', 'MB')
+def _read_corr(root):
+    path = _path(root, 'geolabel', 'corr.bin')
+    return lambda: read_corr(path), os.path.getsize(path) / 1e6
+
+
+@case('CorrFile.scan', 'records')
+def _corr_file(root):
+    path = _path(root, 'geolabel', 'corr.bin')
+    return lambda: CorrFile(path), len(CorrFile(path))
+
+
+@case('CorrFile.iter', 'MB')
+def _corr_file_iter(root):
+    path = _path(root, 'geolabel', 'corr.bin')
+    corr_file = CorrFile(path)
+    return lambda: [float(val[2][:, 12].sum()) for val in corr_file], os.path.getsize(path) / 1e6
+
+
+@case('CorrColumns.pos', 'correspondences')
+def _corr_columns(root):
+    path = _path(root, 'geolabel', 'corr.bin')
+    col_dir = convert_corr(path, path + '.bench_cols')
+
+    def _run():
+        corr_columns = CorrColumns(col_dir)
+        return [corr_columns.read(i) for i in range(len(corr_columns))]
+    return _run, int(CorrFile(path).num_corr().sum())
+
+
+@case('read_mask', 'records')
+def _read_mask(root):
+    path = _path(root, 'geolabel', 'mask.bin')
+    return lambda: read_mask(path), len(MaskFile(path))
+
+
+@case('MaskFile.packed', 'records')
+def _mask_file(root):
+    path = _path(root, 'geolabel', 'mask.bin')
+    return lambda: MaskFile(path, packed=True, packed_path=path + '.bench'), len(MaskFile(path))
+
+
+@case('render_masks', 'records')
+def _render_masks(root):
+    masks = MaskFile(_path(root, 'geolabel', 'mask.bin')).records['mask'][:256]
+    return lambda: render_masks(masks, (480, 640)), masks.shape[0]
+
+
+@case('read_kpt', 'keypoints')
+def _read_kpt(root):
+    path = _path(root, 'img_kpts', _basename(0) + '.bin')
+    return lambda: read_kpt(path), read_kpt(path).shape[0]
+
+
+@case('KeypointStore.gather', 'keypoints')
+def _keypoint_store(root):
+    kpt_dir = _path(root, 'img_kpts')
+    store = KeypointStore(kpt_dir, pack_kpts(kpt_dir, kpt_dir + '.bench'))
+    corr_file = CorrFile(_path(root, 'geolabel', 'corr.bin'))
+    records = list(corr_file)
+
+    def _run():
+        return [store.gather(idx0, corr[:, 13]) for idx0, _, corr in records]
+    return _run, int(corr_file.num_corr().sum())
+
+
+@case('CorrJoin', 'correspondences')
+def _corr_join(root):
+    corr_file = CorrFile(_path(root, 'geolabel', 'corr.bin'))
+    kpt_store = KeypointStore(_path(root, 'img_kpts'))
+
+    def _run():
+        corr_join = CorrJoin(corr_file, kpt_store)
+        return corr_join.keypoints(), corr_join.match_counts()
+    return _run, int(corr_file.num_corr().sum())
+
+
+@case('KeypointIndex.match', 'keypoints')
+def _keypoint_index(root):
+    cams = CameraSet.load(_path(root, 'geolabel', 'cameras.txt'))
+    xy0 = kpt_positions(read_kpt(_path(root, 'img_kpts', _basename(0) + '.bin')), cams[0][4])
+    xy1 = kpt_positions(read_kpt(_path(root, 'img_kpts', _basename(1) + '.bin')), cams[1][4])
+
+    def _run():
+        return KeypointIndex(xy1, cell_size=4.).match(xy0, 4.)
+    return _run, xy0.shape[0] + xy1.shape[0]
+
+
+@case('load_pfm', 'MB')
+def _load_pfm(root):
+    path = _path(root, 'depths', _basename(0) + '.pfm')
+    return lambda: load_pfm(path), os.path.getsize(path) / 1e6
+
+
+@case('read_cams', 'cameras')
+def _read_cams(root):
+    path = _path(root, 'geolabel', 'cameras.txt')
+    return lambda: read_cams(path), len(read_cams(path))
+
+
+@case('CameraSet.load', 'cameras')
+def _camera_set(root):
+    path = _path(root, 'geolabel', 'cameras.txt')
+    return lambda: CameraSet.load(path, cache_path=path + '.bench'), len(read_cams(path))
+
+
+@case('interpolate_depth', 'points')
+def _interpolate_depth(root):
+    depth = load_pfm(_path(root, 'depths', _basename(0) + '.pfm'))
+    pos = grid_positions(depth.shape[0], depth.shape[1]) + 0.5
+    return lambda: interpolate_depth(pos, depth), pos.shape[0]
+
+
+def _load_pair(root):
+    cams = CameraSet.load(_path(root, 'geolabel', 'cameras.txt'))
+    depths = {i: load_pfm(_path(root, 'depths', _basename(i) + '.pfm')) for i in range(2)}
+    return cams, depths
+
+
+@case('warp', 'points')
+def _warp(root):
+    cams, depths = _load_pair(root)
+    K0, t0, R0, _, size0 = cams[0]
+    K1, t1, R1, _, size1 = cams[1]
+    rel_pose = np.concatenate(relative_pose([R0, t0], [R1, t1]), axis=-1)
+    r_K0 = scale_intrinsics(K0, size0, depths[0].shape[::-1])
+    r_K1 = scale_intrinsics(K1, size1, depths[1].shape[::-1])
+    pos0 = grid_positions(depths[0].shape[0], depths[0].shape[1])
+    return lambda: warp(pos0, rel_pose, depths[0], r_K0, depths[1], r_K1), pos0.shape[0]
+
+
+@case('warp_batch', 'points')
+def _warp_batch(root):
+    cams = CameraSet.load(_path(root, 'geolabel', 'cameras.txt'))
+    n = min(len(cams), 8)
+    depths = {i: load_pfm(_path(root, 'depths', _basename(i) + '.pfm')) for i in range(n)}
+    pairs = list(range(1, n))
+    return lambda: warp_batch(0, pairs, depths, cams), depths[0].size * len(pairs)
+
+
+@case('undist_points', 'keypoints')
+def _undist_points(root):
+    cams = CameraSet.load(_path(root, 'geolabel', 'cameras.txt'))
+    K, _, _, dist, size = cams[0]
+    kpts = read_kpt(_path(root, 'img_kpts', _basename(0) + '.bin'))
+    return lambda: undist_points(kpts, K, dist, size), kpts.shape[0]
+
+
+@case('CameraSet.undistort', 'keypoints')
+def _camera_set_undistort(root):
+    cams = CameraSet.load(_path(root, 'geolabel', 'cameras.txt'))
+    kpts = [read_kpt(_path(root, 'img_kpts', _basename(i) + '.bin')) for i in range(len(cams))]
+    img_idx = np.repeat(np.arange(len(cams)), [val.shape[0] for val in kpts])
+    kpts = np.concatenate(kpts, axis=0)
+    return lambda: cams.undistort(kpts, img_idx), kpts.shape[0]
+
+
+@case('get_epipolar_dist_mat', 'pairs')
+def _epipolar_dist_mat(root):
+    cams = CameraSet.load(_path(root, 'geolabel', 'cameras.txt'))
+    kpts0 = read_kpt(_path(root, 'img_kpts', _basename(0) + '.bin'))[:, [2, 5]]
+    kpts1 = read_kpt(_path(root, 'img_kpts', _basename(1) + '.bin'))[:, [2, 5]]
+    e_mat = cams.get_essential_mat([0], [1])[0]
+
+    def _run():
+        return get_epipolar_dist_mat(kpts0, kpts1, cams.K[0], cams.K[1], cams.img_size[0],
+                                     cams.img_size[1], e_mat, dtype=np.float32, top_k=10)
+    return _run, kpts0.shape[0] * kpts1.shape[0]
+
+
+@case('PatchExtractor', 'patches')
+def _patch_extractor(root):
+    rng = np.random.RandomState(0)
+    img = (rng.rand(1000, 1000) * 255).astype(np.uint8)
+    kpts = read_kpt(_path(root, 'img_kpts', _basename(0) + '.bin'))
+    patch_extractor = PatchExtractor()
+    return lambda: patch_extractor.get_patches(img, kpts), kpts.shape[0]
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Synthetic scene fixtures in the GL3D data format, see docs/data_format.md.
+"""
+
+from __future__ import print_function
+
+import os
+from struct import pack
+
+import numpy as np
+
+
+def random_rotation(rng, max_angle=0.1):
+    """Random rotation matrix of a small angle (radian) around a random axis."""
+    axis = rng.randn(3)
+    axis /= np.linalg.norm(axis)
+    angle = rng.uniform(-max_angle, max_angle)
+    K = np.array([(0, -axis[2], axis[1]), (axis[2], 0, -axis[0]), (-axis[1], axis[0], 0)])
+    return np.eye(3) + np.sin(angle) * K + (1 - np.cos(angle)) * np.matmul(K, K)
+
+
+def make_cameras(n, img_size=(1000, 1000), seed=0):
+    """Generate cameras looking at the plane z = 10 from around the origin.
+    Returns:
+        data: Nx23 camera table in the format of cameras.txt.
+    """
+    rng = np.random.RandomState(seed)
+    data = np.zeros((n, 23))
+    for i in range(n):
+        R = random_rotation(rng)
+        center = rng.uniform(-1, 1, 3) * (1, 1, 0.2)
+        data[i, 0] = i
+        data[i, 1:3] = max(img_size) * 1.2
+        data[i, 3:5] = (img_size[0] / 2., img_size[1] / 2.)
+        data[i, 6:9] = -np.matmul(R, center)
+        data[i, 9:18] = R.ravel()
+        data[i, 18:21] = rng.uniform(-0.03, 0.03, 3)
+        data[i, 21:23] = img_size
+    return data
+
+
+def write_cameras(path, data):
+    with open(path, 'w') as fout:
+        for row in data:
+            fout.write('%d ' % row[0] + ' '.join(['%.9g' % val for val in row[1:21]]) +
+                       ' %d %d\n' % (row[21], row[22]))
+
+
+def render_plane_depth(cam, depth_size, plane_z=10.):
+    """Render the depth map of the plane z = plane_z.
+    Args:
+        cam: a row of the camera table.
+        depth_size: depth map size (width, height).
+    Returns:
+        depth: HxW float32 depth map.
+    """
+    w, h = depth_size
+    K = np.array([(cam[1] * w / cam[21], cam[5], cam[3] * w / cam[21]),
+                  (0, cam[2] * h / cam[22], cam[4] * h / cam[22]), (0, 0, 1)])
+    R = cam[9:18].reshape(3, 3)
+    center = -np.matmul(R.T, cam[6:9])
+    v, u = np.mgrid[0:h, 0:w]
+    rays = np.matmul(np.linalg.inv(K), np.stack([u.ravel(), v.ravel(), np.ones(h * w)]))
+    world_rays = np.matmul(R.T, rays)
+    depth = rays[2] * (plane_z - center[2]) / world_rays[2]
+    return depth.reshape(h, w).astype(np.float32)
+
+
+def write_pfm(path, data):
+    """Write a little-endian PFM file."""
+    with open(path, 'wb') as fout:
+        fout.write(b'PF\n' if data.ndim == 3 else b'Pf\n')
+        fout.write(('%d %d\n' % (data.shape[1], data.shape[0])).encode('UTF-8'))
+        fout.write(b'-1.000000\n')
+        fout.write(np.ascontiguousarray(data[::-1], dtype='<f4').tobytes())
+
+
+def make_kpts(n, rng):
+    """Generate Nx6 keypoint transformations."""
+    scale = rng.uniform(0.005, 0.05, (n, 1))
+    angle = rng.uniform(-np.pi, np.pi, (n, 1))
+    kpts = np.concatenate([scale * np.cos(angle), -scale * np.sin(angle), rng.uniform(-1, 1, (n, 1)),
+                           scale * np.sin(angle), scale * np.cos(angle), rng.uniform(-1, 1, (n, 1))],
+                          axis=-1)
+    return kpts.astype(np.float32)
+
+
+def write_corr(path, records):
+    """Write corr.bin.
+    Args:
+        records: list of (idx0, idx1, Nx15 float32 correspondences).
+    """
+    with open(path, 'wb') as fout:
+        for idx0, idx1, corr in records:
+            fout.write(pack('<3q', idx0, idx1, corr.shape[0]))
+            fout.write(np.ascontiguousarray(corr, dtype='<f4').tobytes())
+
+
+def make_corr(kpts0, kpts1, n, rng):
+    """Generate N correspondences between two keypoint sets."""
+    idx0 = rng.choice(kpts0.shape[0], n, replace=n > kpts0.shape[0])
+    idx1 = rng.choice(kpts1.shape[0], n, replace=n > kpts1.shape[0])
+    geo_dist = rng.uniform(0, 1, (n, 1)).astype(np.float32)
+    return np.concatenate([kpts0[idx0], kpts1[idx1], geo_dist,
+                           idx0[:, None].astype(np.float32), idx1[:, None].astype(np.float32)], axis=-1)
+
+
+def write_mask(path, pairs, rng, size=32):
+    """Write mask.bin of random masks for the given pairs."""
+    dtype = np.dtype([('idx0', '<i4'), ('idx1', '<i4'), ('mask', '?', (size * size * 2,))])
+    records = np.zeros(len(pairs), dtype=dtype)
+    records['idx0'] = [val[0] for val in pairs]
+    records['idx1'] = [val[1] for val in pairs]
+    records['mask'] = rng.rand(len(pairs), size * size * 2) > 0.5
+    records.tofile(path)
+
+
+def make_scene(root, n_images=8, img_size=(1000, 1000), depth_size=(1000, 1000), kpt_num=8000,
+               corr_num=100000, n_corr_pairs=4, n_mask_pairs=None, seed=0):
+    """Generate a synthetic scene.
+    Args:
+        root: scene directory.
+        n_images: number of images.
+        img_size: image size (width, height) in cameras.txt.
+        depth_size: depth map size (width, height).
+        kpt_num: number of keypoints per image.
+        corr_num: number of correspondences per matching record.
+        n_corr_pairs: number of matching records.
+        n_mask_pairs: number of mask records, defaults to all pairs.
+    Returns:
+        root: scene directory.
+    """
+    rng = np.random.RandomState(seed)
+    for sub_dir in ['geolabel', 'img_kpts', 'depths', 'undist_images']:
+        if not os.path.exists(os.path.join(root, sub_dir)):
+            os.makedirs(os.path.join(root, sub_dir))
+
+    cams = make_cameras(n_images, img_size, seed)
+    write_cameras(os.path.join(root, 'geolabel', 'cameras.txt'), cams)
+
+    all_kpts = []
+    for i in range(n_images):
+        kpts = make_kpts(kpt_num, rng)
+        kpts.tofile(os.path.join(root, 'img_kpts', str(i).zfill(8) + '.bin'))
+        all_kpts.append(kpts)
+        write_pfm(os.path.join(root, 'depths', str(i).zfill(8) + '.pfm'),
+                  render_plane_depth(cams[i], depth_size))
+
+    all_pairs = [(i, j) for i in range(n_images) for j in range(i + 1, n_images)]
+    records = [(i, j, make_corr(all_kpts[i], all_kpts[j], corr_num, rng))
+               for i, j in all_pairs[:n_corr_pairs]]
+    write_corr(os.path.join(root, 'geolabel', 'corr.bin'), records)
+
+    mask_pairs = all_pairs if n_mask_pairs is None else \
+        [all_pairs[val % len(all_pairs)] for val in range(n_mask_pairs)]
+    write_mask(os.path.join(root, 'geolabel', 'mask.bin'), mask_pairs, rng)
+
+    for name in ['mesh_overlap.txt', 'common_track.txt']:
+        with open(os.path.join(root, 'geolabel', name), 'w') as fout:
+            for i, j in all_pairs:
+                fout.write('%d %d %g\n%d %d %g\n' % (i, j, rng.uniform(0, 1), j, i, rng.uniform(0, 1)))
+    return root
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Benchmark runner.
+
+Each case runs in its own process, so that the peak RSS is measured per case. Results are saved
+in json and can be compared against a saved baseline.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import queue as queue_lib
+import tempfile
+import resource
+import tracemalloc
+import multiprocessing
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmark.fixtures import make_scene
+from benchmark.cases import CASES
+
+SIZES = {
+    'small': dict(n_images=4, depth_size=(250, 250), kpt_num=1000, corr_num=10000,
+                  n_corr_pairs=2, n_mask_pairs=1000),
+    'full': dict(n_images=8, depth_size=(1000, 1000), kpt_num=8000, corr_num=100000,
+                 n_corr_pairs=4, n_mask_pairs=20000),
+}
+
+
+def trace_call(fn):
+    """Trace allocations of a call by tracemalloc.
+    Returns:
+        net_blocks: number of memory blocks allocated by the call and still allocated once it
+            returns, including its result, but not blocks allocated and freed within the call.
+        peak_alloc: peak bytes allocated during the call.
+    """
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start_alloc, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    result = fn()
+    _, peak_alloc = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    del result
+    tracemalloc.stop()
+    # blocks of the snapshot taken before the call are not counted.
+    net_blocks = sum([val.count_diff for val in after.compare_to(before, 'filename')
+                      if val.traceback[0].filename != tracemalloc.__file__])
+    return net_blocks, peak_alloc - start_alloc
+
+
+def run_case(setup, root, repeat, queue):
+    """Time a case and report through the queue."""
+    try:
+        fn, work = setup(root)
+        fn()  # warm up.
+        times = []
+        for _ in range(repeat):
+            start_time = time.time()
+            fn()
+            times.append(time.time() - start_time)
+        net_blocks, peak_alloc = trace_call(fn)
+        # blocks held by the measurement itself, e.g., of its local variables.
+        net_blocks -= trace_call(lambda: None)[0]
+        # ru_maxrss is in KB on Linux and in bytes on macOS.
+        rss_unit = 1. if sys.platform == 'darwin' else 1024.
+        queue.put({
+            'time_min': min(times), 'time_median': float(np.median(times)), 'repeat': repeat,
+            'work': work, 'throughput': work / max(min(times), 1e-9),
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_unit / 1e6,
+            'peak_alloc_mb': peak_alloc / 1e6, 'net_blocks': net_blocks})
+    except Exception as err:  # pylint: disable=broad-except
+        queue.put({'error': '%s: %s' % (type(err).__name__, err)})
+
+
+def wait_result(proc, queue, timeout=None, poll_interval=1.):
+    """Wait for the result of a case process.
+    Args:
+        timeout: maximum seconds to wait, after which the process is terminated.
+    Returns:
+        result: the reported result, or an error if the process died or timed out without one.
+    """
+    start_time = time.time()
+    while True:
+        try:
+            return queue.get(timeout=poll_interval)
+        except queue_lib.Empty:
+            pass
+        if not proc.is_alive():
+            # the result may have been flushed right before the process exited.
+            try:
+                return queue.get(timeout=poll_interval)
+            except queue_lib.Empty:
+                return {'error': 'case process exited with code %s' % proc.exitcode}
+        if timeout is not None and time.time() - start_time > timeout:
+            proc.terminate()
+            return {'error': 'timed out after %.0fs' % timeout}
+
+
+def compare(results, baseline, tolerance):
+    """Compare results against the baseline.
+    Returns:
+        regressions: list of case names that are slower than the baseline by more than tolerance.
+    """
+    regressions = []
+    for name, val in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None or 'error' in val or 'error' in base:
+            continue
+        ratio = val['time_min'] / max(base['time_min'], 1e-9)
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = ' REGRESSION'
+            regressions.append(name)
+        print('%-24s %8.2fx vs baseline%s' % (name, ratio, flag))
+    return regressions
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--size', type=str, default='full', choices=sorted(SIZES.keys()),
+                        help='fixture size.')
+    parser.add_argument('--filter', type=str, default=None, help='only run cases containing this.')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed runs.')
+    parser.add_argument('--fixture_dir', type=str, default=None,
+                        help='directory to keep fixtures, defaults to a temporary one.')
+    parser.add_argument('--out', type=str, default=None, help='path to save results in json.')
+    parser.add_argument('--baseline', type=str, default=None, help='baseline json to compare with.')
+    parser.add_argument('--timeout', type=float, default=1800,
+                        help='seconds after which a case is terminated and reported as failed.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown reported as regression.')
+    args = parser.parse_args()
+
+    fixture_dir = args.fixture_dir if args.fixture_dir is not None else tempfile.mkdtemp()
+    root = os.path.join(fixture_dir, 'bench_%s' % args.size)
+    try:
+        if not os.path.exists(os.path.join(root, 'geolabel', 'mask.bin')):
+            print('Generating %s fixtures in %s' % (args.size, root))
+            make_scene(root, **SIZES[args.size])
+
+        results = {}
+        for name, unit, setup in CASES:
+            if args.filter is not None and args.filter not in name:
+                continue
+            queue = multiprocessing.Queue()
+            proc = multiprocessing.Process(target=run_case, args=(setup, root, args.repeat, queue))
+            proc.start()
+            result = wait_result(proc, queue, args.timeout)
+            proc.join()
+            result['unit'] = unit
+            results[name] = result
+            if 'error' in result:
+                print('%-24s %s' % (name, result['error']))
+            else:
+                print('%-24s %9.2f ms %12.1f %s/s  peak RSS %7.1f MB  peak alloc %7.1f MB' %
+                      (name, result['time_min'] * 1e3, result['throughput'], unit,
+                       result['peak_rss_mb'], result['peak_alloc_mb']))
+    finally:
+        if args.fixture_dir is None:
+            shutil.rmtree(fixture_dir, ignore_errors=True)
+
+    report = {'meta': {'size': args.size, 'python': platform.python_version(),
+                       'numpy': np.__version__, 'platform': platform.platform(),
+                       'time': time.strftime('%Y-%m-%d %H:%M:%S')},
+              'results': results}
+    if args.out is not None:
+        with open(args.out, 'w') as fout:
+            json.dump(report, fout, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as fin:
+            baseline = json.load(fin)
+        if baseline['meta']['size'] != args.size:
+            print('Warning: baseline size %s differs from %s.' % (baseline['meta']['size'], args.size))
+        if compare(results, baseline['results'], args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,8 @@
 #!/usr/bin/bash
+# Usage: bash download_data.sh <data_name> <chunk_start> <chunk_end>
+# Chunks are downloaded in parallel, resumed and verified by tools/download.py, which also
+# extracts the archive and filters scenes, refer to tools/README.md.
 DATA_NAME=$1
 
-if [ ! -d download_data_$DATA_NAME ]; then
-    mkdir -p download_data_$DATA_NAME
-fi
-
-let CHUNK_START=$2
-let CHUNK_END=$3
-
-for ((i=CHUNK_START;i<=CHUNK_END;i++)); do
-    IDX=$(printf "%03d" $i)
-    URL=research.altizure.com/data/gl3d_v2/$DATA_NAME/$DATA_NAME.tar.$IDX
-    wget -c $URL -P download_data_$DATA_NAME
-    echo $URL
-done
-
-URL=research.altizure.com/data/gl3d_v2/$DATA_NAME/sha1sum.txt
-wget -c $URL -P download_data_$DATA_NAME
-
+python3 "$(dirname "$0")/tools/download.py" $DATA_NAME --start $2 --end $3 \
+    --out_dir download_data_$DATA_NAME "${@:4}"
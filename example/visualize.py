@@ -10,14 +10,15 @@ import os
 import sys
 import numpy as np
 import cv2
-from scipy import ndimage
 import matplotlib.pyplot as plt
 
 sys.path.append('..')
 
-from utils.geom import get_essential_mat, get_epipolar_dist, undist_points, warp, grid_positions, upscale_positions, downscale_positions, relative_pose
-from utils.io import read_kpt, read_corr, read_mask, hash_int_pair, read_cams, load_pfm
+from utils.geom import get_essential_mat, get_epipolar_dist, undist_points, warp, grid_positions, upscale_positions, downscale_positions, relative_pose, scale_intrinsics
+from utils.io import read_kpt, CorrFile, MaskFile, read_cams, load_pfm
 from utils.patch_extractor import PatchExtractor
+from utils.mask import fill_masks, upsample_masks
+from utils.image import read_image
 
 
 def draw_kpts(imgs, kpts, color=(0, 255, 0), radius=2, thickness=2):
@@ -94,20 +95,10 @@ def draw_mask(img0, img1, mask, size=32, downscale_ratio=1):
     resize_imgs.append(cv2.resize(
         img1, (int(img1.shape[1] * downscale_ratio), int(img1.shape[0] * downscale_ratio))))
 
-    masks = []
-    masks.append(ndimage.binary_fill_holes(np.reshape(mask[:size * size], (size, size))))
-    masks.append(ndimage.binary_fill_holes(np.reshape(mask[size * size:], (size, size))))
-
+    masks = fill_masks(mask, size)
     for idx, val in enumerate(masks):
-        h_interval = np.ceil(float(resize_imgs[idx].shape[0]) / val.shape[0])
-        w_interval = np.ceil(float(resize_imgs[idx].shape[1]) / val.shape[1])
-
-        for i in range(resize_imgs[idx].shape[0]):
-            for j in range(resize_imgs[idx].shape[1]):
-                p = int(np.floor(i / h_interval))
-                q = int(np.floor(j / w_interval))
-                if val[p, q]:
-                    resize_imgs[idx][i, j, 0] = 255
+        val = upsample_masks(val, resize_imgs[idx].shape[0:2], mode='interval')
+        resize_imgs[idx][val, 0] = 255
 
     display = np.concatenate(resize_imgs, axis=1)
     return display
@@ -128,9 +119,8 @@ if __name__ == '__main__':
     # read correspondences
     match_pair_idx = args.pair_idx
     corr_path = os.path.join(root, 'geolabel', 'corr.bin')
-    match_records = read_corr(corr_path)
-    cidx0 = match_records[match_pair_idx][0]
-    cidx1 = match_records[match_pair_idx][1]
+    corr_file = CorrFile(corr_path)
+    cidx0, cidx1, corr = corr_file[match_pair_idx]
     basename0 = str(cidx0).zfill(8)
     basename1 = str(cidx1).zfill(8)
     # read images
@@ -173,12 +163,12 @@ if __name__ == '__main__':
         kpts1 = kpts1 * img_size1 / 2 + img_size1 / 2
         display = draw_kpts([img0, img1], [kpts0, kpts1])
     elif args.fn == 'match':
-        kpts0 = match_records[match_pair_idx][2][:, 0:6]
+        kpts0 = corr[:, 0:6]
         kpts0 = undist_points(kpts0, K0, dist0, ori_img_size0)
         kpts0 = np.stack([kpts0[:, 2], kpts0[:, 5]], axis=-1)
 
-        kpts1 = match_records[match_pair_idx][2][:, 6:12]
-        kpts1 = undist_points(kpts1, K0, dist1, ori_img_size1)
+        kpts1 = corr[:, 6:12]
+        kpts1 = undist_points(kpts1, K1, dist1, ori_img_size1)
         kpts1 = np.stack([kpts1[:, 2], kpts1[:, 5]], axis=-1)
 
         # validate epipolar geometry
@@ -197,11 +187,11 @@ if __name__ == '__main__':
         disp_num = 100
         patch_extractor = PatchExtractor()
 
-        kpts0 = match_records[match_pair_idx][2][:, 0:6][0:disp_num]
+        kpts0 = corr[:, 0:6][0:disp_num]
         kpts0 = undist_points(kpts0, K0, dist0, ori_img_size0)
 
-        kpts1 = match_records[match_pair_idx][2][:, 6:12][0:disp_num]
-        kpts1 = undist_points(kpts1, K0, dist1, ori_img_size1)
+        kpts1 = corr[:, 6:12][0:disp_num]
+        kpts1 = undist_points(kpts1, K1, dist1, ori_img_size1)
 
         gray_img0 = cv2.cvtColor(img0, cv2.COLOR_RGB2GRAY)
         patches0 = patch_extractor.get_patches(gray_img0, kpts0)
@@ -234,15 +224,14 @@ if __name__ == '__main__':
         rel_pose = np.concatenate(rel_pose, axis=-1)
 
         pos0 = grid_positions(depth0.shape[0], depth0.shape[1])
-        r0 = ori_img_size0 / depth0.shape[::-1][1:]
-        r1 = ori_img_size1 / depth1.shape[::-1][1:]
-        r_K0 = np.stack([K0[0] / r0[0], K0[1] / r0[1], K0[2]], axis=0)
-        r_K1 = np.stack([K1[0] / r1[0], K1[1] / r1[1], K1[2]], axis=0)
+        r_K0 = scale_intrinsics(K0, ori_img_size0, depth0.shape[::-1])
+        r_K1 = scale_intrinsics(K1, ori_img_size1, depth1.shape[::-1])
 
         pos0, pos1, ids = warp(pos0, rel_pose, depth0, r_K0, depth1, r_K1)
 
-        disp_img0 = cv2.resize(img0, (0, 0), fx=0.25, fy=0.25)
-        disp_img1 = cv2.resize(img1, (0, 0), fx=0.25, fy=0.25)
+        # decoded at reduced resolution.
+        disp_img0 = read_image(img_path0, scale=0.25, rgb=True)
+        disp_img1 = read_image(img_path1, scale=0.25, rgb=True)
 
         pos0 = np.round(pos0).astype(np.int32)
         pos1 = np.round(pos1).astype(np.int32)
@@ -258,8 +247,7 @@ if __name__ == '__main__':
     elif args.fn == 'mask':
         # visualize the mask file.
         mask_path = os.path.join(root, 'geolabel', 'mask.bin')
-        mask_dict = read_mask(mask_path)
-        mask = mask_dict.get(hash_int_pair(cidx0, cidx1))
+        mask = MaskFile(mask_path).get(cidx0, cidx1)
         display = draw_mask(img0, img1, mask, downscale_ratio=0.5)
     else:
         raise NotImplementedError()
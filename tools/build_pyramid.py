@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Build on-disk image pyramids of a dataset split.
+
+For each scene listed in list/<dataset>/imageset_<split>.txt, images of <pid>/<img_dir>/ are
+downscaled to <pid>/<img_dir>_d<factor>/, which are read by image.read_image when possible.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utils.io import read_list
+from utils.image import build_pyramid
+
+
+def process_scene(config):
+    """Build the pyramid of a scene.
+    Args:
+        config: (pid, data_root, img_dir, factors, ext, quality, overwrite).
+    Returns:
+        summary: a dictionary of the scene summary, or the error message.
+    """
+    pid, data_root, img_dir, factors, ext, quality, overwrite = config
+    start_time = time.time()
+    try:
+        count = build_pyramid(os.path.join(data_root, pid, img_dir), factors, ext, quality, overwrite)
+        return {'pid': pid, 'count': count, 'time': time.time() - start_time}
+    except Exception as err:  # pylint: disable=broad-except
+        return {'pid': pid, 'error': '%s: %s' % (type(err).__name__, err)}
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--dataset', type=str, default='comb',
+                        help='dataset list, e.g., gl3d, tourism, blendedmvg, comb.')
+    parser.add_argument('--split', type=str, default='train', help='train, test or all.')
+    parser.add_argument('--list_root', type=str, default='list', help='root of dataset lists.')
+    parser.add_argument('--data_root', type=str, default='data', help='root of scene data.')
+    parser.add_argument('--img_dir', type=str, default='undist_images',
+                        help='image folder, e.g., undist_images, blended_images.')
+    parser.add_argument('--factors', type=int, nargs='+', default=[2, 4], help='downscale factors.')
+    parser.add_argument('--ext', type=str, default=None,
+                        help='file extension of levels, e.g., .png, defaults to the source one.')
+    parser.add_argument('--quality', type=int, default=95, help='JPEG quality.')
+    parser.add_argument('--num_workers', type=int, default=8, help='number of processes.')
+    parser.add_argument('--overwrite', default=False, action='store_true',
+                        help='whether to rewrite existing level images.')
+    args = parser.parse_args()
+
+    pids = [val for val in read_list(os.path.join(args.list_root, args.dataset,
+                                                  'imageset_%s.txt' % args.split))
+            if val.strip() != '']
+    configs = [(pid, args.data_root, args.img_dir, args.factors, args.ext, args.quality,
+                args.overwrite) for pid in pids]
+    start_time = time.time()
+    failures = 0
+    count = 0
+    pool = Pool(args.num_workers)
+    try:
+        for idx, summary in enumerate(pool.imap_unordered(process_scene, configs)):
+            if 'error' in summary:
+                failures += 1
+                print('[%d/%d] %s failed: %s' % (idx + 1, len(configs), summary['pid'], summary['error']))
+                continue
+            count += summary['count']
+            print('[%d/%d] %s, %d images in %.2fs' %
+                  (idx + 1, len(configs), summary['pid'], summary['count'], summary['time']))
+    finally:
+        pool.close()
+        pool.join()
+    print('Wrote %d images of %d scenes in %.1fs, %d failed.' %
+          (count, len(configs) - failures, time.time() - start_time, failures))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Check the integrity of the data of a dataset split without loading it.
+
+For each scene listed in list/<dataset>/imageset_<split>.txt, binary files are validated from
+their sizes and headers only:
+    geolabel/cameras.txt         23 fields per line, unique image ids, matching the image number
+                                 of image_index_offset.txt.
+    geolabel/corr.bin            record headers walked to the end of file, i.e., 24 + 60 * N bytes
+                                 per record, with non-negative N and image ids of cameras.txt.
+    geolabel/mask.bin            a multiple of the record size, with image ids of cameras.txt.
+    img_kpts/<img_idx>.bin       a multiple of 24 bytes, i.e., 6 float32 per keypoint.
+    <depth>/<img_idx>.pfm        header dimensions matching the byte count.
+Issues are written to a json report, one entry per file of (pid, file, kind, detail).
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utils.io import read_list, read_pfm_header, mask_dtype, CorrFile
+
+KPT_SIZE = 24
+CAM_FIELDS = 23
+
+
+def _issue(issues, path, kind, detail):
+    issues.append({'file': path, 'kind': kind, 'detail': detail})
+
+
+def check_cams(cam_path, image_num, issues):
+    """Check cameras.txt.
+    Returns:
+        ids: image ids, or None if the file is missing or malformed.
+    """
+    if not os.path.exists(cam_path):
+        _issue(issues, cam_path, 'missing', 'file not found')
+        return None
+    ids = []
+    with open(cam_path) as fin:
+        for line_idx, line in enumerate(fin):
+            fields = line.split()
+            if not fields:
+                continue
+            if len(fields) != CAM_FIELDS:
+                _issue(issues, cam_path, 'format',
+                       'line %d has %d fields, expected %d' % (line_idx + 1, len(fields), CAM_FIELDS))
+                return None
+            try:
+                values = [float(val) for val in fields]
+            except ValueError as err:
+                _issue(issues, cam_path, 'format', 'line %d: %s' % (line_idx + 1, err))
+                return None
+            if not np.all(np.isfinite(values)):
+                _issue(issues, cam_path, 'format', 'line %d has non-finite values' % (line_idx + 1))
+            ids.append(int(values[0]))
+    ids = np.array(ids, dtype=np.int64)
+    if np.unique(ids).shape[0] != ids.shape[0]:
+        _issue(issues, cam_path, 'ids', '%d duplicated ids' % (ids.shape[0] - np.unique(ids).shape[0]))
+    if image_num is not None:
+        missing = np.setdiff1d(np.arange(image_num), ids)
+        extra = np.setdiff1d(ids, np.arange(image_num))
+        if missing.shape[0] > 0 or extra.shape[0] > 0:
+            _issue(issues, cam_path, 'ids', '%d of %d images missing, %d ids out of range, e.g., %s' %
+                   (missing.shape[0], image_num, extra.shape[0],
+                    (missing.tolist() + extra.tolist())[0:5]))
+    return ids
+
+
+def check_corr(corr_path, ids, issues):
+    """Walk the record headers of corr.bin by io.CorrFile.
+    Returns:
+        record_num: number of records.
+    """
+    try:
+        corr_file = CorrFile(corr_path, load_index=False)
+    except IOError as err:
+        _issue(issues, corr_path, 'truncated', str(err))
+        return 0
+    except ValueError as err:
+        _issue(issues, corr_path, 'format', str(err))
+        return 0
+    pairs = corr_file.pairs()
+    corr_file.close()
+    if ids is not None and pairs.shape[0] > 0:
+        unknown = ~np.isin(pairs, ids).all(axis=1)
+        if np.any(unknown):
+            _issue(issues, corr_path, 'ids', '%d records of unknown images, e.g., %s' %
+                   (int(unknown.sum()), pairs[unknown][0:5].tolist()))
+    return pairs.shape[0]
+
+
+def check_mask(mask_path, ids, issues, size=32, check_ids=True):
+    """Check mask.bin.
+    Returns:
+        record_num: number of complete records.
+    """
+    dtype = mask_dtype(size)
+    file_size = os.path.getsize(mask_path)
+    if file_size % dtype.itemsize != 0:
+        _issue(issues, mask_path, 'truncated', 'size %d is not a multiple of the record size %d' %
+               (file_size, dtype.itemsize))
+    record_num = file_size // dtype.itemsize
+    if check_ids and ids is not None and record_num > 0:
+        records = np.memmap(mask_path, dtype=dtype, mode='r', shape=(record_num,))
+        pairs = np.stack([records['idx0'], records['idx1']], axis=-1)
+        del records
+        unknown = ~np.isin(pairs, ids).all(axis=1)
+        if np.any(unknown):
+            _issue(issues, mask_path, 'ids', '%d records of unknown images, e.g., %s' %
+                   (int(unknown.sum()), pairs[unknown][0:5].tolist()))
+    return record_num
+
+
+def check_kpts(kpt_dir, ids, issues):
+    """Check the keypoint files of images.
+    Returns:
+        kpt_num: total number of keypoints.
+    """
+    if not os.path.isdir(kpt_dir):
+        _issue(issues, kpt_dir, 'missing', 'folder not found')
+        return 0
+    sizes = {}
+    for entry in os.scandir(kpt_dir):
+        name, ext = os.path.splitext(entry.name)
+        if ext == '.bin':
+            sizes[name] = entry.stat().st_size
+    kpt_num = 0
+    for name, file_size in sorted(sizes.items()):
+        if file_size % KPT_SIZE != 0:
+            _issue(issues, os.path.join(kpt_dir, name + '.bin'), 'truncated',
+                   'size %d is not a multiple of %d' % (file_size, KPT_SIZE))
+        kpt_num += file_size // KPT_SIZE
+    _check_names(kpt_dir, sizes, ids, '.bin', issues)
+    return kpt_num
+
+
+def check_depths(depth_dir, ids, issues):
+    """Check the PFM headers of depth maps against their sizes.
+    Returns:
+        depth_num: number of depth maps.
+    """
+    if not os.path.isdir(depth_dir):
+        _issue(issues, depth_dir, 'missing', 'folder not found')
+        return 0
+    names = {}
+    for entry in os.scandir(depth_dir):
+        name, ext = os.path.splitext(entry.name)
+        if ext != '.pfm':
+            continue
+        names[name] = True
+        try:
+            shape, data_type, offset = read_pfm_header(entry.path)
+        except Exception as err:  # pylint: disable=broad-except
+            _issue(issues, entry.path, 'format', 'bad header: %s' % err)
+            continue
+        expected = offset + int(np.prod(shape)) * data_type.itemsize
+        file_size = entry.stat().st_size
+        if file_size < expected:
+            _issue(issues, entry.path, 'truncated', '%s needs %d bytes, file size %d' %
+                   ('x'.join(map(str, shape)), expected, file_size))
+        elif file_size > expected:
+            _issue(issues, entry.path, 'size', '%d trailing bytes after %s data' %
+                   (file_size - expected, 'x'.join(map(str, shape))))
+    _check_names(depth_dir, names, ids, '.pfm', issues)
+    return len(names)
+
+
+def _check_names(folder, names, ids, ext, issues):
+    """Cross-check file names of images against image ids."""
+    if ids is None:
+        return
+    found = set()
+    invalid = []
+    for name in names:
+        try:
+            found.add(int(name))
+        except ValueError:
+            invalid.append(name + ext)
+    missing = sorted(set(ids.tolist()).difference(found))
+    extra = sorted(found.difference(ids.tolist()))
+    if missing:
+        _issue(issues, folder, 'missing', '%d of %d images missing, e.g., %s' %
+               (len(missing), ids.shape[0], [str(val).zfill(8) + ext for val in missing[0:5]]))
+    if extra or invalid:
+        _issue(issues, folder, 'ids', '%d files of unknown images, e.g., %s' %
+               (len(extra) + len(invalid), ([str(val).zfill(8) + ext for val in extra] + invalid)[0:5]))
+
+
+def check_scene(config):
+    """Check the files of a scene.
+    Args:
+        config: (pid, image_num, data_root, depth_dirs, check_mask_ids).
+    Returns:
+        summary: a dictionary of the scene summary and issues.
+    """
+    pid, image_num, data_root, depth_dirs, check_mask_ids = config
+    scene_root = os.path.join(data_root, pid)
+    start_time = time.time()
+    issues = []
+    summary = {'pid': pid, 'image_num': image_num}
+    try:
+        if not os.path.isdir(scene_root):
+            _issue(issues, scene_root, 'missing', 'scene not found')
+        else:
+            ids = check_cams(os.path.join(scene_root, 'geolabel', 'cameras.txt'), image_num, issues)
+            corr_path = os.path.join(scene_root, 'geolabel', 'corr.bin')
+            if os.path.exists(corr_path):
+                summary['corr_records'] = check_corr(corr_path, ids, issues)
+            mask_path = os.path.join(scene_root, 'geolabel', 'mask.bin')
+            if os.path.exists(mask_path):
+                summary['mask_records'] = check_mask(mask_path, ids, issues,
+                                                     check_ids=check_mask_ids)
+            summary['kpt_num'] = check_kpts(os.path.join(scene_root, 'img_kpts'), ids, issues)
+            for depth_dir in depth_dirs:
+                summary[depth_dir] = check_depths(os.path.join(scene_root, depth_dir), ids, issues)
+    except Exception as err:  # pylint: disable=broad-except
+        _issue(issues, scene_root, 'error', '%s: %s' % (type(err).__name__, err))
+    summary['issues'] = issues
+    summary['time'] = time.time() - start_time
+    return summary
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--dataset', type=str, default='comb',
+                        help='dataset list, e.g., gl3d, tourism, blendedmvg, comb.')
+    parser.add_argument('--split', type=str, default='all', help='train, test or all.')
+    parser.add_argument('--list_root', type=str, default='list', help='root of dataset lists.')
+    parser.add_argument('--data_root', type=str, default='data', help='root of scene data.')
+    parser.add_argument('--depth', type=str, nargs='*', default=['depths'],
+                        help='depth folders to check, e.g., depths rendered_depths.')
+    parser.add_argument('--skip_mask_ids', default=False, action='store_true',
+                        help='whether to skip checking image ids of mask records, which reads all pages.')
+    parser.add_argument('--num_workers', type=int, default=16, help='number of processes.')
+    parser.add_argument('--out', type=str, default=None,
+                        help='path to the json report, defaults to check_<dataset>_<split>.json.')
+    args = parser.parse_args()
+
+    list_dir = os.path.join(args.list_root, args.dataset)
+    pids = [val.strip() for val in read_list(os.path.join(list_dir, 'imageset_%s.txt' % args.split))
+            if val.strip() != '']
+    image_num = {}
+    for line in read_list(os.path.join(list_dir, 'image_index_offset.txt')):
+        if line.strip() != '':
+            pid, start, end = line.split()
+            image_num[pid] = int(end) - int(start)
+    configs = [(pid, image_num.get(pid), args.data_root, args.depth, not args.skip_mask_ids)
+               for pid in pids]
+
+    summaries = []
+    start_time = time.time()
+    pool = Pool(args.num_workers)
+    try:
+        for summary in pool.imap_unordered(check_scene, configs):
+            summaries.append(summary)
+            for issue in summary['issues']:
+                print('%s: %s %s, %s' % (summary['pid'], issue['kind'], issue['file'], issue['detail']))
+            if len(summaries) % 100 == 0:
+                print('[%d/%d] %.1f scenes/s' % (len(summaries), len(configs),
+                                                 len(summaries) / (time.time() - start_time)))
+    finally:
+        pool.close()
+        pool.join()
+
+    summaries.sort(key=lambda val: val['pid'])
+    issues = [dict(pid=val['pid'], **issue) for val in summaries for issue in val['issues']]
+    elapsed = time.time() - start_time
+    report = {'dataset': args.dataset, 'split': args.split, 'elapsed': elapsed,
+              'scenes': len(summaries), 'images': sum([val['image_num'] or 0 for val in summaries]),
+              'bad_scenes': sorted(set([val['pid'] for val in issues])), 'issues': issues,
+              'missing_offsets': [pid for pid in pids if pid not in image_num],
+              'summaries': summaries}
+    out_path = args.out if args.out is not None else 'check_%s_%s.json' % (args.dataset, args.split)
+    with open(out_path, 'w') as fout:
+        json.dump(report, fout, indent=2)
+    print('Checked %d scenes (%d images) in %.1fs, %d issues in %d scenes, report saved to %s.' %
+          (report['scenes'], report['images'], elapsed, len(issues), len(report['bad_scenes']), out_path))
+    if issues:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Convert corr.bin of a dataset split to the columnar layout.
+
+For each scene listed in list/<dataset>/imageset_<split>.txt, geolabel/corr.bin is converted to
+geolabel/corr.bin.cols/, which is read by corr_columns.CorrColumns.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utils.io import read_list
+from utils.corr_columns import COLUMNS, convert_corr
+
+
+def process_scene(config):
+    """Convert corr.bin of a scene.
+    Args:
+        config: (pid, data_root, dtypes, compress, chunk_rows).
+    Returns:
+        summary: a dictionary of the scene summary, or the error message.
+    """
+    pid, data_root, dtypes, compress, chunk_rows = config
+    start_time = time.time()
+    try:
+        corr_path = os.path.join(data_root, pid, 'geolabel', 'corr.bin')
+        out_dir = convert_corr(corr_path, dtypes=dtypes, compress=compress, chunk_rows=chunk_rows)
+        nbytes = sum([os.path.getsize(os.path.join(out_dir, val)) for val in os.listdir(out_dir)])
+        return {'pid': pid, 'src_bytes': os.path.getsize(corr_path), 'bytes': nbytes,
+                'time': time.time() - start_time}
+    except Exception as err:  # pylint: disable=broad-except
+        return {'pid': pid, 'error': '%s: %s' % (type(err).__name__, err)}
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--dataset', type=str, default='comb',
+                        help='dataset list, e.g., gl3d, tourism, blendedmvg, comb.')
+    parser.add_argument('--split', type=str, default='train', help='train, test or all.')
+    parser.add_argument('--list_root', type=str, default='list', help='root of dataset lists.')
+    parser.add_argument('--data_root', type=str, default='data', help='root of scene data.')
+    parser.add_argument('--dtype', type=str, action='append', default=[],
+                        help='column dtype overriding the lossless default, e.g., affine0=float16, repeatable.')
+    parser.add_argument('--compress', default=False, action='store_true',
+                        help='whether to compress chunks by zlib.')
+    parser.add_argument('--chunk_rows', type=int, default=65536, help='number of rows per chunk.')
+    parser.add_argument('--num_workers', type=int, default=8, help='number of processes.')
+    parser.add_argument('--overwrite', default=False, action='store_true',
+                        help='whether to reconvert converted scenes.')
+    args = parser.parse_args()
+
+    dtypes = dict(val.split('=') for val in args.dtype)
+    for key in dtypes:
+        if key not in COLUMNS:
+            parser.error('Unknown column %s.' % key)
+    pids = [val for val in read_list(os.path.join(args.list_root, args.dataset,
+                                                  'imageset_%s.txt' % args.split))
+            if val.strip() != '']
+    todo = [pid for pid in pids if args.overwrite or not os.path.exists(
+        os.path.join(args.data_root, pid, 'geolabel', 'corr.bin.cols', 'meta.json'))]
+    print('%d scenes, %d converted, %d to process.' % (len(pids), len(pids) - len(todo), len(todo)))
+
+    start_time = time.time()
+    failures = 0
+    src_bytes = 0
+    nbytes = 0
+    pool = Pool(args.num_workers)
+    try:
+        configs = [(pid, args.data_root, dtypes, args.compress, args.chunk_rows) for pid in todo]
+        for idx, summary in enumerate(pool.imap_unordered(process_scene, configs)):
+            if 'error' in summary:
+                failures += 1
+                print('[%d/%d] %s failed: %s' % (idx + 1, len(todo), summary['pid'], summary['error']))
+                continue
+            src_bytes += summary['src_bytes']
+            nbytes += summary['bytes']
+            print('[%d/%d] %s, %.1f MB to %.1f MB in %.2fs' %
+                  (idx + 1, len(todo), summary['pid'], summary['src_bytes'] / 1e6,
+                   summary['bytes'] / 1e6, summary['time']))
+    finally:
+        pool.close()
+        pool.join()
+    print('Converted %d scenes (%.1f GB to %.1f GB) in %.1fs, %d failed.' %
+          (len(todo) - failures, src_bytes / 1e9, nbytes / 1e9, time.time() - start_time, failures))
+
+
+if __name__ == '__main__':
+    main()
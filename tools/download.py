@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Parallel, resumable downloader of dataset chunks.
+
+The archive of a data name is split into chunks, <base_url>/<name>/<name>.tar.<idx>, listed with
+their SHA1 in <base_url>/<name>/sha1sum.txt. Chunks are downloaded by a pool of workers, resumed by
+range requests from partial <chunk>.part files, and verified while streaming. Optionally, the
+archive is extracted in a streaming pipeline while chunks are downloaded, reading chunks in order
+without concatenating them, and only members of given scene pids are extracted. Once all members
+overlapping a chunk are extracted, the chunk is marked by <chunk>.done and optionally removed, so
+that a rerun resumes the extraction after the chunks marked, without downloading them again.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import hashlib
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utils.io import read_list
+
+BASE_URL = 'http://research.altizure.com/data/gl3d_v2'
+BLOCK_SIZE = 1 << 20
+# seconds of the first retry wait, doubled on each retry.
+RETRY_WAIT = 1.
+
+
+def chunk_name(name, idx):
+    return '%s.tar.%03d' % (name, idx)
+
+
+def read_sha1sums(text):
+    """Parse sha1sum.txt.
+    Returns:
+        sha1sums: a dictionary of SHA1 indexed by file name.
+    """
+    sha1sums = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            sha1sums[os.path.basename(fields[1].lstrip('*'))] = fields[0].lower()
+    return sha1sums
+
+
+def fetch_text(url, timeout=60):
+    with urlopen(url, timeout=timeout) as response:
+        return response.read().decode('UTF-8')
+
+
+def _hash_file(path, sha1):
+    with open(path, 'rb') as fin:
+        while True:
+            block = fin.read(BLOCK_SIZE)
+            if not block:
+                break
+            sha1.update(block)
+    return sha1
+
+
+def download_chunk(url, path, sha1sum=None, retries=3, timeout=60):
+    """Download a file, resuming from <path>.part by a range request.
+    Args:
+        url: file url.
+        path: output path, which only exists once the download is complete and verified.
+        sha1sum: expected SHA1, not verified if None.
+        retries: number of retries on errors or SHA1 mismatch.
+    Returns:
+        nbytes: bytes downloaded in this call.
+    """
+    if os.path.exists(path):
+        if sha1sum is None or _hash_file(path, hashlib.sha1()).hexdigest() == sha1sum:
+            return 0
+        os.remove(path)
+    part_path = path + '.part'
+    nbytes = 0
+    for attempt in range(retries + 1):
+        try:
+            # hash the partial file, then keep hashing while streaming the rest.
+            sha1 = hashlib.sha1()
+            offset = 0
+            if os.path.exists(part_path):
+                _hash_file(part_path, sha1)
+                offset = os.path.getsize(part_path)
+            request = Request(url, headers={'Range': 'bytes=%d-' % offset} if offset > 0 else {})
+            try:
+                response = urlopen(request, timeout=timeout)
+            except HTTPError as err:
+                if err.code != 416:
+                    raise
+                # the partial file is already complete.
+                response = None
+            if response is not None:
+                with response:
+                    if offset > 0 and response.status != 206:
+                        # range requests are not supported, restart.
+                        sha1 = hashlib.sha1()
+                        offset = 0
+                    with open(part_path, 'ab' if offset > 0 else 'wb') as fout:
+                        while True:
+                            block = response.read(BLOCK_SIZE)
+                            if not block:
+                                break
+                            fout.write(block)
+                            sha1.update(block)
+                            nbytes += len(block)
+            if sha1sum is not None and sha1.hexdigest() != sha1sum:
+                os.remove(part_path)
+                raise IOError('SHA1 mismatch of %s.' % url)
+            os.rename(part_path, path)
+            return nbytes
+        except (IOError, OSError):
+            if attempt == retries:
+                raise
+            time.sleep(min(RETRY_WAIT * 2 ** attempt, 30))
+    return nbytes
+
+
+class ChunkReader(object):
+    """File-like reader of chunks in order, which waits for chunks being downloaded."""
+
+    def __init__(self, paths, events, start=0, skip=0):
+        """
+        Args:
+            paths: chunk paths in order.
+            events: threading.Event of each chunk, set when the chunk is ready or failed.
+            start: archive offset of the first chunk.
+            skip: bytes of the first chunk to skip, i.e., the stream starts at start + skip.
+        """
+        self.paths = paths
+        self.events = events
+        self.start = start
+        self.skip = skip
+        # archive offsets of the ends of chunks opened so far.
+        self.ends = []
+        self.failed = set()
+        self._idx = -1
+        self._fin = None
+
+    def _next(self):
+        if self._fin is not None:
+            self._fin.close()
+        self._idx += 1
+        self._fin = None
+        if self._idx < len(self.paths):
+            self.events[self._idx].wait()
+            if self._idx in self.failed:
+                raise IOError('Failed to download %s.' % self.paths[self._idx])
+            self._fin = open(self.paths[self._idx], 'rb')
+            self.ends.append((self.ends[-1] if self.ends else self.start) +
+                             os.path.getsize(self.paths[self._idx]))
+            if self._idx == 0:
+                self._fin.seek(self.skip)
+
+    def read(self, size=-1):
+        if self._idx < 0:
+            self._next()
+        blocks = []
+        while self._fin is not None and (size < 0 or size > 0):
+            block = self._fin.read(size)
+            if not block:
+                self._next()
+                continue
+            blocks.append(block)
+            if size > 0:
+                size -= len(block)
+        return b''.join(blocks)
+
+    def close(self):
+        if self._fin is not None:
+            self._fin.close()
+            self._fin = None
+
+
+def member_filter(pids):
+    """Get the filter of archive members.
+    Args:
+        pids: scene pids to extract, or None for all.
+    """
+    pids = set(pids) if pids is not None else None
+
+    def _keep(member):
+        parts = member.name.replace('\\', '/').split('/')
+        if member.name.startswith('/') or '..' in parts:
+            return False
+        if not (member.isfile() or member.isdir()):
+            return False
+        return pids is None or len(pids.intersection(parts)) > 0
+    return _keep
+
+
+def extract_stream(fileobj, extract_dir, pids=None, progress=None):
+    """Extract a tar stream.
+    Args:
+        progress: function called with the stream offset before which all members are extracted.
+    Returns:
+        count: number of extracted members.
+    """
+    keep = member_filter(pids)
+    # members are also checked by the data filter where available, i.e., Python >= 3.8.17.
+    kwargs = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+    count = 0
+    with tarfile.open(fileobj=fileobj, mode='r|') as tar:
+        for member in tar:
+            if progress is not None:
+                # the offset of the first header of the member, e.g., of its long name.
+                progress(member.offset)
+            if keep(member):
+                tar.extract(member, extract_dir, **kwargs)
+                count += 1
+    return count
+
+
+def read_pids(list_paths):
+    pids = []
+    for list_path in list_paths:
+        pids.extend([val.strip() for val in read_list(list_path) if val.strip() != ''])
+    return pids
+
+
+def read_done(path, extract_dir, pids):
+    """Read the marker of a chunk extracted to extract_dir.
+    Returns:
+        done: a dictionary of the archive offsets of the chunk end, and of the member header to
+            resume the extraction from, or None if the chunk is not marked for the same extraction.
+    """
+    try:
+        with open(path + '.done') as fin:
+            done = json.load(fin)
+    except (IOError, OSError, ValueError):
+        return None
+    if done.get('extract_dir') != os.path.abspath(extract_dir) or \
+            done.get('pids') != (sorted(pids) if pids is not None else None):
+        return None
+    return done
+
+
+def download(name, out_dir, base_url=BASE_URL, chunks=None, num_workers=8, extract_dir=None,
+             pids=None, remove_chunks=False, retries=3):
+    """Download, verify and optionally extract the chunks of a data name.
+    Args:
+        name: data name, e.g., gl3d_imgs.
+        out_dir: directory of chunks.
+        base_url: base url.
+        chunks: chunk indices, defaults to all chunks listed in sha1sum.txt.
+        num_workers: number of concurrent downloads.
+        extract_dir: directory to extract the archive to, not extracted if None. The archive is
+            extracted as one stream, so chunks must start from 0.
+        pids: scene pids to extract, or None for all.
+        remove_chunks: whether to remove chunks once extracted.
+    Returns:
+        summary: a dictionary of the download summary.
+    """
+    if extract_dir is not None and chunks is not None and len(chunks) > 0 and chunks[0] != 0:
+        raise ValueError('Streaming extraction needs chunks from 0 onward, got %d.' % chunks[0])
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    url_dir = '%s/%s' % (base_url.rstrip('/'), name)
+    sha1_text = fetch_text(url_dir + '/sha1sum.txt')
+    with open(os.path.join(out_dir, 'sha1sum.txt'), 'w') as fout:
+        fout.write(sha1_text)
+    sha1sums = read_sha1sums(sha1_text)
+    if chunks is None:
+        chunks = sorted([int(val.rsplit('.', 1)[1]) for val in sha1sums
+                         if val.startswith(name + '.tar.')])
+    names = [chunk_name(name, idx) for idx in chunks]
+    missing = [val for val in names if val not in sha1sums]
+    if missing:
+        print('Warning: no SHA1 of %s, not verified.' % ', '.join(missing))
+    paths = [os.path.join(out_dir, val) for val in names]
+    done = os.path.join(extract_dir, '_EXTRACTED_' + name) if extract_dir is not None else None
+
+    # chunks already extracted by a previous run are neither downloaded nor read again.
+    skipped = 0
+    start, skip = 0, 0
+    if extract_dir is not None:
+        while skipped < len(paths):
+            marker = read_done(paths[skipped], extract_dir, pids)
+            if marker is None:
+                break
+            start, skip = marker['end'], marker['resume'] - marker['end']
+            skipped += 1
+        if skipped > 0:
+            print('%d chunks already extracted, resuming from %s.' %
+                  (skipped, names[skipped] if skipped < len(names) else 'the end'))
+    names, paths = names[skipped:], paths[skipped:]
+    events = [threading.Event() for _ in names]
+    reader = ChunkReader(paths, events, start, skip)
+    # chunks before which all members are extracted.
+    released = [0]
+
+    def _release(offset, last=False):
+        """Mark chunks ending before an archive offset, or all chunks if last, as extracted."""
+        while released[0] < len(paths):
+            if released[0] < len(reader.ends):
+                end = reader.ends[released[0]]
+            elif last:
+                # not read, as the archive ended before the chunk.
+                end = reader.ends[-1] if reader.ends else start
+            else:
+                break
+            if end > offset and not last:
+                break
+            path = paths[released[0]]
+            with open(path + '.done', 'w') as fout:
+                json.dump({'end': end, 'resume': offset, 'extract_dir': os.path.abspath(extract_dir),
+                           'pids': sorted(pids) if pids is not None else None}, fout)
+            if remove_chunks and os.path.exists(path):
+                os.remove(path)
+            released[0] += 1
+
+    start_time = time.time()
+    stats = {'bytes': 0, 'chunks': 0, 'failures': []}
+    lock = threading.Lock()
+
+    def _download(idx):
+        try:
+            nbytes = download_chunk('%s/%s' % (url_dir, names[idx]), paths[idx],
+                                    sha1sums.get(names[idx]), retries)
+            with lock:
+                stats['bytes'] += nbytes
+                stats['chunks'] += 1
+                elapsed = time.time() - start_time
+                print('[%d/%d] %s, %.1f MB/s' % (stats['chunks'], len(names), names[idx],
+                                                 stats['bytes'] / elapsed / 1e6))
+        except Exception as err:  # pylint: disable=broad-except
+            with lock:
+                reader.failed.add(idx)
+                stats['failures'].append({'chunk': names[idx], 'error': '%s: %s' % (type(err).__name__, err)})
+                print('%s failed: %s' % (names[idx], err))
+        finally:
+            events[idx].set()
+
+    extracted = None
+    with ThreadPoolExecutor(num_workers) as executor:
+        for idx in range(len(names)):
+            executor.submit(_download, idx)
+        if extract_dir is not None and not os.path.exists(done) and paths:
+            # extracted while later chunks are being downloaded.
+            try:
+                extracted = extract_stream(reader, extract_dir, pids,
+                                           lambda offset: _release(start + skip + offset))
+                _release(reader.ends[-1] if reader.ends else start, last=True)
+                with open(done, 'w') as fout:
+                    fout.write('%d\n' % extracted)
+            except (IOError, OSError, tarfile.TarError) as err:
+                stats['failures'].append({'chunk': None, 'error': 'extraction: %s' % err})
+                print('Extraction failed: %s' % err)
+            finally:
+                reader.close()
+
+    return {'name': name, 'chunks': stats['chunks'], 'skipped': skipped, 'bytes': stats['bytes'],
+            'extracted': extracted, 'failures': stats['failures'],
+            'elapsed': time.time() - start_time}
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('name', type=str, help='data name, e.g., gl3d_imgs, gl3d_depths.')
+    parser.add_argument('--out_dir', type=str, default=None,
+                        help='directory of chunks, defaults to download_data_<name>.')
+    parser.add_argument('--base_url', type=str, default=BASE_URL, help='base url of data.')
+    parser.add_argument('--start', type=int, default=None, help='first chunk index.')
+    parser.add_argument('--end', type=int, default=None, help='last chunk index, inclusive.')
+    parser.add_argument('--num_workers', type=int, default=8, help='number of concurrent downloads.')
+    parser.add_argument('--extract_dir', type=str, default=None,
+                        help='directory to extract the archive to, e.g., ., not extracted if unset.')
+    parser.add_argument('--pid_list', type=str, action='append', default=[],
+                        help='only extract scenes listed, e.g., list/comb/imageset_train.txt, repeatable.')
+    parser.add_argument('--remove_chunks', default=False, action='store_true',
+                        help='whether to remove chunks once extracted.')
+    parser.add_argument('--retries', type=int, default=3, help='number of retries per chunk.')
+    args = parser.parse_args()
+
+    chunks = None
+    if args.start is not None or args.end is not None:
+        if args.start is None or args.end is None:
+            parser.error('--start and --end must be given together.')
+        chunks = list(range(args.start, args.end + 1))
+        if args.extract_dir is not None and args.start != 0:
+            parser.error('--extract_dir needs chunks from 0 onward, since the archive is extracted '
+                         'as one stream; download later chunks first, then extract with --start 0.')
+    out_dir = args.out_dir if args.out_dir is not None else 'download_data_' + args.name
+    pids = read_pids(args.pid_list) if args.pid_list else None
+    summary = download(args.name, out_dir, args.base_url, chunks, args.num_workers,
+                       args.extract_dir, pids, args.remove_chunks, args.retries)
+    print('Downloaded %d chunks (%.1f GB) in %.1fs, %d failed, %d skipped as extracted before.' %
+          (summary['chunks'], summary['bytes'] / 1e9, summary['elapsed'], len(summary['failures']),
+           summary['skipped']))
+    if summary['extracted'] is not None:
+        print('Extracted %d members.' % summary['extracted'])
+    if summary['failures']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
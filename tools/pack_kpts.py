@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Pack the keypoint files of a dataset split into one array per scene.
+
+For each scene listed in list/<dataset>/imageset_<split>.txt, img_kpts/*.bin are merged into
+<data_root>/<pid>/img_kpts.packed.npy with an offset table, which is read by io.KeypointStore.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utils.io import pack_kpts, kpt_pack_current, read_list
+
+
+def process_scene(config):
+    """Pack the keypoints of a scene.
+    Args:
+        config: (pid, data_root, dtype).
+    Returns:
+        summary: a dictionary of the scene summary, or the error message.
+    """
+    pid, data_root, dtype = config
+    start_time = time.time()
+    try:
+        pack_prefix = pack_kpts(os.path.join(data_root, pid, 'img_kpts'), dtype=dtype)
+        return {'pid': pid, 'bytes': os.path.getsize(pack_prefix + '.npy'),
+                'time': time.time() - start_time}
+    except Exception as err:  # pylint: disable=broad-except
+        return {'pid': pid, 'error': '%s: %s' % (type(err).__name__, err)}
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--dataset', type=str, default='comb',
+                        help='dataset list, e.g., gl3d, tourism, blendedmvg, comb.')
+    parser.add_argument('--split', type=str, default='train', help='train, test or all.')
+    parser.add_argument('--list_root', type=str, default='list', help='root of dataset lists.')
+    parser.add_argument('--data_root', type=str, default='data', help='root of scene data.')
+    parser.add_argument('--dtype', type=str, default='float32', choices=['float32', 'float16', 'uint16'],
+                        help='storage type, uint16 for quantization with per-column ranges.')
+    parser.add_argument('--num_workers', type=int, default=8, help='number of processes.')
+    parser.add_argument('--overwrite', default=False, action='store_true',
+                        help='whether to repack packed scenes.')
+    args = parser.parse_args()
+
+    pids = [val for val in read_list(os.path.join(args.list_root, args.dataset,
+                                                  'imageset_%s.txt' % args.split))
+            if val.strip() != '']
+    todo = [pid for pid in pids if args.overwrite or not kpt_pack_current(
+        os.path.join(args.data_root, pid, 'img_kpts'))]
+    print('%d scenes, %d packed and current, %d to process.' % (len(pids), len(pids) - len(todo), len(todo)))
+
+    start_time = time.time()
+    failures = 0
+    pool = Pool(args.num_workers)
+    try:
+        for idx, summary in enumerate(pool.imap_unordered(
+                process_scene, [(pid, args.data_root, args.dtype) for pid in todo])):
+            if 'error' in summary:
+                failures += 1
+                print('[%d/%d] %s failed: %s' % (idx + 1, len(todo), summary['pid'], summary['error']))
+            else:
+                print('[%d/%d] %s, %.1f MB in %.2fs' %
+                      (idx + 1, len(todo), summary['pid'], summary['bytes'] / 1e6, summary['time']))
+    finally:
+        pool.close()
+        pool.join()
+    print('Packed %d scenes in %.1fs, %d failed.' % (len(todo) - failures, time.time() - start_time,
+                                                     failures))
+
+
+if __name__ == '__main__':
+    main()
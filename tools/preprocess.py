@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Scene-level preprocessing into compact training shards.
+
+Each scene listed in list/<dataset>/imageset_<split>.txt is parsed once and written to
+<out_dir>/<pid>/ as .npy arrays with CSR-style offset tables, which can be memory-mapped for
+fast epoch reading:
+    cameras.npz                  image ids, K (Nx3x3), t (Nx3), R (Nx3x3), dist (Nx3), img_size (Nx2).
+    corr_pairs.npy               Mx2 image indices of matching records.
+    corr.npy, corr_offsets.npy   Lx15 float32 correspondences and (M+1) offsets.
+    kpts.npy, kpts_offsets.npy   Kx6 float32 keypoints and (N+1) offsets, with empty rows of images
+                                 without keypoint files, listed as missing_kpts in the summary.
+    depths.npy, depths_offsets.npy, depth_shapes.npy
+                                 flattened depth maps, (N+1) offsets and Nx2 depth map sizes.
+    _SUCCESS                     checkpoint of a finished scene, with summary in json.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+from multiprocessing import Pool
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utils.io import CorrFile, read_kpt, load_pfm, read_pfm_header, read_list
+from utils.camera import CameraSet
+
+
+def read_image_num(offset_path):
+    """Read the image number of each scene from image_index_offset.txt.
+    Returns:
+        image_num: a dictionary of image number indexed by pid.
+    """
+    image_num = {}
+    for line in read_list(offset_path):
+        if line.strip() == '':
+            continue
+        pid, start, end = line.split()
+        image_num[pid] = int(end) - int(start)
+    return image_num
+
+
+def write_csr(out_dir, name, arrays, dtype, width=None, counts=None):
+    """Concatenate arrays and write them with an offset table.
+    Args:
+        out_dir: output directory.
+        name: file prefix.
+        arrays: list of arrays, concatenated along the first axis.
+        dtype: data type.
+        width: row width of the data, if arrays are 2-d.
+        counts: row number of each array. If given, arrays can be an iterator, which is consumed
+            one array at a time, so that only one array is held in memory.
+    Returns:
+        nbytes: bytes written.
+    """
+    if counts is None:
+        counts = [val.shape[0] for val in arrays]
+    counts = np.array(counts, dtype=np.int64).reshape(-1)
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    shape = (int(offsets[-1]), width) if width is not None else (int(offsets[-1]),)
+    data = np.lib.format.open_memmap(os.path.join(out_dir, name + '.npy'), mode='w+',
+                                     dtype=dtype, shape=shape)
+    for idx, val in enumerate(arrays):
+        data[offsets[idx]:offsets[idx + 1]] = val
+    data.flush()
+    del data
+    np.save(os.path.join(out_dir, name + '_offsets.npy'), offsets)
+    return int(offsets[-1]) * np.dtype(dtype).itemsize * (width or 1)
+
+
+def process_scene(config):
+    """Parse a scene and write its shard.
+    Args:
+        config: (pid, image_num, data_root, out_dir, depth_dir).
+    Returns:
+        summary: a dictionary of the scene summary, or the error message.
+    """
+    pid, image_num, data_root, out_dir, depth_dir = config
+    scene_root = os.path.join(data_root, pid)
+    shard_dir = os.path.join(out_dir, pid)
+    tmp_dir = shard_dir + '.tmp'
+    start_time = time.time()
+    try:
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        basenames = [str(i).zfill(8) for i in range(image_num)]
+
+        cam_set = CameraSet.load(os.path.join(scene_root, 'geolabel', 'cameras.txt'))
+        np.savez(os.path.join(tmp_dir, 'cameras.npz'), ids=cam_set.ids, K=cam_set.K, t=cam_set.t,
+                 R=cam_set.R, dist=cam_set.dist, img_size=cam_set.img_size)
+
+        corr_path = os.path.join(scene_root, 'geolabel', 'corr.bin')
+        corr_num = 0
+        if os.path.exists(corr_path):
+            corr_file = CorrFile(corr_path)
+            np.save(os.path.join(tmp_dir, 'corr_pairs.npy'), corr_file.pairs())
+            write_csr(tmp_dir, 'corr', [val[2] for val in corr_file], np.float32, 15)
+            corr_num = len(corr_file)
+
+        kpts = []
+        missing_kpts = []
+        for idx, val in enumerate(basenames):
+            kpt_path = os.path.join(scene_root, 'img_kpts', val + '.bin')
+            if os.path.exists(kpt_path):
+                kpts.append(read_kpt(kpt_path))
+            else:
+                kpts.append(np.zeros((0, 6), dtype=np.float32))
+                missing_kpts.append(idx)
+        write_csr(tmp_dir, 'kpts', kpts, np.float32, 6)
+
+        if depth_dir is not None:
+            depth_paths = [os.path.join(scene_root, depth_dir, val + '.pfm') for val in basenames]
+            # sizes are read from headers, and depth maps are loaded one at a time while writing.
+            depth_shapes = np.array([read_pfm_header(val)[0][0:2] for val in depth_paths],
+                                    dtype=np.int64).reshape(-1, 2)
+            np.save(os.path.join(tmp_dir, 'depth_shapes.npy'), depth_shapes)
+            write_csr(tmp_dir, 'depths', (np.ravel(load_pfm(val)) for val in depth_paths),
+                                np.float32, counts=np.prod(depth_shapes, axis=1))
+
+        bytes_written = sum([os.path.getsize(os.path.join(tmp_dir, val))
+                             for val in os.listdir(tmp_dir)])
+        summary = {'pid': pid, 'image_num': image_num, 'corr_num': corr_num,
+                   'missing_kpts': missing_kpts, 'bytes_written': bytes_written,
+                   'time': time.time() - start_time}
+        with open(os.path.join(tmp_dir, '_SUCCESS'), 'w') as fout:
+            json.dump(summary, fout)
+        if os.path.exists(shard_dir):
+            shutil.rmtree(shard_dir)
+        os.rename(tmp_dir, shard_dir)
+        return summary
+    except Exception as err:  # pylint: disable=broad-except
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return {'pid': pid, 'error': '%s: %s' % (type(err).__name__, err)}
+
+
+def is_done(out_dir, pid):
+    return os.path.exists(os.path.join(out_dir, pid, '_SUCCESS'))
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--dataset', type=str, default='comb',
+                        help='dataset list, e.g., gl3d, tourism, blendedmvg, comb.')
+    parser.add_argument('--split', type=str, default='train', help='train, test or all.')
+    parser.add_argument('--list_root', type=str, default='list', help='root of dataset lists.')
+    parser.add_argument('--data_root', type=str, default='data', help='root of scene data.')
+    parser.add_argument('--out_dir', type=str, required=True, help='output directory of shards.')
+    parser.add_argument('--depth', type=str, default='depths',
+                        help='depth folder, e.g., depths, rendered_depths, or none.')
+    parser.add_argument('--num_workers', type=int, default=8, help='number of processes.')
+    parser.add_argument('--overwrite', default=False, action='store_true',
+                        help='whether to reprocess finished scenes.')
+    args = parser.parse_args()
+
+    list_dir = os.path.join(args.list_root, args.dataset)
+    pids = [val for val in read_list(os.path.join(list_dir, 'imageset_%s.txt' % args.split))
+            if val.strip() != '']
+    image_num = read_image_num(os.path.join(list_dir, 'image_index_offset.txt'))
+    depth_dir = None if args.depth == 'none' else args.depth
+
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+    todo = [pid for pid in pids if args.overwrite or not is_done(args.out_dir, pid)]
+    print('%d scenes, %d finished, %d to process.' % (len(pids), len(pids) - len(todo), len(todo)))
+
+    configs = [(pid, image_num[pid], args.data_root, args.out_dir, depth_dir) for pid in todo
+               if pid in image_num]
+    summaries = []
+    failures = []
+    start_time = time.time()
+    image_count = 0
+    nbytes = 0
+    pool = Pool(args.num_workers)
+    try:
+        for summary in pool.imap_unordered(process_scene, configs):
+            if 'error' in summary:
+                failures.append(summary)
+                print('[%d/%d] %s failed: %s' %
+                      (len(summaries) + len(failures), len(configs), summary['pid'], summary['error']))
+                continue
+            summaries.append(summary)
+            image_count += summary['image_num']
+            nbytes += summary['bytes_written']
+            elapsed = time.time() - start_time
+            note = ', %d keypoint files missing' % len(summary['missing_kpts']) \
+                if summary['missing_kpts'] else ''
+            print('[%d/%d] %s, %d images in %.2fs%s; %.2f scenes/s, %.1f images/s, %.1f MB/s written' %
+                  (len(summaries) + len(failures), len(configs), summary['pid'],
+                   summary['image_num'], summary['time'], note, len(summaries) / elapsed,
+                   image_count / elapsed, nbytes / elapsed / 1e6))
+    finally:
+        pool.close()
+        pool.join()
+
+    elapsed = time.time() - start_time
+    report = {'dataset': args.dataset, 'split': args.split, 'elapsed': elapsed,
+              'scenes': len(summaries), 'images': image_count, 'bytes_written': nbytes,
+              'failures': failures, 'missing_offsets': [pid for pid in todo if pid not in image_num],
+              'summaries': summaries}
+    with open(os.path.join(args.out_dir, 'report_%s_%s.json' % (args.dataset, args.split)), 'w') as fout:
+        json.dump(report, fout, indent=2)
+    print('Processed %d scenes (%d images, %.1f GB written) in %.1fs, %d failed, %d with missing '
+          'keypoint files.' % (len(summaries), image_count, nbytes / 1e9, elapsed, len(failures),
+                              len([val for val in summaries if val['missing_kpts']])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Tests of download.py against a local stand-in of the data server.
+
+    python -m unittest discover -s tools -p 'test_*.py'
+"""
+
+from __future__ import print_function
+
+import os
+import io
+import sys
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import download
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serve files of server.files, with range requests unless server.no_range is set, and fail
+    the first server.fail_count requests of each path, and all requests of server.broken, with 503."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.headers.get('Range')))
+            failures = server.failures.get(self.path, 0)
+            if failures < server.fail_count or self.path in server.broken:
+                server.failures[self.path] = failures + 1
+                self.send_error(503)
+                return
+        data = server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header is not None and not server.no_range:
+            start = int(range_header.split('=')[1].split('-')[0])
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % len(data))
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+def make_archive(members):
+    """Make a tar archive of {name: bytes}."""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        for name, data in sorted(members.items()):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+class DownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.files = {}
+        self.server.requests = []
+        self.server.failures = {}
+        self.server.fail_count = 0
+        self.server.no_range = False
+        self.server.broken = set()
+        self.server.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.retry_wait = download.RETRY_WAIT
+        download.RETRY_WAIT = 0.01
+
+    def tearDown(self):
+        download.RETRY_WAIT = self.retry_wait
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def publish(self, name, archive, chunk_size):
+        """Split an archive into chunks served under /<name>/ with sha1sum.txt."""
+        lines = []
+        for idx, start in enumerate(range(0, len(archive), chunk_size)):
+            chunk = archive[start:start + chunk_size]
+            chunk_name = download.chunk_name(name, idx)
+            self.server.files['/%s/%s' % (name, chunk_name)] = chunk
+            lines.append('%s  %s' % (hashlib.sha1(chunk).hexdigest(), chunk_name))
+        self.server.files['/%s/sha1sum.txt' % name] = ('\n'.join(lines) + '\n').encode('UTF-8')
+        return len(lines)
+
+    def test_resume_by_range(self):
+        data = os.urandom(100000)
+        self.server.files['/x/a.bin'] = data
+        path = os.path.join(self.tmp_dir, 'a.bin')
+        with open(path + '.part', 'wb') as fout:
+            fout.write(data[0:40000])
+        nbytes = download.download_chunk(self.base_url + '/x/a.bin', path, hashlib.sha1(data).hexdigest())
+        self.assertEqual(nbytes, 60000)
+        self.assertEqual(self.server.requests[-1][1], 'bytes=40000-')
+        with open(path, 'rb') as fin:
+            self.assertEqual(fin.read(), data)
+        self.assertFalse(os.path.exists(path + '.part'))
+
+    def test_resume_without_range_support(self):
+        data = os.urandom(50000)
+        self.server.files['/x/a.bin'] = data
+        self.server.no_range = True
+        path = os.path.join(self.tmp_dir, 'a.bin')
+        with open(path + '.part', 'wb') as fout:
+            fout.write(data[0:10000])
+        download.download_chunk(self.base_url + '/x/a.bin', path, hashlib.sha1(data).hexdigest())
+        with open(path, 'rb') as fin:
+            self.assertEqual(fin.read(), data)
+
+    def test_size_mismatch(self):
+        data = os.urandom(30000)
+        self.server.files['/x/a.bin'] = data
+        path = os.path.join(self.tmp_dir, 'a.bin')
+        # a partial file longer than the remote file, from a different file of the same name.
+        with open(path + '.part', 'wb') as fout:
+            fout.write(os.urandom(40000))
+        download.download_chunk(self.base_url + '/x/a.bin', path, hashlib.sha1(data).hexdigest())
+        with open(path, 'rb') as fin:
+            self.assertEqual(fin.read(), data)
+        # a remote file shorter than expected never passes verification.
+        self.server.files['/x/b.bin'] = data[0:20000]
+        with self.assertRaises(IOError):
+            download.download_chunk(self.base_url + '/x/b.bin', os.path.join(self.tmp_dir, 'b.bin'),
+                                    hashlib.sha1(data).hexdigest(), retries=1)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, 'b.bin')))
+
+    def test_retry(self):
+        data = os.urandom(20000)
+        self.server.files['/x/a.bin'] = data
+        self.server.fail_count = 2
+        path = os.path.join(self.tmp_dir, 'a.bin')
+        download.download_chunk(self.base_url + '/x/a.bin', path, hashlib.sha1(data).hexdigest(), retries=2)
+        with open(path, 'rb') as fin:
+            self.assertEqual(fin.read(), data)
+        self.assertEqual(len([val for val in self.server.requests if val[0] == '/x/a.bin']), 3)
+
+        self.server.files['/x/b.bin'] = data
+        with self.assertRaises(IOError):
+            download.download_chunk(self.base_url + '/x/b.bin', os.path.join(self.tmp_dir, 'b.bin'),
+                                    retries=1)
+
+    def test_download_and_extract(self):
+        members = {'pid0/geolabel/cameras.txt': b'0 1 2\n', 'pid1/img_kpts/00000000.bin': os.urandom(24000),
+                   'pid2/depths/00000000.pfm': os.urandom(5000)}
+        num_chunks = self.publish('gl3d_test', make_archive(members), 4096)
+        out_dir = os.path.join(self.tmp_dir, 'chunks')
+        extract_dir = os.path.join(self.tmp_dir, 'data')
+        os.makedirs(extract_dir)
+        summary = download.download('gl3d_test', out_dir, self.base_url, num_workers=4,
+                                    extract_dir=extract_dir, pids=['pid1', 'pid2'], remove_chunks=True)
+        self.assertEqual(summary['failures'], [])
+        self.assertEqual(summary['chunks'], num_chunks)
+        for name, data in members.items():
+            path = os.path.join(extract_dir, name)
+            if name.startswith('pid0'):
+                self.assertFalse(os.path.exists(path))
+                continue
+            with open(path, 'rb') as fin:
+                self.assertEqual(fin.read(), data)
+        self.assertEqual([val for val in os.listdir(out_dir) if '.tar.' in val and
+                          not val.endswith('.done')], [])
+
+    def test_resume_extraction(self):
+        members = {'pid%d/depths/00000000.pfm' % i: os.urandom(3000 + 1000 * i) for i in range(6)}
+        num_chunks = self.publish('gl3d_test', make_archive(members), 2048)
+        out_dir = os.path.join(self.tmp_dir, 'chunks')
+        extract_dir = os.path.join(self.tmp_dir, 'data')
+        os.makedirs(extract_dir)
+        broken = '/gl3d_test/%s' % download.chunk_name('gl3d_test', 6)
+        self.server.broken.add(broken)
+        summary = download.download('gl3d_test', out_dir, self.base_url, num_workers=4,
+                                    extract_dir=extract_dir, remove_chunks=True, retries=0)
+        self.assertEqual(len(summary['failures']), 2)
+        marked = sorted([val for val in os.listdir(out_dir) if val.endswith('.done')])
+        self.assertTrue(0 < len(marked) < 6)
+        for val in marked:
+            self.assertFalse(os.path.exists(os.path.join(out_dir, val[:-len('.done')])))
+
+        self.server.broken.clear()
+        del self.server.requests[:]
+        summary = download.download('gl3d_test', out_dir, self.base_url, num_workers=4,
+                                    extract_dir=extract_dir, remove_chunks=True)
+        self.assertEqual(summary['failures'], [])
+        self.assertEqual(summary['skipped'], len(marked))
+        self.assertEqual(summary['chunks'], num_chunks - len(marked))
+        requested = set([val[0] for val in self.server.requests])
+        for val in marked:
+            self.assertNotIn('/gl3d_test/' + val[:-len('.done')], requested)
+        for name, data in members.items():
+            with open(os.path.join(extract_dir, name), 'rb') as fin:
+                self.assertEqual(fin.read(), data)
+        self.assertEqual([val for val in os.listdir(out_dir) if not val.endswith('.done')],
+                         ['sha1sum.txt'])
+
+        # nothing is downloaded once all chunks are extracted.
+        del self.server.requests[:]
+        summary = download.download('gl3d_test', out_dir, self.base_url, extract_dir=extract_dir)
+        self.assertEqual((summary['chunks'], summary['skipped']), (0, num_chunks))
+        self.assertEqual([val[0] for val in self.server.requests], ['/gl3d_test/sha1sum.txt'])
+
+    def test_extract_needs_first_chunk(self):
+        with self.assertRaises(ValueError):
+            download.download('gl3d_test', os.path.join(self.tmp_dir, 'chunks'), self.base_url,
+                              chunks=[1, 2], extract_dir=self.tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Undistort keypoints of a dataset split once and cache them next to img_kpts/.
+
+For each scene listed in list/<dataset>/imageset_<split>.txt, all keypoint files are undistorted
+in one batched call, and written to <data_root>/<pid>/<out_name>/ in the format of img_kpts/,
+so that they can be read by io.read_kpt as is. A scene is written to a temporary folder and
+renamed when finished, so that interrupted runs can be resumed.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+from multiprocessing import Pool
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utils.io import read_kpt, read_list
+from utils.camera import CameraSet
+
+
+def process_scene(config):
+    """Undistort the keypoints of a scene.
+    Args:
+        config: (pid, data_root, out_name, num_iters).
+    Returns:
+        summary: a dictionary of the scene summary, or the error message.
+    """
+    pid, data_root, out_name, num_iters = config
+    scene_root = os.path.join(data_root, pid)
+    out_dir = os.path.join(scene_root, out_name)
+    tmp_dir = out_dir + '.tmp'
+    start_time = time.time()
+    try:
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        cam_set = CameraSet.load(os.path.join(scene_root, 'geolabel', 'cameras.txt'))
+        kpt_dir = os.path.join(scene_root, 'img_kpts')
+        file_names = sorted([val for val in os.listdir(kpt_dir) if val.endswith('.bin')])
+        kpts = [read_kpt(os.path.join(kpt_dir, val)) for val in file_names]
+        img_idx = np.repeat([int(os.path.splitext(val)[0]) for val in file_names],
+                            [val.shape[0] for val in kpts])
+        offsets = np.concatenate([[0], np.cumsum([val.shape[0] for val in kpts])]).astype(np.int64)
+        if offsets[-1] > 0:
+            undist_kpts = cam_set.undistort(np.concatenate(kpts, axis=0), img_idx,
+                                            num_iters=num_iters).astype(np.float32)
+        else:
+            undist_kpts = np.zeros((0, 6), dtype=np.float32)
+        for idx, val in enumerate(file_names):
+            undist_kpts[offsets[idx]:offsets[idx + 1]].tofile(os.path.join(tmp_dir, val))
+        if os.path.exists(out_dir):
+            shutil.rmtree(out_dir)
+        os.rename(tmp_dir, out_dir)
+        return {'pid': pid, 'image_num': len(file_names), 'kpt_num': int(offsets[-1]),
+                'time': time.time() - start_time}
+    except Exception as err:  # pylint: disable=broad-except
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return {'pid': pid, 'error': '%s: %s' % (type(err).__name__, err)}
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--dataset', type=str, default='comb',
+                        help='dataset list, e.g., gl3d, tourism, blendedmvg, comb.')
+    parser.add_argument('--split', type=str, default='train', help='train, test or all.')
+    parser.add_argument('--list_root', type=str, default='list', help='root of dataset lists.')
+    parser.add_argument('--data_root', type=str, default='data', help='root of scene data.')
+    parser.add_argument('--out_name', type=str, default='undist_kpts',
+                        help='output folder name inside each scene.')
+    parser.add_argument('--num_iters', type=int, default=5, help='number of undistortion iterations.')
+    parser.add_argument('--num_workers', type=int, default=8, help='number of processes.')
+    parser.add_argument('--overwrite', default=False, action='store_true',
+                        help='whether to reprocess finished scenes.')
+    args = parser.parse_args()
+
+    list_dir = os.path.join(args.list_root, args.dataset)
+    pids = [val for val in read_list(os.path.join(list_dir, 'imageset_%s.txt' % args.split))
+            if val.strip() != '']
+    todo = [pid for pid in pids if args.overwrite or
+            not os.path.exists(os.path.join(args.data_root, pid, args.out_name))]
+    print('%d scenes, %d finished, %d to process.' % (len(pids), len(pids) - len(todo), len(todo)))
+
+    configs = [(pid, args.data_root, args.out_name, args.num_iters) for pid in todo]
+    summaries = []
+    failures = []
+    start_time = time.time()
+    kpt_count = 0
+    pool = Pool(args.num_workers)
+    try:
+        for summary in pool.imap_unordered(process_scene, configs):
+            if 'error' in summary:
+                failures.append(summary)
+                print('[%d/%d] %s failed: %s' %
+                      (len(summaries) + len(failures), len(configs), summary['pid'], summary['error']))
+                continue
+            summaries.append(summary)
+            kpt_count += summary['kpt_num']
+            print('[%d/%d] %s, %d keypoints in %.2fs; %.1f M keypoints/s' %
+                  (len(summaries) + len(failures), len(configs), summary['pid'], summary['kpt_num'],
+                   summary['time'], kpt_count / (time.time() - start_time) / 1e6))
+    finally:
+        pool.close()
+        pool.join()
+
+    if failures:
+        print(json.dumps(failures, indent=2))
+    print('Undistorted %d scenes (%d keypoints) in %.1fs, %d failed.' %
+          (len(summaries), kpt_count, time.time() - start_time, len(failures)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""
+Copyright 2019, Zixin Luo, HKUST.
+On-disk cache of derived labels, e.g., results of geom.warp or undistorted keypoints.
+
+Entries are keyed by the hash of a name, the (path, size, mtime) of input files and parameters,
+so that results are recomputed only if inputs or parameters change. Each entry is a directory of
+.npy files, which can be memory-mapped, written to a temporary directory and renamed in place, so
+that concurrent writers never expose partial entries. Files are named by a token of the write kept in
+the meta file, so that readers never mix files of an entry replaced while being read.
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import uuid
+import shutil
+import hashlib
+
+import numpy as np
+
+
+def file_stamp(path):
+    """Get the (path, size, mtime) stamp of a file."""
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def _jsonable(val):
+    if isinstance(val, np.ndarray):
+        return val.tolist()
+    if isinstance(val, np.generic):
+        return val.item()
+    raise TypeError('Parameter of type %s is not hashable.' % type(val).__name__)
+
+
+class LabelCache(object):
+    """Size-capped LRU cache of arrays on disk."""
+
+    META = 'meta.json'
+    # fraction of max_bytes to evict down to once the cap is exceeded.
+    LOW_WATER = 0.9
+
+    def __init__(self, cache_dir, max_bytes=None, mmap=True, scan_interval=100):
+        """
+        Args:
+            cache_dir: cache directory.
+            max_bytes: size cap, least recently used entries are evicted beyond it. No cap if None.
+            mmap: whether to memory-map cached arrays.
+            scan_interval: number of puts after which the cache directory is rescanned for the cap,
+                to account for entries of other processes. Otherwise, it is only scanned once the
+                size estimate of this process exceeds max_bytes.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.mmap = mmap
+        self.scan_interval = scan_interval
+        # estimated cache size, i.e., the size of the last scan plus bytes put since.
+        self._nbytes = None
+        self._puts = 0
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, name, inputs=(), params=None):
+        """Compute the key of an entry.
+        Args:
+            name: name of the derived product, e.g., 'warp'.
+            inputs: paths of input files.
+            params: json-serializable parameters, e.g., {'depth_thld': 0.05}.
+        Returns:
+            key: hex digest.
+        """
+        desc = {'name': name, 'inputs': [file_stamp(val) for val in inputs], 'params': params}
+        desc = json.dumps(desc, sort_keys=True, default=_jsonable)
+        return hashlib.sha1(desc.encode('UTF-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[0:2], key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self._path(key), self.META))
+
+    def get(self, key, default=None):
+        """Get an entry.
+        Returns:
+            result: the cached array, tuple or dictionary of arrays, or default if not cached.
+        """
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, self.META)) as fin:
+                meta = json.load(fin)
+            # entries without a token are of earlier versions.
+            prefix = meta['token'] + '_' if 'token' in meta else ''
+            arrays = [np.load(os.path.join(path, '%s%d.npy' % (prefix, i)), mmap_mode='r' if self.mmap else None)
+                      for i in range(len(meta['names']))]
+        except (IOError, OSError, ValueError):
+            # missing, or evicted concurrently.
+            return default
+        try:
+            os.utime(os.path.join(path, self.META))
+        except OSError:
+            pass
+        if meta['kind'] == 'array':
+            return arrays[0]
+        if meta['kind'] == 'dict':
+            return dict(zip(meta['names'], arrays))
+        return tuple(arrays)
+
+    def put(self, key, result):
+        """Put an entry. If another writer has put the same key, its entry is kept.
+        Args:
+            result: an array, tuple or dictionary of arrays.
+        Raises:
+            TypeError: if an array is not numeric, e.g., None or an object array, which could not be
+                memory-mapped and would be recomputed on every get_or_compute.
+        """
+        if isinstance(result, dict):
+            kind, names, arrays = 'dict', list(result.keys()), list(result.values())
+        elif isinstance(result, (tuple, list)):
+            kind, names, arrays = 'tuple', list(range(len(result))), list(result)
+        else:
+            kind, names, arrays = 'array', [0], [result]
+        try:
+            arrays = [np.asarray(val) for val in arrays]
+        except ValueError as err:
+            # e.g., ragged sequences.
+            raise TypeError('Result is not numeric: %s' % err)
+        for name, val in zip(names, arrays):
+            if val.dtype.kind not in 'biufc':
+                raise TypeError('Result %s of dtype %s is not numeric.' % (name, val.dtype))
+        path = self._path(key)
+        token = uuid.uuid4().hex[:8]
+        tmp_path = '%s.tmp.%d.%s' % (path, os.getpid(), token)
+        os.makedirs(tmp_path)
+        try:
+            nbytes = 0
+            for i, val in enumerate(arrays):
+                np.save(os.path.join(tmp_path, '%s_%d.npy' % (token, i)), val)
+                nbytes += val.nbytes
+            with open(os.path.join(tmp_path, self.META), 'w') as fout:
+                json.dump({'kind': kind, 'names': names, 'nbytes': nbytes, 'token': token}, fout)
+            try:
+                os.rename(tmp_path, path)
+            except OSError:
+                # the entry exists, written by a concurrent writer.
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        if self.max_bytes is not None:
+            self._puts += 1
+            if self._nbytes is not None:
+                self._nbytes += nbytes
+            if self._nbytes is None or self._nbytes > self.max_bytes or \
+                    self._puts >= self.scan_interval:
+                # evicted below the cap, so that a full cache is not rescanned on every put.
+                self.evict(self.max_bytes if self._nbytes is None or self._nbytes <= self.max_bytes
+                           else int(self.max_bytes * self.LOW_WATER))
+
+    def get_or_compute(self, fn, name, inputs=(), params=None):
+        """Get an entry, or compute and put it.
+        Args:
+            fn: function computing the result without arguments.
+            name, inputs, params: see key.
+        Returns:
+            result: the cached result, memory-mapped if enabled, or the computed result.
+        Raises:
+            TypeError: if the computed result is not numeric, see put.
+        """
+        key = self.key(name, inputs, params)
+        result = self.get(key)
+        if result is None:
+            result = fn()
+            self.put(key, result)
+        return result
+
+    def entries(self):
+        """List entries.
+        Returns:
+            entries: list of (last access time, bytes, key), sorted from the least recently used.
+        """
+        entries = []
+        for sub_dir in os.listdir(self.cache_dir):
+            sub_path = os.path.join(self.cache_dir, sub_dir)
+            if not os.path.isdir(sub_path):
+                continue
+            for key in os.listdir(sub_path):
+                meta_path = os.path.join(sub_path, key, self.META)
+                if '.' in key or not os.path.exists(meta_path):
+                    continue
+                try:
+                    nbytes = sum([os.path.getsize(os.path.join(sub_path, key, val))
+                                  for val in os.listdir(os.path.join(sub_path, key))])
+                    entries.append((os.path.getmtime(meta_path), nbytes, key))
+                except OSError:
+                    continue
+        return sorted(entries)
+
+    def remove(self, key):
+        """Remove an entry, which is renamed first so that readers never see partial entries."""
+        path = self._path(key)
+        trash_path = '%s.del.%d.%s' % (path, os.getpid(), uuid.uuid4().hex[:8])
+        try:
+            os.rename(path, trash_path)
+        except OSError:
+            return
+        shutil.rmtree(trash_path, ignore_errors=True)
+
+    def evict(self, max_bytes):
+        """Evict least recently used entries until the cache is within max_bytes.
+        Returns:
+            nbytes: bytes of the remaining entries.
+        """
+        entries = self.entries()
+        nbytes = sum([val[1] for val in entries])
+        for _, size, key in entries:
+            if nbytes <= max_bytes:
+                break
+            self.remove(key)
+            nbytes -= size
+        self._nbytes = nbytes
+        self._puts = 0
+        return nbytes
+
+    def clear(self):
+        for _, _, key in self.entries():
+            self.remove(key)
+        self._nbytes = 0
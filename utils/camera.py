@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Camera tools.
+"""
+
+from __future__ import print_function
+
+import os
+import numpy as np
+
+from .geom import undist_points_batch
+from .profiler import profiled, add_bytes_read
+
+
+class CameraSet(object):
+    """Columnar store of the cameras of a scene, parsed from cameras.txt.
+
+    Attributes:
+        ids: N image indices.
+        K, K_inv: Nx3x3 intrinsic matrices and their inverses.
+        t: Nx3 translation vectors.
+        R: Nx3x3 rotation matrices.
+        dist: Nx3 radial distortion.
+        img_size: Nx2 image size (width, height).
+        centers: Nx3 camera centers.
+    """
+
+    def __init__(self, data):
+        """
+        Args:
+            data: Nx23 camera table, with one line per image in the format of cameras.txt.
+        """
+        data = np.asarray(data, dtype=np.float64).reshape(-1, 23)
+        n = data.shape[0]
+        self.ids = data[:, 0].astype(np.int64)
+        self.K = np.zeros((n, 3, 3))
+        self.K[:, 0, 0] = data[:, 1]
+        self.K[:, 1, 1] = data[:, 2]
+        self.K[:, 0, 2] = data[:, 3]
+        self.K[:, 1, 2] = data[:, 4]
+        self.K[:, 0, 1] = data[:, 5]
+        self.K[:, 2, 2] = 1
+        self.t = np.ascontiguousarray(data[:, 6:9])
+        self.R = np.ascontiguousarray(data[:, 9:18]).reshape(n, 3, 3)
+        self.dist = np.ascontiguousarray(data[:, 18:21])
+        self.img_size = np.ascontiguousarray(data[:, 21:23])
+        self.K_inv = np.linalg.inv(self.K) if n > 0 else np.zeros((0, 3, 3))
+        # center = -R^T * t
+        self.centers = -np.matmul(np.transpose(self.R, (0, 2, 1)), self.t[..., None])[..., 0]
+
+        self._identity_ids = bool(np.array_equal(self.ids, np.arange(n)))
+        self._id_order = np.argsort(self.ids, kind='stable')
+        self._sorted_ids = self.ids[self._id_order]
+
+    @classmethod
+    @profiled(path_arg=1)
+    def load(cls, cam_path, cache_path=None, save_cache=False):
+        """Load cameras.txt, or its binary sidecar if up to date.
+        Args:
+            cam_path: path to cameras.txt.
+            cache_path: path to the sidecar, defaults to <cam_path>.npz.
+            save_cache: whether to write the sidecar after parsing the text file.
+        Returns:
+            cam_set: CameraSet.
+        """
+        cache_path = cache_path if cache_path is not None else cam_path + '.npz'
+        file_size = os.path.getsize(cam_path)
+        mtime = os.path.getmtime(cam_path)
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cache:
+                if int(cache['file_size']) == file_size and float(cache['mtime']) == mtime:
+                    add_bytes_read(os.path.getsize(cache_path))
+                    return cls(cache['data'])
+        data = np.loadtxt(cam_path, dtype=np.float64, ndmin=2)
+        add_bytes_read(file_size)
+        if save_cache:
+            with open(cache_path, 'wb') as fout:
+                np.savez(fout, data=data, file_size=file_size, mtime=mtime)
+        return cls(data)
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    def index(self, img_idx):
+        """Get row positions of image indices.
+        Args:
+            img_idx: image indices, scalar or array.
+        Returns:
+            rows: row positions, -1 if the image does not exist.
+        """
+        img_idx = np.asarray(img_idx, dtype=np.int64)
+        if self._identity_ids:
+            return np.where((img_idx >= 0) & (img_idx < len(self)), img_idx, -1)
+        if len(self) == 0:
+            return np.full(img_idx.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted_ids, img_idx), len(self) - 1)
+        return np.where(self._sorted_ids[pos] == img_idx, self._id_order[pos], -1)
+
+    def _rows(self, img_idx):
+        rows = self.index(img_idx)
+        if np.any(rows < 0):
+            raise KeyError(np.asarray(img_idx)[rows < 0])
+        return rows
+
+    def __contains__(self, img_idx):
+        return bool(self.index(img_idx) >= 0)
+
+    def __getitem__(self, img_idx):
+        """Get a camera in the format of read_cams.
+        Returns:
+            (K, t, R, dist, img_size): K - 3x3, t - 3x1, R - 3x3, dist - 3, img_size - 2.
+        """
+        row = int(self._rows(img_idx))
+        return (self.K[row], self.t[row].reshape(3, 1), self.R[row], self.dist[row], self.img_size[row])
+
+    def relative_pose(self, idx0, idx1):
+        """Compute relative poses of image pairs, see geom.relative_pose.
+        Args:
+            idx0, idx1: M image indices.
+        Returns:
+            rel_R: Mx3x3 relative rotations.
+            rel_t: Mx3 relative translations.
+        """
+        rows0 = self._rows(idx0)
+        rows1 = self._rows(idx1)
+        R1 = self.R[rows1]
+        rel_R = np.matmul(R1, np.transpose(self.R[rows0], (0, 2, 1)))
+        rel_t = np.matmul(R1, (self.centers[rows0] - self.centers[rows1])[..., None])[..., 0]
+        return rel_R, rel_t
+
+    def get_essential_mat(self, idx0, idx1):
+        """Compute essential matrices of image pairs, see geom.get_essential_mat.
+        Args:
+            idx0, idx1: M image indices.
+        Returns:
+            e_mat: Mx3x3 essential matrices, normalized to unit Frobenius norm.
+        """
+        rel_R, rel_t = self.relative_pose(idx0, idx1)
+        dt_ssm = np.zeros(rel_R.shape)
+        dt_ssm[:, 0, 1] = -rel_t[:, 2]
+        dt_ssm[:, 0, 2] = rel_t[:, 1]
+        dt_ssm[:, 1, 0] = rel_t[:, 2]
+        dt_ssm[:, 1, 2] = -rel_t[:, 0]
+        dt_ssm[:, 2, 0] = -rel_t[:, 1]
+        dt_ssm[:, 2, 1] = rel_t[:, 0]
+        e_mat = np.matmul(dt_ssm, rel_R)
+        e_mat /= np.linalg.norm(e_mat.reshape(-1, 9), axis=1)[:, None, None]
+        return e_mat
+
+    @profiled()
+    def undistort(self, pts, img_idx, normalized=True, num_iters=5):
+        """Undistort points of many images in one call, see geom.undist_points_batch.
+        Args:
+            pts: Nx6 keypoints in normalized coordinates, or Nx2 pixel coordinates.
+            img_idx: N image indices of points, or a scalar for all points.
+            normalized: whether pts are keypoints in normalized coordinates.
+        Returns:
+            upts: undistorted points in the layout of pts.
+        """
+        rows = np.broadcast_to(self._rows(img_idx), (pts.shape[0],))
+        return undist_points_batch(pts, self.K, self.dist, rows,
+                                   self.img_size if normalized else None, num_iters)
+
+    def undist_grid(self, img_idx, step=4, num_iters=5):
+        """Build the undistortion lookup grid of a camera.
+        Returns:
+            grid: UndistortGrid.
+        """
+        row = int(self._rows(img_idx))
+        return UndistortGrid(self.K[row], self.dist[row], self.img_size[row], step, num_iters)
+
+
+class UndistortGrid(object):
+    """Precomputed undistortion of a camera on a regular pixel grid, looked up bilinearly.
+
+    Points out of the image are linearly extrapolated from the border cells.
+    """
+
+    def __init__(self, K, dist, img_size, step=4, num_iters=5):
+        """
+        Args:
+            K: 3x3 intrinsics.
+            dist: 3-d radial distortion.
+            img_size: image size (width, height).
+            step: grid spacing in pixels.
+        """
+        self.img_size = np.asarray(img_size, dtype=np.float64)
+        self.step = float(step)
+        nx = int(np.ceil(self.img_size[0] / step)) + 1
+        ny = int(np.ceil(self.img_size[1] / step)) + 1
+        gx, gy = np.meshgrid(np.arange(nx) * self.step, np.arange(ny) * self.step)
+        nodes = np.stack([gx.ravel(), gy.ravel()], axis=-1)
+        self.grid = undist_points_batch(nodes, K, dist, num_iters=num_iters).reshape(ny, nx, 2)
+
+    def __call__(self, pts, normalized=False):
+        """Undistort points.
+        Args:
+            pts: Nx2 pixel coordinates, or Nx6 keypoints in normalized coordinates.
+            normalized: whether pts are keypoints in normalized coordinates.
+        Returns:
+            upts: undistorted points in the layout of pts.
+        """
+        hs = self.img_size / 2
+        if normalized:
+            u = pts[:, 2] * hs[0] + hs[0]
+            v = pts[:, 5] * hs[1] + hs[1]
+        else:
+            u, v = pts[:, 0], pts[:, 1]
+        ny, nx = self.grid.shape[0:2]
+        fu = np.asarray(u, dtype=np.float64) / self.step
+        fv = np.asarray(v, dtype=np.float64) / self.step
+        iu = np.clip(np.floor(fu), 0, nx - 2).astype(np.int64)
+        iv = np.clip(np.floor(fv), 0, ny - 2).astype(np.int64)
+        wu = (fu - iu)[:, None]
+        wv = (fv - iv)[:, None]
+        grid = self.grid
+        upts = (grid[iv, iu] * (1 - wu) + grid[iv, iu + 1] * wu) * (1 - wv) + \
+            (grid[iv + 1, iu] * (1 - wu) + grid[iv + 1, iu + 1] * wu) * wv
+        if normalized:
+            new_upts = pts.copy()
+            new_upts[:, 2] = (upts[:, 0] - hs[0]) / hs[0]
+            new_upts[:, 5] = (upts[:, 1] - hs[1]) / hs[1]
+            return new_upts
+        return upts
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Columnar, chunked layout of corr.bin.
+
+The correspondences of a corr.bin are split into typed columns, each stored as a file of chunks
+of a fixed number of rows, optionally compressed by zlib:
+    meta.json                    row number, chunk size, and dtype, width and chunk byte ranges
+                                 of each column.
+    pairs.npy, offsets.npy       Mx2 image indices of records and (M+1) row offsets of records.
+    <column>.bin                 column data.
+Columns:
+    pos0, pos1                   Lx2 keypoint positions, i.e., TRANSFORMATION[:, 2].
+    affine0, affine1             Lx4 remaining entries of TRANSFORMATION, in the order of
+                                 (0, 0), (0, 1), (1, 0), (1, 1).
+    geo_dist                     L geometric distance.
+    feat_idx                     Lx2 FEATURE_IDX0 and FEATURE_IDX1.
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import zlib
+import shutil
+
+import numpy as np
+
+from .io import CorrFile, hash_int_pairs
+
+# column: (corr.bin columns, default dtype)
+COLUMNS = {
+    'pos0': ([2, 5], 'float32'),
+    'affine0': ([0, 1, 3, 4], 'float32'),
+    'pos1': ([8, 11], 'float32'),
+    'affine1': ([6, 7, 9, 10], 'float32'),
+    'geo_dist': ([12], 'float32'),
+    'feat_idx': ([13, 14], 'int32'),
+}
+
+
+def convert_corr(corr_path, out_dir=None, dtypes=None, compress=False, chunk_rows=65536):
+    """Convert corr.bin to the columnar layout.
+    Args:
+        corr_path: path to corr.bin.
+        out_dir: output directory, defaults to <corr_path>.cols.
+        dtypes: a dictionary overriding default dtypes of COLUMNS, which are lossless, e.g.,
+            {'affine0': 'float16', 'affine1': 'float16'} to halve them at ~2.4e-4 relative error.
+        compress: whether to compress chunks by zlib.
+        chunk_rows: number of rows per chunk.
+    Returns:
+        out_dir: output directory.
+    """
+    out_dir = out_dir if out_dir is not None else corr_path + '.cols'
+    dtypes = dict((key, val[1]) for key, val in COLUMNS.items()) if dtypes is None else \
+        dict((key, dtypes.get(key, val[1])) for key, val in COLUMNS.items())
+    corr_file = CorrFile(corr_path)
+    tmp_dir = out_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    num = corr_file.num_corr()
+    offsets = np.concatenate([[0], np.cumsum(num)]).astype(np.int64)
+    np.save(os.path.join(tmp_dir, 'pairs.npy'), corr_file.pairs())
+    np.save(os.path.join(tmp_dir, 'offsets.npy'), offsets)
+
+    meta = {'num_rows': int(offsets[-1]), 'chunk_rows': chunk_rows, 'compress': compress,
+            'source_size': corr_file.file_size, 'columns': {}}
+    fouts = {}
+    for key, (cols, _) in COLUMNS.items():
+        meta['columns'][key] = {'dtype': np.dtype(dtypes[key]).str, 'width': len(cols), 'chunks': []}
+        fouts[key] = open(os.path.join(tmp_dir, key + '.bin'), 'wb')
+    buf = np.empty((min(chunk_rows, int(offsets[-1])), 15), dtype=np.float32)
+    try:
+        for start in range(0, int(offsets[-1]), chunk_rows):
+            end = min(start + chunk_rows, int(offsets[-1]))
+            # rows of a chunk may span several records.
+            first = int(np.searchsorted(offsets, start, side='right')) - 1
+            last = int(np.searchsorted(offsets, end, side='left'))
+            rows = buf[0:end - start]
+            for i in range(first, last):
+                # only the rows of the chunk are copied out of each record view.
+                row_start = max(start, int(offsets[i]))
+                row_end = min(end, int(offsets[i + 1]))
+                rows[row_start - start:row_end - start] = \
+                    corr_file[i][2][row_start - offsets[i]:row_end - offsets[i]]
+            for key, (cols, _) in COLUMNS.items():
+                column = meta['columns'][key]
+                data = rows[:, cols].astype(column['dtype'])
+                data = np.ascontiguousarray(data.ravel() if column['width'] == 1 else data).tobytes()
+                if compress:
+                    data = zlib.compress(data)
+                column['chunks'].append([fouts[key].tell(), len(data)])
+                fouts[key].write(data)
+    except BaseException:
+        for fout in fouts.values():
+            fout.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    for fout in fouts.values():
+        fout.close()
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as fout:
+        json.dump(meta, fout)
+
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.rename(tmp_dir, out_dir)
+    return out_dir
+
+
+class CorrColumns(object):
+    """Reader of the columnar layout, which only reads the columns and chunks requested."""
+
+    def __init__(self, col_dir):
+        """
+        Args:
+            col_dir: directory written by convert_corr.
+        """
+        self.col_dir = col_dir
+        with open(os.path.join(col_dir, 'meta.json')) as fin:
+            self.meta = json.load(fin)
+        self.pairs = np.load(os.path.join(col_dir, 'pairs.npy'))
+        self.offsets = np.load(os.path.join(col_dir, 'offsets.npy'))
+        self.chunk_rows = self.meta['chunk_rows']
+        self.columns = sorted(self.meta['columns'].keys())
+        self._maps = {}
+        self._cache = {}
+        keys = hash_int_pairs(self.pairs[:, 0], self.pairs[:, 1])
+        self._key_order = np.argsort(keys, kind='stable')
+        self._sorted_keys = keys[self._key_order]
+
+    def __len__(self):
+        return self.pairs.shape[0]
+
+    def num_corr(self):
+        """Correspondence number of each record."""
+        return np.diff(self.offsets)
+
+    def find(self, idx0, idx1):
+        """Find the record number of an image pair.
+        Returns:
+            record_idx: record number, or -1 if the pair does not exist.
+        """
+        key = hash_int_pairs(idx0, idx1)
+        pos = np.searchsorted(self._sorted_keys, key)
+        if pos < self._sorted_keys.shape[0] and self._sorted_keys[pos] == key:
+            return int(self._key_order[pos])
+        return -1
+
+    def _shape(self, name, num_rows):
+        width = self.meta['columns'][name]['width']
+        return (num_rows,) if width == 1 else (num_rows, width)
+
+    def _chunk(self, name, chunk_idx):
+        """Decode a compressed chunk, keeping the last decoded chunk of each column."""
+        cached = self._cache.get(name)
+        if cached is not None and cached[0] == chunk_idx:
+            return cached[1]
+        column = self.meta['columns'][name]
+        offset, nbytes = column['chunks'][chunk_idx]
+        with open(os.path.join(self.col_dir, name + '.bin'), 'rb') as fin:
+            fin.seek(offset)
+            data = zlib.decompress(fin.read(nbytes))
+        num_rows = min(self.chunk_rows, self.meta['num_rows'] - chunk_idx * self.chunk_rows)
+        data = np.frombuffer(data, dtype=column['dtype']).reshape(self._shape(name, num_rows))
+        self._cache[name] = (chunk_idx, data)
+        return data
+
+    def column(self, name, start=0, end=None):
+        """Read rows of a column.
+        Args:
+            name: column name, see COLUMNS.
+            start, end: row range, defaults to all rows.
+        Returns:
+            data: column data, a view of the mapped file if not compressed.
+        """
+        end = self.meta['num_rows'] if end is None else end
+        column = self.meta['columns'][name]
+        if not self.meta['compress']:
+            if name not in self._maps:
+                path = os.path.join(self.col_dir, name + '.bin')
+                if os.path.getsize(path) > 0:
+                    self._maps[name] = np.memmap(path, dtype=column['dtype'], mode='r',
+                                                 shape=self._shape(name, self.meta['num_rows']))
+                else:
+                    self._maps[name] = np.zeros(self._shape(name, 0), dtype=column['dtype'])
+            return self._maps[name][start:end]
+        if end <= start:
+            return np.zeros(self._shape(name, 0), dtype=column['dtype'])
+        chunks = []
+        for chunk_idx in range(start // self.chunk_rows, (end - 1) // self.chunk_rows + 1):
+            chunk_start = chunk_idx * self.chunk_rows
+            chunks.append(self._chunk(name, chunk_idx)[max(start - chunk_start, 0):end - chunk_start])
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks, axis=0)
+
+    def read(self, record_idx, columns=('pos0', 'pos1')):
+        """Read columns of a record.
+        Args:
+            record_idx: record number.
+            columns: column names.
+        Returns:
+            data: a dictionary of column data.
+        """
+        start, end = int(self.offsets[record_idx]), int(self.offsets[record_idx + 1])
+        return dict((name, self.column(name, start, end)) for name in columns)
+
+    def get_pair(self, idx0, idx1, columns=('pos0', 'pos1')):
+        """Read columns of an image pair, see read."""
+        record_idx = self.find(idx0, idx1)
+        if record_idx < 0:
+            raise KeyError((idx0, idx1))
+        return self.read(record_idx, columns)
+
+    def __getitem__(self, record_idx):
+        """Get a record in the layout of CorrFile.
+        Returns:
+            (idx0, idx1, corr): two image indices and Nx15 float32 match matrix.
+        """
+        data = self.read(record_idx, self.columns)
+        corr = np.empty((int(self.offsets[record_idx + 1] - self.offsets[record_idx]), 15),
+                        dtype=np.float32)
+        for name, (cols, _) in COLUMNS.items():
+            corr[:, cols] = data[name].reshape(corr.shape[0], -1)
+        idx0, idx1 = self.pairs[record_idx]
+        return int(idx0), int(idx1), corr
@@ -7,97 +7,80 @@ Geometry computations.
 from __future__ import print_function
 
 import numpy as np
-import cv2
 
+from .profiler import profiled
 
-def interpolate_depth(pos, depth):
-    ids = np.array(range(0, pos.shape[0]))
 
+@profiled()
+def interpolate_depth(pos, depth, dtype=None, out=None):
+    """Bilinearly interpolate depth values at valid positions.
+    Args:
+        pos: Nx2 (row, column) positions.
+        depth: HxW depth map.
+        dtype: computation type, e.g., np.float32, defaults to the promoted type of pos and depth.
+        out: optional buffer of at least N elements to hold the interpolated depth.
+    Returns:
+        interpolated_depth: M-d interpolated depth, a view of out if given.
+        pos: Mx2 valid positions, of which all four corners are inside the map and of positive depth.
+        ids: M-d indices of valid positions.
+    """
     h, w = depth.shape
+    if dtype is not None:
+        pos = pos.astype(dtype, copy=False)
+        depth = depth.astype(dtype, copy=False)
 
     i = pos[:, 0]
     j = pos[:, 1]
-
-    i_top_left = np.floor(i).astype(np.int32)
-    j_top_left = np.floor(j).astype(np.int32)
-    valid_top_left = np.logical_and(i_top_left >= 0, j_top_left >= 0)
-
-    i_top_right = np.floor(i).astype(np.int32)
-    j_top_right = np.ceil(j).astype(np.int32)
-    valid_top_right = np.logical_and(i_top_right >= 0, j_top_right < w)
-
-    i_bottom_left = np.ceil(i).astype(np.int32)
-    j_bottom_left = np.floor(j).astype(np.int32)
-    valid_bottom_left = np.logical_and(i_bottom_left < h, j_bottom_left >= 0)
-
-    i_bottom_right = np.ceil(i).astype(np.int32)
-    j_bottom_right = np.ceil(j).astype(np.int32)
-    valid_bottom_right = np.logical_and(i_bottom_right < h, j_bottom_right < w)
-
-    # Valid corner
-    valid_corner = np.logical_and(
-        np.logical_and(valid_top_left, valid_top_right),
-        np.logical_and(valid_bottom_left, valid_bottom_right)
-    )
-
-    i_top_left = i_top_left[valid_corner]
-    j_top_left = j_top_left[valid_corner]
-
-    i_top_right = i_top_right[valid_corner]
-    j_top_right = j_top_right[valid_corner]
-
-    i_bottom_left = i_bottom_left[valid_corner]
-    j_bottom_left = j_bottom_left[valid_corner]
-
-    i_bottom_right = i_bottom_right[valid_corner]
-    j_bottom_right = j_bottom_right[valid_corner]
-
-    ids = ids[valid_corner]
-
-    # Valid depth
-    valid_depth = np.logical_and(
-        np.logical_and(
-            depth[i_top_left, j_top_left] > 0,
-            depth[i_top_right, j_top_right] > 0
-        ),
-        np.logical_and(
-            depth[i_bottom_left, j_bottom_left] > 0,
-            depth[i_bottom_right, j_bottom_right] > 0
-        )
-    )
-
-    i_top_left = i_top_left[valid_depth]
-    j_top_left = j_top_left[valid_depth]
-
-    i_top_right = i_top_right[valid_depth]
-    j_top_right = j_top_right[valid_depth]
-
-    i_bottom_left = i_bottom_left[valid_depth]
-    j_bottom_left = j_bottom_left[valid_depth]
-
-    i_bottom_right = i_bottom_right[valid_depth]
-    j_bottom_right = j_bottom_right[valid_depth]
-
-    ids = ids[valid_depth]
+    i_top_left = np.floor(i)
+    j_top_left = np.floor(j)
+    dist_i_top_left = i - i_top_left
+    dist_j_top_left = j - j_top_left
+    # ceil, as top-left plus one for non-integral positions.
+    i_top_left = i_top_left.astype(np.intp)
+    j_top_left = j_top_left.astype(np.intp)
+    i_bottom_right = i_top_left + (dist_i_top_left > 0)
+    j_bottom_right = j_top_left + (dist_j_top_left > 0)
+
+    valid = (i_top_left >= 0) & (j_top_left >= 0) & (i_bottom_right < h) & (j_bottom_right < w)
+    # clip to gather all corners at once, positions out of bound are masked out below.
+    np.clip(i_top_left, 0, h - 1, out=i_top_left)
+    np.clip(j_top_left, 0, w - 1, out=j_top_left)
+    np.clip(i_bottom_right, 0, h - 1, out=i_bottom_right)
+    np.clip(j_bottom_right, 0, w - 1, out=j_bottom_right)
+
+    # flat indices of top-left, top-right, bottom-left and bottom-right corners.
+    corner_idx = np.empty((4, pos.shape[0]), dtype=np.intp)
+    np.multiply(i_top_left, w, out=corner_idx[0])
+    np.multiply(i_bottom_right, w, out=corner_idx[2])
+    corner_idx[1] = corner_idx[0]
+    corner_idx[3] = corner_idx[2]
+    corner_idx[0] += j_top_left
+    corner_idx[1] += j_bottom_right
+    corner_idx[2] += j_top_left
+    corner_idx[3] += j_bottom_right
+    corner_depth = np.take(np.ravel(depth), corner_idx)
+
+    # Valid corner and valid depth
+    valid &= np.all(corner_depth > 0, axis=0)
+    ids = np.flatnonzero(valid)
+    corner_depth = corner_depth[:, ids]
+    dist_i_top_left = dist_i_top_left[ids]
+    dist_j_top_left = dist_j_top_left[ids]
 
     # Interpolation
-    i = i[ids]
-    j = j[ids]
-    dist_i_top_left = i - i_top_left.astype(np.float32)
-    dist_j_top_left = j - j_top_left.astype(np.float32)
-    w_top_left = (1 - dist_i_top_left) * (1 - dist_j_top_left)
-    w_top_right = (1 - dist_i_top_left) * dist_j_top_left
-    w_bottom_left = dist_i_top_left * (1 - dist_j_top_left)
-    w_bottom_right = dist_i_top_left * dist_j_top_left
-
-    interpolated_depth = (
-        w_top_left * depth[i_top_left, j_top_left] +
-        w_top_right * depth[i_top_right, j_top_right] +
-        w_bottom_left * depth[i_bottom_left, j_bottom_left] +
-        w_bottom_right * depth[i_bottom_right, j_bottom_right]
-    )
-
-    pos = np.stack([i, j], axis=1)
+    res_dtype = np.result_type(dist_i_top_left, corner_depth)
+    if out is None:
+        interpolated_depth = np.empty(ids.shape[0], dtype=res_dtype)
+    else:
+        interpolated_depth = out[:ids.shape[0]]
+    w_i_top = 1 - dist_i_top_left
+    w_j_left = 1 - dist_j_top_left
+    np.multiply(w_i_top * w_j_left, corner_depth[0], out=interpolated_depth, casting='unsafe')
+    interpolated_depth += w_i_top * dist_j_top_left * corner_depth[1]
+    interpolated_depth += dist_i_top_left * w_j_left * corner_depth[2]
+    interpolated_depth += dist_i_top_left * dist_j_top_left * corner_depth[3]
+
+    pos = pos[ids]
     return [interpolated_depth, pos, ids]
 
 
@@ -134,7 +117,8 @@ def relative_pose(pose0, pose1):
     return [rel_R, rel_t]
 
 
-def warp(pos0, rel_pose, depth0, K0, depth1, K1):
+@profiled()
+def warp(pos0, rel_pose, depth0, K0, depth1, K1, depth_thld=0.05):
     def swap_axis(data):
         return np.stack([data[:, 1], data[:, 0]], axis=-1)
 
@@ -156,7 +140,7 @@ def warp(pos0, rel_pose, depth0, K0, depth1, K1):
     pos0 = pos0[new_ids]
     estimated_depth = xyz1.T[new_ids, -1]
 
-    inlier_mask = np.abs(estimated_depth - annotated_depth) < 0.05
+    inlier_mask = np.abs(estimated_depth - annotated_depth) < depth_thld
 
     ids = ids[inlier_mask]
     pos0 = pos0[inlier_mask]
@@ -164,29 +148,191 @@ def warp(pos0, rel_pose, depth0, K0, depth1, K1):
     return pos0, pos1, ids
 
 
-def undist_points(pts, K, dist, img_size=None):
-    n = pts.shape[0]
-    new_pts = pts
-    if img_size is not None:
-        hs = img_size / 2
-        new_pts = np.stack([pts[:, 2] * hs[0] + hs[0], pts[:, 5] * hs[1] + hs[1]], axis=1)
+def scale_intrinsics(K, ori_img_size, img_size):
+    """Rescale the intrinsic matrix to another image resolution.
+    Args:
+        K: 3x3 intrinsic matrix.
+        ori_img_size: original image size (width, height).
+        img_size: new image size (width, height).
+    Returns:
+        r_K: 3x3 rescaled intrinsic matrix.
+    """
+    r = np.asarray(ori_img_size, dtype=np.float64) / np.asarray(img_size, dtype=np.float64)
+    r_K = np.stack([K[0] / r[0], K[1] / r[1], K[2]], axis=0)
+    return r_K
+
+
+@profiled()
+def unproject_depth(pos, depth, K):
+    """Unproject positions with valid depth to 3D points.
+    Args:
+        pos: Nx2 (row, column) positions.
+        depth: HxW depth map.
+        K: 3x3 intrinsic matrix at the depth resolution.
+    Returns:
+        xyz: 3xM points in camera coordinates.
+        pos: Mx2 valid positions.
+        ids: M-d indices of valid positions.
+    """
+    z, pos, ids = interpolate_depth(pos, depth)
+    uv_homo = np.stack([pos[:, 1], pos[:, 0], np.ones(pos.shape[0])], axis=0)
+    xyz = np.matmul(np.linalg.inv(K), uv_homo) * z
+    return xyz, pos, ids
+
+
+@profiled()
+def warp_batch(src_idx, pairs, depths, cams, pos0=None, depth_thld=0.05,
+               cloud_cache=None, max_points=1 << 24):
+    """Warp a source depth map into many target views.
+    Args:
+        src_idx: source image index.
+        pairs: M target image indices.
+        depths: image index to HxW depth map, e.g., a dictionary.
+        cams: image index to (K, t, R, dist, img_size), as returned by read_cams.
+        pos0: Nx2 positions in the source depth map, defaults to all pixels.
+        depth_thld: threshold of depth consistency.
+        cloud_cache: optional dictionary to cache unprojected source points by src_idx, of which
+            the entries are only valid for the same pos0.
+        max_points: maximum number of points reprojected by one stacked matmul.
+    Returns:
+        pos0: Lx2 positions in the source depth map.
+        pos1: Lx2 positions in the target depth maps.
+        ids: L-d indices into pos0.
+        offsets: (M+1)-d offsets, results of pairs[k] are rows offsets[k] to offsets[k + 1].
+    """
+    def _get_K(idx, depth):
+        cam = cams[idx]
+        return scale_intrinsics(cam[0], cam[4], depth.shape[::-1])
 
-    new_dist = np.zeros((5), dtype=np.float32)
-    new_dist[0] = dist[0]
-    new_dist[1] = dist[1]
-    new_dist[4] = dist[2]
+    depth0 = depths[src_idx]
+    if cloud_cache is not None and src_idx in cloud_cache:
+        xyz0, pos0, ids0 = cloud_cache[src_idx]
+    else:
+        if pos0 is None:
+            pos0 = grid_positions(depth0.shape[0], depth0.shape[1])
+        xyz0, pos0, ids0 = unproject_depth(pos0, depth0, _get_K(src_idx, depth0))
+        if cloud_cache is not None:
+            cloud_cache[src_idx] = (xyz0, pos0, ids0)
+
+    cam0 = cams[src_idx]
+    rel_poses = [relative_pose([cam0[2], cam0[1]], [cams[i][2], cams[i][1]]) for i in pairs]
+    rel_R = np.array([val[0] for val in rel_poses]).reshape(-1, 3, 3)
+    rel_t = np.array([val[1] for val in rel_poses]).reshape(-1, 3, 1)
+
+    all_pos0, all_pos1, all_ids = [], [], []
+    offsets = np.zeros(len(pairs) + 1, dtype=np.int64)
+    group = max(1, max_points // max(xyz0.shape[1], 1))
+    for g in range(0, len(pairs), group):
+        # reproject to a group of target views at once.
+        xyz1 = np.matmul(rel_R[g:g + group], xyz0) + rel_t[g:g + group]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xy1_homo = xyz1 / xyz1[:, 2:3]
+        for k in range(xyz1.shape[0]):
+            depth1 = depths[pairs[g + k]]
+            uv1 = np.matmul(_get_K(pairs[g + k], depth1), xy1_homo[k])
+            pos1 = np.stack([uv1[1], uv1[0]], axis=-1)
+            annotated_depth, pos1, new_ids = interpolate_depth(pos1, depth1)
+            estimated_depth = xyz1[k, 2, new_ids]
+            inlier_mask = np.abs(estimated_depth - annotated_depth) < depth_thld
+            new_ids = new_ids[inlier_mask]
+            all_pos0.append(pos0[new_ids])
+            all_pos1.append(pos1[inlier_mask])
+            all_ids.append(ids0[new_ids])
+            offsets[g + k + 1] = offsets[g + k] + new_ids.shape[0]
+
+    if len(pairs) == 0:
+        return np.zeros((0, 2)), np.zeros((0, 2)), np.zeros((0,), dtype=np.int64), offsets
+    return (np.concatenate(all_pos0, axis=0), np.concatenate(all_pos1, axis=0),
+            np.concatenate(all_ids, axis=0), offsets)
+
+
+def undistort_normalized(x, y, dist, num_iters=5):
+    """Iteratively remove the radial distortion (k1, k2, k3) of normalized image coordinates,
+    in the same fixed-point scheme as cv2.undistortPoints.
+    Args:
+        x, y: N-d distorted normalized coordinates.
+        dist: Nx3 (or 3) radial distortion.
+        num_iters: number of iterations, 5 as the default of cv2.undistortPoints.
+    Returns:
+        x, y: N-d undistorted normalized coordinates.
+    """
+    dist = np.asarray(dist, dtype=np.float64)
+    k1, k2, k3 = dist[..., 0], dist[..., 1], dist[..., 2]
+    x0, y0 = x, y
+    for _ in range(num_iters):
+        r2 = x * x
+        r2 += y * y
+        icdist = k3 * r2
+        icdist += k2
+        icdist *= r2
+        icdist += k1
+        icdist *= r2
+        icdist += 1
+        np.reciprocal(icdist, out=icdist)
+        if icdist.min(initial=0) < 0:
+            # diverged, fall back to the distorted coordinates.
+            icdist[icdist < 0] = 1
+        x = x0 * icdist
+        y = y0 * icdist
+    return x, y
+
+
+@profiled()
+def undist_points_batch(pts, K, dist, cam_idx=None, img_size=None, num_iters=5):
+    """Undistort points of many images in one call.
+    Args:
+        pts: Nx2 pixel coordinates, or Nx6 keypoints in normalized coordinates if img_size is given.
+        K: 3x3, or Cx3x3 stacked intrinsics.
+        dist: 3, or Cx3 stacked radial distortion.
+        cam_idx: N camera indices into stacked K, dist and img_size.
+        img_size: 2, or Cx2 stacked image size (width, height).
+        num_iters: number of iterations, see undistort_normalized.
+    Returns:
+        upts: Nx2 undistorted pixel coordinates, or a copy of keypoints with undistorted coordinates.
+    """
+    K = np.asarray(K, dtype=np.float64)
+    dist = np.asarray(dist, dtype=np.float64)
+    # fx, fy, cx, cy, skew and k1, k2, k3 of each camera, gathered once per point.
+    params = np.concatenate([K[..., [0, 1, 0, 1, 0], [0, 1, 2, 2, 1]], dist], axis=-1)
+    if cam_idx is not None:
+        params = np.take(params.T, np.asarray(cam_idx, dtype=np.int64), axis=1)
+    else:
+        params = params[:, None]
+    fx, fy, cx, cy, skew = params[0:5]
+    if img_size is not None:
+        hs = np.asarray(img_size, dtype=np.float64) / 2
+        if cam_idx is not None and hs.ndim > 1:
+            hs = np.take(hs.T, cam_idx, axis=1)
+        else:
+            hs = hs[:, None]
+        u = pts[:, 2] * hs[0] + hs[0]
+        v = pts[:, 5] * hs[1] + hs[1]
+    else:
+        u = pts[:, 0].astype(np.float64)
+        v = pts[:, 1].astype(np.float64)
 
-    upts = cv2.undistortPoints(np.expand_dims(new_pts, axis=1), K, new_dist)
-    upts = np.squeeze(cv2.convertPointsToHomogeneous(upts), axis=1)
-    upts = np.matmul(K, upts.T).T[:, 0:2]
+    x, y = undistort_normalized((u - cx) / fx, (v - cy) / fy, params[5:8].T, num_iters)
+    u = fx * x + skew * y + cx
+    v = fy * y + cy
 
     if img_size is not None:
         new_upts = pts.copy()
-        new_upts[:, 2] = (upts[:, 0] - hs[0]) / hs[0]
-        new_upts[:, 5] = (upts[:, 1] - hs[1]) / hs[1]
+        new_upts[:, 2] = (u - hs[0]) / hs[0]
+        new_upts[:, 5] = (v - hs[1]) / hs[1]
         return new_upts
-    else:
-        return upts
+    return np.stack([u, v], axis=-1)
+
+
+@profiled()
+def undist_points(pts, K, dist, img_size=None):
+    """Undistort points of an image, see undist_points_batch.
+    Args:
+        pts: Nx2 pixel coordinates, or Nx6 keypoints in normalized coordinates if img_size is given.
+        K: 3x3 intrinsics.
+        dist: 3-d radial distortion.
+        img_size: image size (width, height).
+    """
+    return undist_points_batch(pts, K, dist, img_size=img_size)
 
 
 def skew_symmetric_mat(v):
@@ -218,7 +364,30 @@ def get_essential_mat(t0, t1, R0, R1):
     return e_mat
 
 
-def get_epipolar_dist(kpt_coord0, kpt_coord1, K0, K1, ori_img_size0, ori_img_size1, e_mat, eps=1e-6):
+def get_norm_coord_mat(K, ori_img_size, K_inv=None):
+    """Get the matrix mapping keypoint coordinates to normalized camera coordinates.
+    Args:
+        K: (B)x3x3 intrinsic matrix.
+        ori_img_size: (B)x2 original image size (width, height).
+        K_inv: optional precomputed inverse of K.
+    Returns:
+        T: (B)x3x3 matrix, T * (x, y, 1)^T = K^-1 * (u, v, 1)^T for x, y normalized to [-1, +1].
+    """
+    if K_inv is None:
+        K_inv = np.linalg.inv(K)
+    hs = np.asarray(ori_img_size, dtype=np.float64) / 2
+    S = np.zeros(hs.shape[:-1] + (3, 3))
+    S[..., 0, 0] = hs[..., 0]
+    S[..., 0, 2] = hs[..., 0]
+    S[..., 1, 1] = hs[..., 1]
+    S[..., 1, 2] = hs[..., 1]
+    S[..., 2, 2] = 1
+    return np.matmul(K_inv, S)
+
+
+@profiled()
+def get_epipolar_dist(kpt_coord0, kpt_coord1, K0, K1, ori_img_size0, ori_img_size1, e_mat, eps=1e-6,
+                      get_epi_dist_mat=False):
     """
     Compute (symmetric) epipolar distances.
     Args:
@@ -229,8 +398,12 @@ def get_epipolar_dist(kpt_coord0, kpt_coord1, K0, K1, ori_img_size0, ori_img_siz
         get_epi_dist_mat: Whether to get epipolar distance in matrix form or vector form.
         eps: Epsilon.
     Returns:
-        epi_dist: N-d epipolar distance.
+        epi_dist: N-d epipolar distance, or NxM distance matrix, see get_epipolar_dist_mat.
     """
+    if get_epi_dist_mat:
+        return get_epipolar_dist_mat(kpt_coord0, kpt_coord1, K0, K1, ori_img_size0, ori_img_size1,
+                                     e_mat, eps=eps)
+
     def _get_homo_coord(coord):
         homo_coord = np.concatenate([coord, np.ones_like(coord[:, 0, None])], axis=-1)
         return homo_coord
@@ -250,4 +423,101 @@ def get_epipolar_dist(kpt_coord0, kpt_coord1, K0, K1, ori_img_size0, ori_img_siz
     x1Ex0 = np.sum(xy1_homo * Ex0, axis=0)
     epi_dist = (x1Ex0 ** 2) / (line_norm0 + line_norm1 + eps)
     epi_dist = np.sqrt(epi_dist)
-    return epi_dist
\ No newline at end of file
+    return epi_dist
+
+
+@profiled()
+def get_epipolar_dist_mat(kpt_coord0, kpt_coord1, K0, K1, ori_img_size0, ori_img_size1, e_mat,
+                          eps=1e-6, K0_inv=None, K1_inv=None, dtype=np.float64, max_bytes=1 << 28,
+                          top_k=None, thld=None):
+    """
+    Compute (symmetric) epipolar distances between all keypoint pairs, optionally batched over B
+    image pairs. Rows are evaluated in chunks so that the temporaries stay within max_bytes.
+    Args:
+        kpt_coord0: (B)xNx2 keypoint coordinates, normalized to [-1, +1].
+        kpt_coord1: (B)xMx2 keypoint coordinates, normalized to [-1, +1].
+        K: (B)x3x3 intrinsic matrix.
+        ori_img_size: (B)x2 original image size (width, height).
+        e_mat: (B)x3x3 precomputed essential matrix.
+        eps: Epsilon.
+        K0_inv, K1_inv: optional precomputed inverse intrinsic matrices, e.g., CameraSet.K_inv.
+        dtype: computation type, e.g., np.float32.
+        max_bytes: memory cap of the chunked evaluation.
+        top_k: if set, only keep the k nearest keypoints in the second image of each keypoint.
+        thld: if set, only keep distances smaller than thld.
+    Returns:
+        If neither top_k nor thld is set, (B)xNxM epi_dist.
+        If top_k is set, (B)xNxk (epi_dist, idx1) sorted by distance, where entries not smaller
+        than thld (if set) have index -1 and distance inf.
+        If only thld is set, sparse entries (batch_idx, idx0, idx1, epi_dist), of which batch_idx
+        is omitted for unbatched inputs.
+    """
+    batched = np.ndim(kpt_coord0) == 3
+    if not batched:
+        kpt_coord0, kpt_coord1 = kpt_coord0[None], kpt_coord1[None]
+        K0, K1, e_mat = K0[None], K1[None], e_mat[None]
+        ori_img_size0 = np.asarray(ori_img_size0)[None]
+        ori_img_size1 = np.asarray(ori_img_size1)[None]
+        K0_inv = K0_inv[None] if K0_inv is not None else None
+        K1_inv = K1_inv[None] if K1_inv is not None else None
+
+    def _get_homo_coord(coord):
+        homo_coord = np.concatenate([coord, np.ones_like(coord[..., 0, None])], axis=-1)
+        return np.transpose(homo_coord, (0, 2, 1))
+
+    # normalized camera coordinates.
+    xy0_homo = np.matmul(get_norm_coord_mat(K0, ori_img_size0, K0_inv), _get_homo_coord(kpt_coord0))
+    xy1_homo = np.matmul(get_norm_coord_mat(K1, ori_img_size1, K1_inv), _get_homo_coord(kpt_coord1))
+    # epipolar lines in both images.
+    Ex0 = np.matmul(e_mat, xy0_homo).astype(dtype)  # Bx3xN
+    Etx1 = np.matmul(np.transpose(e_mat, (0, 2, 1)), xy1_homo).astype(dtype)  # Bx3xM
+    xy1_homo = xy1_homo.astype(dtype)
+    line_norm0 = Ex0[:, 0] ** 2 + Ex0[:, 1] ** 2  # BxN
+    line_norm1 = Etx1[:, 0] ** 2 + Etx1[:, 1] ** 2 + eps  # BxM
+
+    b_num, n, m = Ex0.shape[0], Ex0.shape[2], xy1_homo.shape[2]
+    chunk = max(1, max_bytes // max(3 * m * np.dtype(dtype).itemsize, 1))
+    if top_k is not None:
+        top_k = min(top_k, m)
+        out_dist = np.full((b_num, n, top_k), np.inf, dtype=dtype)
+        out_idx = np.full((b_num, n, top_k), -1, dtype=np.int64)
+    elif thld is not None:
+        sparse = []
+    else:
+        epi_dist = np.empty((b_num, n, m), dtype=dtype)
+
+    for b in range(b_num):
+        for r in range(0, n, chunk):
+            dist = np.matmul(Ex0[b, :, r:r + chunk].T, xy1_homo[b])
+            np.square(dist, out=dist)
+            dist /= line_norm0[b, r:r + chunk, None] + line_norm1[b, None]
+            np.sqrt(dist, out=dist)
+            if top_k is not None:
+                if top_k == 0:
+                    continue
+                idx = np.argpartition(dist, top_k - 1, axis=1)[:, :top_k]
+                part = np.take_along_axis(dist, idx, axis=1)
+                order = np.argsort(part, axis=1, kind='stable')
+                part = np.take_along_axis(part, order, axis=1)
+                idx = np.take_along_axis(idx, order, axis=1)
+                if thld is not None:
+                    invalid = part >= thld
+                    part[invalid] = np.inf
+                    idx[invalid] = -1
+                out_dist[b, r:r + chunk] = part
+                out_idx[b, r:r + chunk] = idx
+            elif thld is not None:
+                idx0, idx1 = np.nonzero(dist < thld)
+                sparse.append((np.full(idx0.shape, b, dtype=np.int64), idx0 + r, idx1, dist[idx0, idx1]))
+            else:
+                epi_dist[b, r:r + chunk] = dist
+
+    if top_k is not None:
+        return (out_dist, out_idx) if batched else (out_dist[0], out_idx[0])
+    if thld is not None:
+        if len(sparse) == 0:
+            sparse = [(np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int64),
+                       np.zeros(0, dtype))]
+        sparse = [np.concatenate(val) for val in zip(*sparse)]
+        return tuple(sparse) if batched else tuple(sparse[1:])
+    return epi_dist if batched else epi_dist[0]
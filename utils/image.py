@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Image reading at reduced resolutions, with on-disk pyramids and prefetching.
+
+JPEG images are decoded at 1/2, 1/4 or 1/8 resolution by cv2.IMREAD_REDUCED_* where the target
+size allows, and read from pre-downscaled pyramid levels of build_pyramid if they exist, e.g.,
+<pid>/undist_images_d4/ for 1/4 of <pid>/undist_images/.
+"""
+
+from __future__ import print_function
+
+import os
+from struct import unpack
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+
+from .geom import scale_intrinsics
+
+# downscale factor: (color flag, grayscale flag)
+REDUCED_FLAGS = {
+    1: (cv2.IMREAD_COLOR, cv2.IMREAD_GRAYSCALE),
+    2: (cv2.IMREAD_REDUCED_COLOR_2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+    4: (cv2.IMREAD_REDUCED_COLOR_4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    8: (cv2.IMREAD_REDUCED_COLOR_8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+}
+
+# start of frame markers, which hold the image size.
+SOF_MARKERS = set([0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF])
+
+
+def read_jpeg_size(img_path):
+    """Read the image size from the JPEG header without decoding.
+    Returns:
+        img_size: (width, height), or None if not a JPEG file.
+    """
+    with open(img_path, 'rb') as fin:
+        if fin.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            byte = fin.read(1)
+            while byte == b'\xff':
+                byte = fin.read(1)
+            if len(byte) == 0:
+                return None
+            marker = ord(byte)
+            if marker == 0xD8 or 0xD0 <= marker <= 0xD7 or marker == 0x01:
+                continue
+            length = fin.read(2)
+            if len(length) < 2:
+                return None
+            length = unpack('>H', length)[0]
+            if marker in SOF_MARKERS:
+                height, width = unpack('>xHH', fin.read(5))
+                return (width, height)
+            fin.seek(length - 2, os.SEEK_CUR)
+
+
+def pyramid_dir(img_dir, factor):
+    """Get the folder of a pyramid level, e.g., <pid>/undist_images_d4."""
+    return img_dir.rstrip('/') + '_d%d' % factor
+
+
+def _reduce_factor(src_size, dst_size, max_factor=8):
+    """Get the largest power of 2 by which the source can be downscaled without going below dst."""
+    ratio = min(float(src_size[0]) / dst_size[0], float(src_size[1]) / dst_size[1])
+    factor = 1
+    while factor * 2 <= min(ratio, max_factor):
+        factor *= 2
+    return factor
+
+
+def read_image(img_path, img_size=None, scale=None, gray=False, rgb=False, pyramid=True,
+               interpolation=cv2.INTER_AREA):
+    """Read an image at a given resolution, decoding as few pixels as possible.
+    Args:
+        img_path: image path.
+        img_size: output size (width, height).
+        scale: output scale w.r.t. the image file, if img_size is not given. Full size if both are None.
+        gray: whether to read in grayscale.
+        rgb: whether to convert color images to RGB, otherwise BGR as cv2.imread.
+        pyramid: whether to read from pyramid levels of build_pyramid if they exist.
+        interpolation: interpolation of the final resize.
+    Returns:
+        img: HxW(x3) uint8 image.
+    """
+    src_size = read_jpeg_size(img_path)
+    if src_size is None and (img_size is not None or scale is not None):
+        # not a JPEG file, decode in full resolution.
+        img = cv2.imread(img_path, REDUCED_FLAGS[1][int(gray)])
+        src_size = (img.shape[1], img.shape[0])
+    else:
+        img = None
+    if img_size is None:
+        scale = 1. if scale is None else scale
+        img_size = (int(round(src_size[0] * scale)), int(round(src_size[1] * scale))) \
+            if src_size is not None else None
+
+    if img is None:
+        factor = _reduce_factor(src_size, img_size) if img_size is not None else 1
+        read_path = img_path
+        if pyramid and factor > 1:
+            img_dir, basename = os.path.split(img_path)
+            level = factor
+            while level > 1:
+                level_path = os.path.join(pyramid_dir(img_dir, level), basename)
+                if os.path.exists(level_path):
+                    read_path = level_path
+                    factor //= level
+                    break
+                level //= 2
+        img = cv2.imread(read_path, REDUCED_FLAGS[factor][int(gray)])
+        if img is None:
+            raise IOError('Failed to read %s.' % read_path)
+
+    if img_size is not None and (img.shape[1], img.shape[0]) != tuple(img_size):
+        img = cv2.resize(img, tuple(img_size), interpolation=interpolation)
+    if rgb and img.ndim == 3:
+        img = img[..., ::-1]
+    return img
+
+
+def load_image(img_path, K, ori_img_size, img_size=None, scale=None, **kwargs):
+    """Read an image, and rescale its intrinsics to the output resolution.
+    Args:
+        img_path: image path.
+        K: 3x3 intrinsics of the camera.
+        ori_img_size: image size (width, height) of the camera, e.g., from cameras.txt.
+        img_size, scale, kwargs: see read_image.
+    Returns:
+        img: image.
+        r_K: 3x3 rescaled intrinsics.
+    """
+    img = read_image(img_path, img_size, scale, **kwargs)
+    return img, scale_intrinsics(K, ori_img_size, (img.shape[1], img.shape[0]))
+
+
+def build_pyramid(img_dir, factors=(2, 4, 8), ext=None, quality=95, overwrite=False):
+    """Write pyramid levels of the images of a folder.
+    Args:
+        img_dir: image folder, e.g., <pid>/undist_images.
+        factors: downscale factors of levels.
+        ext: file extension of levels, e.g., .png for lossless levels, defaults to the source one.
+        quality: JPEG quality.
+        overwrite: whether to rewrite existing level images.
+    Returns:
+        count: number of images written.
+    """
+    count = 0
+    for basename in sorted(os.listdir(img_dir)):
+        name, src_ext = os.path.splitext(basename)
+        if src_ext.lower() not in ('.jpg', '.jpeg', '.png'):
+            continue
+        level_ext = ext if ext is not None else src_ext
+        img = None
+        for factor in factors:
+            level_dir = pyramid_dir(img_dir, factor)
+            level_path = os.path.join(level_dir, name + level_ext)
+            if not overwrite and os.path.exists(level_path):
+                continue
+            if not os.path.exists(level_dir):
+                os.makedirs(level_dir, exist_ok=True)
+            if img is None:
+                img = cv2.imread(os.path.join(img_dir, basename), cv2.IMREAD_UNCHANGED)
+            size = (max(int(round(img.shape[1] / float(factor))), 1),
+                    max(int(round(img.shape[0] / float(factor))), 1))
+            level_img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+            params = [cv2.IMWRITE_JPEG_QUALITY, quality] if level_ext.lower() in ('.jpg', '.jpeg') else []
+            # written to a temporary file and renamed, so that readers never see partial images.
+            tmp_path = os.path.join(level_dir, name + '.tmp' + level_ext)
+            cv2.imwrite(tmp_path, level_img, params)
+            os.replace(tmp_path, level_path)
+            count += 1
+    return count
+
+
+class ImagePipeline(object):
+    """Read images through a thread pool, overlapping decoding with computation."""
+
+    def __init__(self, img_size=None, scale=None, num_threads=4, prefetch=8, **kwargs):
+        """
+        Args:
+            img_size, scale, kwargs: see read_image.
+            num_threads: number of decoding threads.
+            prefetch: maximum number of images decoded ahead.
+        """
+        self.img_size = img_size
+        self.scale = scale
+        self.kwargs = kwargs
+        self.prefetch = prefetch
+        self.executor = ThreadPoolExecutor(num_threads)
+
+    def _load(self, item):
+        if isinstance(item, (tuple, list)):
+            img_path, K, ori_img_size = item
+            return load_image(img_path, K, ori_img_size, self.img_size, self.scale, **self.kwargs)
+        return read_image(item, self.img_size, self.scale, **self.kwargs)
+
+    def imap(self, items):
+        """Read images in order, prefetching the following ones.
+        Args:
+            items: iterable of image paths, or of (img_path, K, ori_img_size) to also rescale
+                intrinsics, see load_image.
+        Yields:
+            image, or (image, rescaled K).
+        """
+        futures = deque()
+        for item in items:
+            futures.append(self.executor.submit(self._load, item))
+            if len(futures) >= self.prefetch:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Global image index of datasets, built on list/<dataset>/image_index_offset.txt.
+"""
+
+from __future__ import print_function
+
+import os
+import numpy as np
+
+from .io import read_list
+
+# file type: (sub directory, extension)
+FILE_TYPES = {
+    'image': ('undist_images', '.jpg'),
+    'blended_image': ('blended_images', '.jpg'),
+    'depth': ('depths', '.pfm'),
+    'rendered_depth': ('rendered_depths', '.pfm'),
+    'kpt': ('img_kpts', '.bin'),
+    'reg_feat': ('reg_feat', '.bin'),
+}
+
+# file type: flat file list, of which line i is the file of global image index i.
+LIST_FILES = {
+    'image': 'image_list.txt',
+    'depth': 'depth_list.txt',
+    'reg_feat': 'regional_feat_list.txt',
+}
+
+
+class ImageIndex(object):
+    """Map global image indices to scenes, local image indices and file paths, and back."""
+
+    def __init__(self, list_dir, data_root='data', cache_path=None, save_cache=False):
+        """
+        Args:
+            list_dir: dataset list directory, e.g., list/gl3d, list/tourism, list/blendedmvg, list/comb.
+            data_root: root of scene data.
+            cache_path: optional path to the binary cache.
+            save_cache: whether to write the cache after parsing the lists.
+        """
+        self.list_dir = list_dir
+        self.data_root = data_root
+        sources = [os.path.join(list_dir, 'image_index_offset.txt')] + \
+            [os.path.join(list_dir, val) for val in sorted(LIST_FILES.values())]
+        stamp = np.array([os.path.getsize(val) if os.path.exists(val) else -1 for val in sources])
+
+        cache = None
+        if cache_path is not None and os.path.exists(cache_path):
+            cache = dict(np.load(cache_path))
+            if not np.array_equal(cache.pop('stamp'), stamp):
+                cache = None
+        if cache is None:
+            cache = self._parse()
+            if cache_path is not None and save_cache:
+                with open(cache_path, 'wb') as fout:
+                    np.savez(fout, stamp=stamp, **cache)
+
+        self.pids = cache['pids']
+        self.starts = cache['starts']
+        self.ends = cache['ends']
+        self.file_lists = {key: cache['list_' + key] for key in LIST_FILES if 'list_' + key in cache}
+        self._pid_order = np.argsort(self.pids, kind='stable')
+        self._sorted_pids = self.pids[self._pid_order]
+
+    def _parse(self):
+        offsets = [val.split() for val in read_list(os.path.join(self.list_dir, 'image_index_offset.txt'))
+                   if val.strip() != '']
+        starts = np.array([int(val[1]) for val in offsets], dtype=np.int64)
+        order = np.argsort(starts, kind='stable')
+        cache = {
+            'pids': np.array([offsets[i][0] for i in order]),
+            'starts': starts[order],
+            'ends': np.array([int(offsets[i][2]) for i in order], dtype=np.int64),
+        }
+        for key, val in LIST_FILES.items():
+            list_path = os.path.join(self.list_dir, val)
+            if os.path.exists(list_path):
+                cache['list_' + key] = np.array(
+                    [line.encode('UTF-8') for line in read_list(list_path) if line.strip() != ''])
+        return cache
+
+    def __len__(self):
+        return int(self.ends[-1]) if self.ends.shape[0] > 0 else 0
+
+    def scene_rows(self, pid):
+        """Get row positions of scenes.
+        Args:
+            pid: scene pids, string or array.
+        Returns:
+            rows: row positions, -1 if the scene does not exist.
+        """
+        pid = np.asarray(pid)
+        if self.pids.shape[0] == 0:
+            return np.full(pid.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted_pids, pid), self.pids.shape[0] - 1)
+        return np.where(self._sorted_pids[pos] == pid, self._pid_order[pos], -1)
+
+    def locate(self, global_idx):
+        """Resolve global image indices.
+        Args:
+            global_idx: global image indices, scalar or array.
+        Returns:
+            rows: row positions of scenes, -1 if the index is out of range or not covered by a scene.
+            local_idx: local image indices in the scenes.
+        """
+        global_idx = np.asarray(global_idx, dtype=np.int64)
+        rows = np.searchsorted(self.starts, global_idx, side='right') - 1
+        safe_rows = np.maximum(rows, 0)
+        valid = (rows >= 0) & (global_idx < self.ends[safe_rows])
+        rows = np.where(valid, rows, -1)
+        local_idx = np.where(valid, global_idx - self.starts[safe_rows], -1)
+        return rows, local_idx
+
+    def resolve(self, global_idx):
+        """Resolve a global image index.
+        Returns:
+            pid: scene pid.
+            local_idx: local image index.
+        """
+        row, local_idx = self.locate(global_idx)
+        if int(row) < 0:
+            raise KeyError(global_idx)
+        return str(self.pids[int(row)]), int(local_idx)
+
+    def global_index(self, pid, local_idx):
+        """Get global image indices from scene pids and local image indices.
+        Returns:
+            global_idx: global image indices, -1 if out of range.
+        """
+        rows = self.scene_rows(pid)
+        local_idx = np.asarray(local_idx, dtype=np.int64)
+        safe_rows = np.maximum(rows, 0)
+        global_idx = self.starts[safe_rows] + local_idx
+        valid = (rows >= 0) & (local_idx >= 0) & (global_idx < self.ends[safe_rows])
+        return np.where(valid, global_idx, -1)
+
+    def path(self, global_idx, file_type='image'):
+        """Get the file path of a global image index.
+        Args:
+            global_idx: global image index.
+            file_type: one of FILE_TYPES.
+        Returns:
+            path: file path, taken from the flat file list if it exists.
+        """
+        if file_type in self.file_lists:
+            entry = self.file_lists[file_type][int(global_idx)].decode('UTF-8')
+            # list entries are relative to the default data root.
+            if entry.startswith('data/'):
+                entry = entry[len('data/'):]
+            return os.path.join(self.data_root, entry)
+        pid, local_idx = self.resolve(global_idx)
+        sub_dir, ext = FILE_TYPES[file_type]
+        return os.path.join(self.data_root, pid, sub_dir, str(local_idx).zfill(8) + ext)
+
+    def split(self, split='train'):
+        """Read the scene pids of a split.
+        Args:
+            split: train, test or all.
+        Returns:
+            pids: list of scene pids.
+        """
+        return [val.strip() for val in read_list(os.path.join(self.list_dir, 'imageset_%s.txt' % split))
+                if val.strip() != '']
+
+    def iter_split(self, split='train'):
+        """Iterate scenes of a split.
+        Yields:
+            (pid, start, end): scene pid and its global image index range.
+        """
+        for pid in self.split(split):
+            row = int(self.scene_rows(pid))
+            if row < 0:
+                continue
+            yield pid, int(self.starts[row]), int(self.ends[row])
+
+    def split_indices(self, split='train'):
+        """Get all global image indices of a split.
+        Returns:
+            global_idx: sorted global image indices.
+        """
+        ranges = [np.arange(start, end) for _, start, end in self.iter_split(split)]
+        if len(ranges) == 0:
+            return np.zeros((0,), dtype=np.int64)
+        return np.sort(np.concatenate(ranges))
@@ -8,17 +8,23 @@ from __future__ import print_function
 
 import os
 import re
-from struct import unpack
+from struct import unpack, unpack_from
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
+from .profiler import profiled, add_bytes_read
 
-def load_pfm(pfm_path):
+
+def read_pfm_header(pfm_path):
+    """Read the PFM header.
+    Args:
+        pfm_path: file path.
+    Returns:
+        shape: data shape, (height, width, 3) for color and (height, width) for grayscale.
+        data_type: data type of the file byte order.
+        offset: byte offset of data.
+    """
     with open(pfm_path, 'rb') as fin:
-        color = None
-        width = None
-        height = None
-        scale = None
-        data_type = None
         header = str(fin.readline().decode('UTF-8')).rstrip()
 
         if header == 'PF':
@@ -35,17 +41,61 @@ def load_pfm(pfm_path):
             raise Exception('Malformed PFM header.')
         scale = float((fin.readline().decode('UTF-8')).rstrip())
         if scale < 0:  # little-endian
-            data_type = '<f'
+            data_type = np.dtype('<f')
         else:
-            data_type = '>f'  # big-endian
-        data_string = fin.read()
-        data = np.fromstring(data_string, data_type)
-        shape = (height, width, 3) if color else (height, width)
-        data = np.reshape(data, shape)
-        data = np.flip(data, 0)
+            data_type = np.dtype('>f')  # big-endian
+        offset = fin.tell()
+    shape = (height, width, 3) if color else (height, width)
+    return shape, data_type, offset
+
+
+@profiled(path_arg=0)
+def load_pfm(pfm_path, flip=True, crop=None, step=1, mmap=False):
+    """Load the PFM file.
+    Args:
+        pfm_path: file path.
+        flip: whether to flip rows to top-to-bottom order.
+        crop: optional (top, left, bottom, right) region to read, in the output orientation.
+        step: downsampling step of rows and columns.
+        mmap: whether to return a (possibly non-contiguous) memory-mapped view if the file is in
+            native byte order, otherwise only the requested region is copied once.
+    Returns:
+        data: depth data in native byte order.
+    """
+    shape, data_type, offset = read_pfm_header(pfm_path)
+    if os.path.getsize(pfm_path) < offset + int(np.prod(shape)) * data_type.itemsize:
+        raise Exception('Truncated PFM data.')
+    data = np.memmap(pfm_path, dtype=data_type, mode='r', offset=offset, shape=shape)
+    if flip:
+        data = data[::-1]
+    if crop is not None:
+        data = data[crop[0]:crop[2], crop[1]:crop[3]]
+    if step > 1:
+        data = data[::step, ::step]
+    add_bytes_read(offset + data.size * data_type.itemsize)
+    if mmap and data_type.isnative:
+        return data
+    return np.ascontiguousarray(data, dtype=data_type.newbyteorder('='))
+
+
+@profiled()
+def load_pfms(pfm_paths, num_threads=8, **kwargs):
+    """Load PFM files with a thread pool.
+    Args:
+        pfm_paths: list of file paths.
+        num_threads: number of threads.
+        kwargs: arguments of load_pfm.
+    Returns:
+        data: list of depth data.
+    """
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        data = list(executor.map(lambda x: load_pfm(x, **kwargs), pfm_paths))
+    # bytes read by the threads are not counted in this call otherwise.
+    add_bytes_read(sum([val.nbytes for val in data]))
     return data
 
 
+@profiled(path_arg=0)
 def read_corr(file_path):
     """Read the match correspondence file.
     Args:
@@ -63,12 +113,163 @@ def read_corr(file_path):
                 # EOF
                 break
             idx0, idx1, num = unpack('L' * 3, rin)
-            bytes_theta = num * 60
-            corr = np.fromstring(fin.read(bytes_theta), dtype=np.float32).reshape(-1, 15)
+            corr = np.fromfile(fin, dtype=np.float32, count=num * 15).reshape(-1, 15)
             matches.append([idx0, idx1, corr])
+        add_bytes_read(fin.tell())
     return matches
 
 
+class CorrFile(object):
+    """Memory-mapped, lazily indexed reader of the match correspondence file.
+
+    Only the record headers are scanned on construction (or loaded from a sidecar index), the
+    correspondence payloads are returned as zero-copy views into the mapped file.
+    """
+
+    HEADER_SIZE = 24
+    ROW_SIZE = 60
+
+    @profiled(path_arg=1)
+    def __init__(self, file_path, index_path=None, save_index=False, load_index=True):
+        """
+        Args:
+            file_path: path to corr.bin.
+            index_path: path to the sidecar offset index, defaults to <file_path>.idx.npz.
+            save_index: whether to write the sidecar index after scanning the headers.
+            load_index: whether to load the sidecar index if it exists, otherwise the headers are
+                always scanned, which raises IOError for truncated files and ValueError for invalid
+                correspondence numbers.
+        """
+        self.file_path = file_path
+        self.index_path = index_path if index_path is not None else file_path + '.idx.npz'
+        self.file_size = os.path.getsize(file_path)
+        if self.file_size > 0:
+            self._data = np.memmap(file_path, dtype=np.uint8, mode='r')
+        else:
+            self._data = np.zeros((0,), dtype=np.uint8)
+
+        self.index = self._load_index() if load_index else None
+        if self.index is None:
+            self.index = self._scan_index()
+            if save_index:
+                self.save_index()
+        # sorted hashed pair keys for O(log n) lookup by image pair.
+        keys = hash_int_pairs(self.index[:, 0], self.index[:, 1])
+        self._key_order = np.argsort(keys, kind='stable')
+        self._sorted_keys = keys[self._key_order]
+
+    def _scan_index(self):
+        """Scan the record headers.
+        Returns:
+            index: Nx4 int64 array, each row consists of two image indices, correspondence number
+            and byte offset of the correspondence payload.
+        """
+        index = []
+        offset = 0
+        while offset < self.file_size:
+            if offset + self.HEADER_SIZE > self.file_size:
+                raise IOError('Truncated record header at byte %d of %s.' % (offset, self.file_path))
+            idx0, idx1, num = unpack_from('<3q', self._data, offset)
+            if num < 0:
+                raise ValueError('Invalid correspondence number %d of the record at byte %d of %s.' %
+                                 (num, offset, self.file_path))
+            offset += self.HEADER_SIZE
+            index.append((idx0, idx1, num, offset))
+            offset += num * self.ROW_SIZE
+        if offset != self.file_size:
+            raise IOError('Truncated correspondence payload in %s.' % self.file_path)
+        add_bytes_read(len(index) * self.HEADER_SIZE)
+        return np.array(index, dtype=np.int64).reshape(-1, 4)
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return None
+        with np.load(self.index_path) as sidecar:
+            if int(sidecar['file_size']) != self.file_size:
+                # stale index of a different file.
+                return None
+            add_bytes_read(os.path.getsize(self.index_path))
+            return sidecar['index']
+
+    def save_index(self):
+        """Save the offset index as a sidecar file."""
+        with open(self.index_path, 'wb') as fout:
+            np.savez(fout, index=self.index, file_size=self.file_size)
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    def __getitem__(self, record_idx):
+        """Get a record by its record number.
+        Returns:
+            (idx0, idx1, corr): two image indices and Nx15 float32 view of the match matrix.
+        """
+        idx0, idx1, num, offset = self.index[record_idx]
+        corr = np.frombuffer(self._data, dtype=np.float32, count=num * 15, offset=offset)
+        return int(idx0), int(idx1), corr.reshape(-1, 15)
+
+    def __iter__(self):
+        for record_idx in range(len(self)):
+            yield self[record_idx]
+
+    def pairs(self):
+        """List image pairs without loading correspondences.
+        Returns:
+            pairs: Nx2 int64 array of image indices.
+        """
+        return self.index[:, 0:2]
+
+    def num_corr(self):
+        """Correspondence number of each record."""
+        return self.index[:, 2]
+
+    @profiled()
+    def columns(self, cols):
+        """Gather columns of the correspondences of all records in bulk.
+        Args:
+            cols: column indices, e.g., [13, 14] for FEATURE_IDX0 and FEATURE_IDX1.
+        Returns:
+            data: Lxlen(cols) float32 array, of which rows are in record order.
+        """
+        num = self.index[:, 2]
+        total = int(num.sum())
+        # payloads and records are 4-byte aligned, so the file is addressed as float32.
+        flat = self._data.view(np.float32)
+        row_start = np.repeat(self.index[:, 3] // 4 - np.concatenate([[0], np.cumsum(num)[:-1]]) * 15,
+                              num) + np.arange(total, dtype=np.int64) * 15
+        data = flat[row_start[:, None] + np.asarray(cols, dtype=np.int64)[None]]
+        add_bytes_read(data.nbytes)
+        return data
+
+    def find(self, idx0, idx1):
+        """Find the record number of an image pair.
+        Returns:
+            record_idx: record number, or -1 if the pair does not exist.
+        """
+        key = hash_int_pairs(idx0, idx1)
+        pos = np.searchsorted(self._sorted_keys, key)
+        if pos < self._sorted_keys.shape[0] and self._sorted_keys[pos] == key:
+            return int(self._key_order[pos])
+        return -1
+
+    def get_pair(self, idx0, idx1):
+        """Get a record by its image pair, see __getitem__."""
+        record_idx = self.find(idx0, idx1)
+        if record_idx < 0:
+            raise KeyError((idx0, idx1))
+        return self[record_idx]
+
+    def close(self):
+        self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+@profiled(path_arg=0)
 def read_kpt(file_path):
     """Read the keypoint file.
     Args:
@@ -77,10 +278,189 @@ def read_kpt(file_path):
         kpt_data: keypoint data of Nx6 numpy array.
     """
     kpt_data = np.fromfile(file_path, dtype=np.float32)
+    add_bytes_read(kpt_data.nbytes)
     kpt_data = np.reshape(kpt_data, (-1, 6))
     return kpt_data
 
 
+def list_kpt_files(kpt_dir):
+    """List keypoint files indexed by image index.
+    Returns:
+        files: a dictionary of file paths indexed by image index.
+    """
+    files = {}
+    for val in os.listdir(kpt_dir):
+        name, ext = os.path.splitext(val)
+        if ext == '.bin' and name.isdigit():
+            files[int(name)] = os.path.join(kpt_dir, val)
+    return files
+
+
+@profiled()
+def pack_kpts(kpt_dir, pack_prefix=None, dtype='float32'):
+    """Merge the keypoint files of a scene into one array with an offset table.
+    Args:
+        kpt_dir: keypoint folder, e.g., <pid>/img_kpts.
+        pack_prefix: prefix of the packed files, defaults to <kpt_dir>.packed.
+        dtype: storage type, float32, float16, or uint16 for quantization with per-column ranges.
+    Returns:
+        pack_prefix: prefix of the packed files, i.e., <pack_prefix>.npy for the Nx6 keypoints,
+            <pack_prefix>_offsets.npy for the offsets of images, <pack_prefix>_stamp.npy for the
+            stamps of keypoint files, and for uint16, <pack_prefix>_quant.npy for the 2x6 offsets
+            and scales of columns.
+    """
+    pack_prefix = pack_prefix if pack_prefix is not None else kpt_dir.rstrip('/') + '.packed'
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float16, np.uint16):
+        raise ValueError('Unsupported dtype %s' % dtype)
+    files = list_kpt_files(kpt_dir)
+    stamps = _kpt_stamps(files)
+    # the stamp is written last, so that an interrupted pack is not taken as valid.
+    data_path = pack_prefix + '.npy'
+    if os.path.exists(_stamp_path(data_path)):
+        os.remove(_stamp_path(data_path))
+    n_img = max(files.keys()) + 1 if files else 0
+    counts = np.zeros(n_img, dtype=np.int64)
+    for img_idx, file_path in files.items():
+        counts[img_idx] = os.path.getsize(file_path) // 24
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    quant = None
+    if dtype == np.uint16:
+        lower = np.full(6, np.inf)
+        upper = np.full(6, -np.inf)
+        for file_path in files.values():
+            kpts = read_kpt(file_path)
+            if kpts.shape[0] > 0:
+                lower = np.minimum(lower, kpts.min(axis=0))
+                upper = np.maximum(upper, kpts.max(axis=0))
+        lower[np.isinf(lower)] = 0
+        quant = np.stack([lower, np.maximum(upper - lower, 1e-12) / 65535])
+
+    data = np.lib.format.open_memmap(data_path + '.tmp', mode='w+', dtype=dtype,
+                                     shape=(int(offsets[-1]), 6))
+    for img_idx, file_path in files.items():
+        kpts = read_kpt(file_path)
+        if quant is not None:
+            kpts = np.round((kpts - quant[0]) / quant[1])
+        data[offsets[img_idx]:offsets[img_idx + 1]] = kpts
+    data.flush()
+    del data
+    os.replace(data_path + '.tmp', data_path)
+    if quant is not None:
+        np.save(pack_prefix + '_quant.npy', quant)
+    elif os.path.exists(pack_prefix + '_quant.npy'):
+        os.remove(pack_prefix + '_quant.npy')
+    with open(pack_prefix + '_offsets.npy.tmp', 'wb') as fout:
+        np.save(fout, offsets)
+    os.replace(pack_prefix + '_offsets.npy.tmp', pack_prefix + '_offsets.npy')
+    _save_stamp(data_path, stamps)
+    return pack_prefix
+
+
+def _kpt_stamps(files):
+    """Get stamps of keypoint files, i.e., Nx3 rows of image index, file size and time."""
+    img_idx = sorted(files.keys())
+    return np.concatenate([np.array(img_idx, dtype=np.int64).reshape(-1, 1),
+                           file_stamps([files[val] for val in img_idx])], axis=1)
+
+
+def kpt_pack_current(kpt_dir, pack_prefix=None):
+    """Check whether the pack of pack_kpts exists and was made from the current keypoint files,
+    i.e., no file was added, removed or modified since. The pack is taken as current if the
+    keypoint folder was removed after packing."""
+    pack_prefix = pack_prefix if pack_prefix is not None else kpt_dir.rstrip('/') + '.packed'
+    if not os.path.exists(pack_prefix + '_offsets.npy'):
+        return False
+    if not os.path.isdir(kpt_dir):
+        return True
+    return stamp_matches(pack_prefix + '.npy', _kpt_stamps(list_kpt_files(kpt_dir)))
+
+
+class KeypointStore(object):
+    """Keypoints of a scene, read from the pack of pack_kpts if it is current, see kpt_pack_current,
+    or per image file."""
+
+    def __init__(self, kpt_dir, pack_prefix=None):
+        """
+        Args:
+            kpt_dir: keypoint folder, e.g., <pid>/img_kpts.
+            pack_prefix: prefix of the packed files, defaults to <kpt_dir>.packed.
+        """
+        self.kpt_dir = kpt_dir
+        self.pack_prefix = pack_prefix if pack_prefix is not None else kpt_dir.rstrip('/') + '.packed'
+        self.data = None
+        self.offsets = None
+        self.quant = None
+        self.files = None
+        if kpt_pack_current(kpt_dir, self.pack_prefix):
+            self.offsets = np.load(self.pack_prefix + '_offsets.npy')
+            self.data = np.load(self.pack_prefix + '.npy', mmap_mode='r')
+            if os.path.exists(self.pack_prefix + '_quant.npy'):
+                self.quant = np.load(self.pack_prefix + '_quant.npy')
+        else:
+            self.files = list_kpt_files(kpt_dir)
+
+    @property
+    def packed(self):
+        return self.data is not None
+
+    def __len__(self):
+        if self.packed:
+            return self.offsets.shape[0] - 1
+        return max(self.files.keys()) + 1 if self.files else 0
+
+    def _decode(self, data):
+        if self.quant is not None:
+            return (data * self.quant[1] + self.quant[0]).astype(np.float32)
+        return data.astype(np.float32, copy=False)
+
+    def num_kpts(self, img_idx):
+        """Get keypoint numbers of images, 0 for images without keypoints."""
+        img_idx = np.asarray(img_idx, dtype=np.int64)
+        if self.offsets is None:
+            # per-image files, of which the sizes are read once.
+            counts = np.zeros(len(self), dtype=np.int64)
+            for key, val in self.files.items():
+                counts[key] = os.path.getsize(val) // 24
+            self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        valid = (img_idx >= 0) & (img_idx < len(self))
+        safe_idx = np.where(valid, img_idx, 0)
+        return np.where(valid, self.offsets[safe_idx + 1] - self.offsets[safe_idx], 0)
+
+    def __getitem__(self, img_idx):
+        """Get the Nx6 keypoints of an image, a zero-copy view of the pack if stored in float32."""
+        if self.packed:
+            if img_idx < 0 or img_idx >= len(self):
+                raise IndexError(img_idx)
+            return self._decode(self.data[self.offsets[img_idx]:self.offsets[img_idx + 1]])
+        if img_idx not in self.files:
+            raise IndexError(img_idx)
+        return read_kpt(self.files[img_idx])
+
+    @profiled()
+    def gather(self, img_idx, feat_idx):
+        """Gather keypoints in bulk, e.g., by FEATURE_IDX of corr records.
+        Args:
+            img_idx: image indices, scalar or N-d.
+            feat_idx: N-d feature indices, i.e., line indices in keypoint files.
+        Returns:
+            kpts: Nx6 float32 keypoints.
+        """
+        feat_idx = np.asarray(feat_idx).astype(np.int64)
+        img_idx = np.broadcast_to(np.asarray(img_idx, dtype=np.int64), feat_idx.shape)
+        if np.any((feat_idx < 0) | (feat_idx >= self.num_kpts(img_idx))):
+            raise IndexError('Feature index out of range.')
+        if self.packed:
+            add_bytes_read(feat_idx.size * 6 * self.data.dtype.itemsize)
+            return self._decode(self.data[self.offsets[img_idx] + feat_idx])
+        kpts = np.empty((feat_idx.shape[0], 6), dtype=np.float32)
+        for val in np.unique(img_idx):
+            mask = img_idx == val
+            kpts[mask] = read_kpt(self.files[int(val)])[feat_idx[mask]]
+        return kpts
+
+
 def hash_int_pair(ind1, ind2):
     """Hash an int pair.
     Args:
@@ -93,6 +473,51 @@ def hash_int_pair(ind1, ind2):
     return ind1 * 2147483647 + ind2
 
 
+def hash_int_pairs(ind1, ind2):
+    """Hash arrays of int pairs, see hash_int_pair."""
+    return np.asarray(ind1, dtype=np.int64) * 2147483647 + np.asarray(ind2, dtype=np.int64)
+
+
+def mask_dtype(size=32):
+    """Record type of the mask file.
+    Args:
+        size: mask size.
+    Returns:
+        dtype: structured type of two image indices and two flattened size x size masks.
+    """
+    return np.dtype([('idx0', '<i4'), ('idx1', '<i4'), ('mask', '?', (size * size * 2,))])
+
+
+def file_stamps(paths):
+    """Get stamps of source files, saved along derived sidecar files to detect changed sources.
+    Returns:
+        stamps: Nx2 int64 array of file sizes and modification times in ns.
+    """
+    stats = [os.stat(val) for val in paths]
+    return np.array([(val.st_size, val.st_mtime_ns) for val in stats], dtype=np.int64).reshape(-1, 2)
+
+
+def _stamp_path(sidecar_path):
+    """Get the stamp path of a sidecar file, e.g., <prefix>_stamp.npy of <prefix>.npy."""
+    return os.path.splitext(sidecar_path)[0] + '_stamp.npy'
+
+
+def stamp_matches(sidecar_path, stamps):
+    """Check whether a sidecar file was derived from source files of the given stamps."""
+    path = _stamp_path(sidecar_path)
+    if not (os.path.exists(sidecar_path) and os.path.exists(path)):
+        return False
+    saved = np.load(path)
+    return saved.shape == stamps.shape and np.array_equal(saved, stamps)
+
+
+def _save_stamp(sidecar_path, stamps):
+    with open(_stamp_path(sidecar_path) + '.tmp', 'wb') as fout:
+        np.save(fout, stamps)
+    os.replace(_stamp_path(sidecar_path) + '.tmp', _stamp_path(sidecar_path))
+
+
+@profiled(path_arg=0)
 def read_mask(file_path, size=32):
     """Read the mask file.
     Args:
@@ -101,19 +526,121 @@ def read_mask(file_path, size=32):
     Returns:
         mask_dict: mask data in dictionary, indexed by hashed pair index.
     """
-    mask_dict = {}
-    size = size * size * 2
-    record_size = 8 + size
-
-    with open(file_path, 'rb') as fin:
-        data = fin.read()
-    for i in range(0, len(data), record_size):
-        decoded = unpack('2i' + '?' * size, data[i: i + record_size])
-        mask = np.array(decoded[2:])
-        mask_dict[hash_int_pair(decoded[0], decoded[1])] = mask
+    records = np.fromfile(file_path, dtype=mask_dtype(size))
+    add_bytes_read(records.nbytes)
+    keys = hash_int_pairs(records['idx0'], records['idx1']).tolist()
+    masks = records['mask']
+    mask_dict = {key: masks[i] for i, key in enumerate(keys)}
     return mask_dict
 
 
+class MaskFile(object):
+    """Memory-mapped reader of the mask file with sorted pair index.
+
+    Masks are decoded from the mapped file on access, or from a packed representation of 1 bit
+    per cell, which can be saved as a sidecar file and shared across processes by memory-mapping.
+    """
+
+    @profiled(path_arg=1)
+    def __init__(self, file_path, size=32, packed=False, packed_path=None, save_packed=False):
+        """
+        Args:
+            file_path: path to mask.bin.
+            size: mask size.
+            packed: whether to hold the masks as packed bits.
+            packed_path: path to the packed sidecar, defaults to <file_path>.packed.npy, which is
+                only used if its stamp, <file_path>.packed_stamp.npy, matches the mask file.
+            save_packed: whether to write the packed sidecar if it does not exist or is stale.
+        """
+        self.file_path = file_path
+        self.size = size
+        self.packed_path = packed_path if packed_path is not None else file_path + '.packed.npy'
+        dtype = mask_dtype(size)
+        file_size = os.path.getsize(file_path)
+        if file_size % dtype.itemsize != 0:
+            raise IOError('Truncated mask record in %s.' % file_path)
+        if file_size > 0:
+            self.records = np.memmap(file_path, dtype=dtype, mode='r')
+        else:
+            self.records = np.zeros((0,), dtype=dtype)
+
+        keys = hash_int_pairs(self.records['idx0'], self.records['idx1'])
+        add_bytes_read(len(self) * 8)
+        self._key_order = np.argsort(keys, kind='stable')
+        self._sorted_keys = keys[self._key_order]
+
+        self.packed = packed
+        self.packed_masks = None
+        if packed:
+            stamps = file_stamps([file_path])
+            if stamp_matches(self.packed_path, stamps):
+                self.packed_masks = np.load(self.packed_path, mmap_mode='r')
+                if self.packed_masks.shape != (len(self), (size * size * 2 + 7) // 8):
+                    self.packed_masks = None
+            if self.packed_masks is None:
+                self.packed_masks = self.pack()
+                if save_packed:
+                    with open(self.packed_path + '.tmp', 'wb') as fout:
+                        np.save(fout, self.packed_masks)
+                    os.replace(self.packed_path + '.tmp', self.packed_path)
+                    _save_stamp(self.packed_path, stamps)
+
+    def pack(self, chunk_size=65536):
+        """Pack the masks into bits.
+        Returns:
+            packed_masks: Nx(size*size*2/8) uint8 array.
+        """
+        n_bytes = (self.size * self.size * 2 + 7) // 8
+        packed_masks = np.empty((len(self), n_bytes), dtype=np.uint8)
+        for i in range(0, len(self), chunk_size):
+            packed_masks[i:i + chunk_size] = np.packbits(self.records['mask'][i:i + chunk_size], axis=1)
+        add_bytes_read(len(self) * self.size * self.size * 2)
+        return packed_masks
+
+    def __len__(self):
+        return self.records.shape[0]
+
+    def pairs(self):
+        """List image pairs.
+        Returns:
+            pairs: Nx2 int32 array of image indices.
+        """
+        return np.stack([self.records['idx0'], self.records['idx1']], axis=-1)
+
+    def find(self, idx0, idx1):
+        """Find the record numbers of image pairs.
+        Args:
+            idx0, idx1: image indices, scalars or arrays.
+        Returns:
+            record_idx: record numbers, -1 if the pair does not exist.
+        """
+        keys = hash_int_pairs(idx0, idx1)
+        if self._sorted_keys.shape[0] == 0:
+            return np.full(keys.shape, -1, dtype=np.int64)
+        pos = np.searchsorted(self._sorted_keys, keys)
+        pos = np.minimum(pos, self._sorted_keys.shape[0] - 1)
+        found = self._sorted_keys[pos] == keys
+        return np.where(found, self._key_order[pos], -1)
+
+    def get_mask(self, record_idx):
+        """Get the mask of a record.
+        Returns:
+            mask: flattened bool mask of both images, of size*size*2.
+        """
+        if self.packed:
+            return np.unpackbits(self.packed_masks[record_idx],
+                                 count=self.size * self.size * 2).astype(bool)
+        return self.records['mask'][record_idx]
+
+    def get(self, idx0, idx1, default=None):
+        """Get the mask of an image pair, see get_mask."""
+        record_idx = int(self.find(idx0, idx1))
+        if record_idx < 0:
+            return default
+        return self.get_mask(record_idx)
+
+
+@profiled(path_arg=0)
 def read_cams(cam_path):
     """
     Args:
@@ -123,6 +650,7 @@ def read_cams(cam_path):
         K - 2x3, t - 3x1, R - 3x3, dist - 1x3, img_size - 1x2.
     """
     cam_data = [i.split(' ') for i in read_list(cam_path)]
+    add_bytes_read(os.path.getsize(cam_path))
 
     cam_dict = {}
     for i in cam_data:
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Overlap masks of image pairs, rendered at image resolution.
+"""
+
+from __future__ import print_function
+
+import os
+import numpy as np
+from scipy import ndimage
+
+
+def fill_masks(masks, size=32):
+    """Split mask records into the masks of both images and fill their holes.
+    Args:
+        masks: Nx(size*size*2) bool mask data, e.g., MaskFile.records['mask'], or a single record.
+        size: mask size.
+    Returns:
+        filled: Nx2xsizexsize bool masks, or 2xsizexsize for a single record.
+    """
+    masks = np.asarray(masks, dtype=bool)
+    single = masks.ndim == 1
+    masks = masks.reshape(-1, size, size)
+    # fill all masks in one call, with a structure that does not connect adjacent masks, and
+    # padded by empty masks so that the first and the last are bounded as the others.
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = ndimage.generate_binary_structure(2, 1)
+    filled = ndimage.binary_fill_holes(np.pad(masks, ((1, 1), (0, 0), (0, 0))), structure)[1:-1]
+    return filled.reshape(2, size, size) if single else filled.reshape(-1, 2, size, size)
+
+
+def upsample_index(in_size, out_size, mode='nearest'):
+    """Get the source cell of each output pixel along an axis.
+    Args:
+        in_size: mask size.
+        out_size: image size.
+        mode: 'nearest' to stretch cells evenly over the image as cv2.INTER_NEAREST, or 'interval'
+            for cells of ceil(out_size / in_size) pixels, as in example/visualize.draw_mask.
+    Returns:
+        index: out_size-d cell indices.
+    """
+    pixels = np.arange(out_size, dtype=np.int64)
+    if mode == 'nearest':
+        return pixels * in_size // out_size
+    elif mode == 'interval':
+        return np.minimum(pixels // int(np.ceil(float(out_size) / in_size)), in_size - 1)
+    else:
+        raise NotImplementedError()
+
+
+def upsample_masks(masks, out_size, mode='nearest'):
+    """Upsample masks to image resolution by index broadcasting.
+    Args:
+        masks: ...xSxS masks.
+        out_size: output size (height, width).
+        mode: see upsample_index.
+    Returns:
+        upsampled: ...xHxW masks.
+    """
+    masks = np.asarray(masks)
+    rows = upsample_index(masks.shape[-2], out_size[0], mode)
+    cols = upsample_index(masks.shape[-1], out_size[1], mode)
+    return masks[..., rows[:, None], cols[None, :]]
+
+
+def render_masks(masks, out_size, size=32, mode='nearest'):
+    """Fill and upsample mask records of image pairs, see fill_masks and upsample_masks.
+    Args:
+        masks: Nx(size*size*2) bool mask data.
+        out_size: output size (height, width) of both images.
+    Returns:
+        rendered: Nx2xHxW bool masks.
+    """
+    return upsample_masks(fill_masks(masks, size), out_size, mode)
+
+
+def pack_masks(masks):
+    """Pack ...xHxW bool masks into ...x(ceil(H*W/8)) uint8 bits."""
+    masks = np.asarray(masks, dtype=bool)
+    return np.packbits(masks.reshape(masks.shape[:-2] + (-1,)), axis=-1)
+
+
+def unpack_masks(packed, out_size):
+    """Unpack masks of pack_masks.
+    Returns:
+        masks: ...xHxW bool masks.
+    """
+    count = out_size[0] * out_size[1]
+    masks = np.unpackbits(packed, axis=-1, count=count).astype(bool)
+    return masks.reshape(masks.shape[:-1] + tuple(out_size))
+
+
+def cache_masks(mask_file, out_size, cache_path, mode='nearest', chunk_size=1024):
+    """Render all masks of a mask file and cache them as packed bits.
+    Args:
+        mask_file: io.MaskFile.
+        out_size: output size (height, width), e.g., of training images or depth maps.
+        cache_path: .npy path of the cache, holding Nx2x(ceil(H*W/8)) uint8 in the record order of
+            mask_file, and is read back with np.load(cache_path, mmap_mode='r') and unpack_masks.
+        chunk_size: number of records rendered at a time.
+    Returns:
+        cache: the memory-mapped cache.
+    """
+    n_bytes = (out_size[0] * out_size[1] + 7) // 8
+    cache = np.lib.format.open_memmap(cache_path + '.tmp', mode='w+', dtype=np.uint8,
+                                      shape=(len(mask_file), 2, n_bytes))
+    for i in range(0, len(mask_file), chunk_size):
+        masks = mask_file.records['mask'][i:i + chunk_size]
+        cache[i:i + chunk_size] = pack_masks(render_masks(masks, out_size, mask_file.size, mode))
+    cache.flush()
+    del cache
+    os.replace(cache_path + '.tmp', cache_path)
+    return np.load(cache_path, mmap_mode='r')
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Join of correspondences in corr.bin to the keypoints in img_kpts, by their FEATURE_IDX columns.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+
+
+class CorrJoin(object):
+    """Feature indices of all correspondences of a scene, joined to its keypoints.
+
+    Attributes:
+        pairs: Mx2 image indices of records.
+        offsets: (M+1) offsets of records into the correspondence rows.
+        feat_idx: Lx2 int32 FEATURE_IDX0 and FEATURE_IDX1 of all correspondences.
+        img_idx: Lx2 image indices of all correspondences.
+        kpt_offsets: (N+1) offsets of images into the scene-wide keypoint ids.
+    """
+
+    def __init__(self, corr_file, kpt_store):
+        """
+        Args:
+            corr_file: io.CorrFile.
+            kpt_store: io.KeypointStore of the same scene.
+        """
+        self.kpt_store = kpt_store
+        self.pairs = corr_file.pairs()
+        num = corr_file.num_corr()
+        self.offsets = np.concatenate([[0], np.cumsum(num)]).astype(np.int64)
+        # converted to int32 once, rather than per access.
+        self.feat_idx = corr_file.columns([13, 14]).astype(np.int32)
+        self.img_idx = np.repeat(self.pairs, num, axis=0)
+
+        n_img = max(len(kpt_store), int(self.pairs.max()) + 1 if self.pairs.shape[0] > 0 else 0)
+        self.num_kpts = kpt_store.num_kpts(np.arange(n_img))
+        self.kpt_offsets = np.concatenate([[0], np.cumsum(self.num_kpts)]).astype(np.int64)
+        if np.any((self.feat_idx < 0) | (self.feat_idx >= self.num_kpts[self.img_idx])):
+            raise ValueError('FEATURE_IDX out of the range of keypoints.')
+
+    def __len__(self):
+        return self.pairs.shape[0]
+
+    def kpt_ids(self):
+        """Get scene-wide keypoint ids of all correspondences.
+        Returns:
+            kpt_ids: Lx2 int64 ids, i.e., kpt_offsets[img_idx] + feat_idx.
+        """
+        return self.kpt_offsets[self.img_idx] + self.feat_idx
+
+    def keypoints(self, record_idx=None):
+        """Gather the keypoints of correspondences in bulk.
+        Args:
+            record_idx: record number, or None for all records.
+        Returns:
+            kpts0, kpts1: Lx6 float32 keypoints of both images.
+        """
+        rows = slice(None) if record_idx is None else \
+            slice(self.offsets[record_idx], self.offsets[record_idx + 1])
+        img_idx = self.img_idx[rows]
+        feat_idx = self.feat_idx[rows]
+        return (self.kpt_store.gather(img_idx[:, 0], feat_idx[:, 0]),
+                self.kpt_store.gather(img_idx[:, 1], feat_idx[:, 1]))
+
+    def match_counts(self):
+        """Count the correspondences of every keypoint over all records.
+        Returns:
+            counts: K-d int64 counts, indexed by scene-wide keypoint ids, of which the histogram of
+                image i is counts[kpt_offsets[i]:kpt_offsets[i + 1]].
+        """
+        return np.bincount(self.kpt_ids().ravel(), minlength=int(self.kpt_offsets[-1]))
+
+    def unmatched(self, img_idx=None, counts=None):
+        """Mark keypoints without any correspondence.
+        Args:
+            img_idx: image index, or None for all keypoints of the scene.
+            counts: precomputed match_counts.
+        Returns:
+            mask: bool mask of unmatched keypoints.
+        """
+        counts = self.match_counts() if counts is None else counts
+        if img_idx is not None:
+            counts = counts[self.kpt_offsets[img_idx]:self.kpt_offsets[img_idx + 1]]
+        return counts == 0
+
+    def join(self, record_idx):
+        """Attach the full keypoint sets of both images of a record.
+        Returns:
+            kpts0, kpts1: keypoints of both images.
+            feat_idx: Nx2 int32 feature indices of correspondences.
+            matched0, matched1: bool masks of keypoints matched in this record.
+        """
+        idx0, idx1 = self.pairs[record_idx]
+        feat_idx = self.feat_idx[self.offsets[record_idx]:self.offsets[record_idx + 1]]
+        matched0 = np.bincount(feat_idx[:, 0], minlength=self.num_kpts[idx0]) > 0
+        matched1 = np.bincount(feat_idx[:, 1], minlength=self.num_kpts[idx1]) > 0
+        return self.kpt_store[int(idx0)], self.kpt_store[int(idx1)], feat_idx, matched0, matched1
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Overlap matrices from mesh_overlap.txt / common_track.txt and pair sampling.
+"""
+
+from __future__ import print_function
+
+import os
+import numpy as np
+
+from .io import hash_int_pairs
+
+
+def read_overlap(file_path):
+    """Read the overlap ratio file, e.g., mesh_overlap.txt or common_track.txt.
+    Args:
+        file_path: file path.
+    Returns:
+        idx0, idx1: int64 image indices.
+        ratio: float32 overlap ratios of idx1 seen from idx0, not symmetric.
+    """
+    data = np.fromfile(file_path, sep=' ').reshape(-1, 3)
+    return data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2].astype(np.float32)
+
+
+class OverlapMatrix(object):
+    """Sparse overlap matrix of a scene in CSR layout."""
+
+    def __init__(self, idx0, idx1, ratio, n=None):
+        """
+        Args:
+            idx0, idx1: image indices of entries.
+            ratio: overlap ratios of entries.
+            n: image number, defaults to the maximum index plus one.
+        """
+        idx0 = np.asarray(idx0, dtype=np.int64)
+        idx1 = np.asarray(idx1, dtype=np.int64)
+        if n is None:
+            n = int(max(idx0.max(), idx1.max())) + 1 if idx0.shape[0] > 0 else 0
+        self.n = n
+        order = np.lexsort((idx1, idx0))
+        self.idx0 = idx0[order]
+        self.indices = idx1[order]
+        self.data = np.asarray(ratio, dtype=np.float32)[order]
+        self.indptr = np.searchsorted(self.idx0, np.arange(n + 1)).astype(np.int64)
+        self._keys = hash_int_pairs(self.idx0, self.indices)
+
+    @classmethod
+    def load(cls, file_path, n=None):
+        idx0, idx1, ratio = read_overlap(file_path)
+        return cls(idx0, idx1, ratio, n)
+
+    @property
+    def nnz(self):
+        return self.data.shape[0]
+
+    def row(self, idx):
+        """Get the overlapping images of an image.
+        Returns:
+            indices: image indices.
+            ratios: overlap ratios.
+        """
+        return self.indices[self.indptr[idx]:self.indptr[idx + 1]], \
+            self.data[self.indptr[idx]:self.indptr[idx + 1]]
+
+    def get(self, idx0, idx1):
+        """Get overlap ratios of image pairs, 0 if not listed.
+        Args:
+            idx0, idx1: image indices, scalars or arrays.
+        Returns:
+            ratio: overlap ratios.
+        """
+        keys = self._keys
+        query = hash_int_pairs(idx0, idx1)
+        if keys.shape[0] == 0:
+            return np.zeros(query.shape, dtype=np.float32)
+        pos = np.minimum(np.searchsorted(keys, query), keys.shape[0] - 1)
+        return np.where(keys[pos] == query, self.data[pos], 0).astype(np.float32)
+
+    def symmetric(self, mode='min'):
+        """Merge both directions of each pair.
+        Args:
+            mode: 'min' or 'max'. With 'min', pairs listed in one direction only are dropped.
+        Returns:
+            overlap: symmetric OverlapMatrix, holding both directions of each pair.
+        """
+        lo = np.minimum(self.idx0, self.indices)
+        hi = np.maximum(self.idx0, self.indices)
+        keys, inverse, counts = np.unique(hash_int_pairs(lo, hi), return_inverse=True,
+                                          return_counts=True)
+        merged = np.full(keys.shape[0], np.inf if mode == 'min' else -np.inf, dtype=np.float32)
+        if mode == 'min':
+            np.minimum.at(merged, inverse, self.data)
+            merged[counts < 2] = 0
+        elif mode == 'max':
+            np.maximum.at(merged, inverse, self.data)
+        else:
+            raise NotImplementedError()
+        first = np.zeros(keys.shape[0], dtype=np.int64)
+        first[inverse] = np.arange(inverse.shape[0])
+        lo, hi = lo[first], hi[first]
+        keep = (merged > 0) & (lo != hi)
+        lo, hi, merged = lo[keep], hi[keep], merged[keep]
+        return OverlapMatrix(np.concatenate([lo, hi]), np.concatenate([hi, lo]),
+                             np.concatenate([merged, merged]), self.n)
+
+    def pairs(self, min_ratio=0., max_ratio=1., upper=False):
+        """List pairs of overlap ratio in [min_ratio, max_ratio].
+        Args:
+            upper: whether to only list pairs of idx0 < idx1, e.g., for symmetric matrices.
+        Returns:
+            idx0, idx1, ratio.
+        """
+        mask = (self.data >= min_ratio) & (self.data <= max_ratio)
+        if upper:
+            mask &= self.idx0 < self.indices
+        return self.idx0[mask], self.indices[mask], self.data[mask]
+
+    def to_scipy(self):
+        """Convert to scipy.sparse.csr_matrix."""
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.data, self.indices, self.indptr), shape=(self.n, self.n))
+
+
+def load_scene_overlaps(data_root, pids, file_name='mesh_overlap.txt', symmetric=None):
+    """Load overlap matrices of scenes.
+    Args:
+        data_root: root of scene data.
+        pids: scene pids.
+        file_name: mesh_overlap.txt or common_track.txt.
+        symmetric: None, 'min' or 'max', see OverlapMatrix.symmetric.
+    Returns:
+        overlaps: a dictionary of OverlapMatrix indexed by pid, skipping scenes without the file.
+    """
+    overlaps = {}
+    for pid in pids:
+        file_path = os.path.join(data_root, pid, 'geolabel', file_name)
+        if not os.path.exists(file_path):
+            continue
+        overlap = OverlapMatrix.load(file_path)
+        overlaps[pid] = overlap.symmetric(symmetric) if symmetric is not None else overlap
+    return overlaps
+
+
+class PairSampler(object):
+    """Streaming sampler of pair batches, balanced over overlap ratio buckets.
+
+    Pairs of all scenes are bucketed by overlap ratio once. Each batch draws its pairs from the
+    buckets in equal (or bin_weights) proportions, and within a bucket, pairs are drawn with
+    probability proportional to the weight of their scenes. Draws are deterministic given the
+    seed, worker id and epoch.
+    """
+
+    def __init__(self, overlaps, bins=(0.1, 0.3, 0.5, 0.7, 1.0), bin_weights=None,
+                 scene_weights=None, upper=False, seed=0, worker_id=0):
+        """
+        Args:
+            overlaps: a dictionary of OverlapMatrix indexed by pid.
+            bins: bucket edges of overlap ratios, pairs out of [bins[0], bins[-1]] are dropped.
+            bin_weights: relative frequencies of buckets in a batch, defaults to uniform.
+            scene_weights: a dictionary of scene weights indexed by pid, or 'uniform' to draw
+                scenes evenly regardless of their pair numbers. Defaults to weight 1 for each pair.
+            upper: whether to only sample pairs of idx0 < idx1, e.g., for symmetric merges.
+            seed: random seed.
+            worker_id: worker id, e.g., of a data loader, to draw different streams.
+        """
+        self.pids = sorted(overlaps.keys())
+        self.bins = np.asarray(bins, dtype=np.float32)
+        self.seed = seed
+        self.worker_id = worker_id
+
+        scene_idx, idx0, idx1, ratio = [], [], [], []
+        for i, pid in enumerate(self.pids):
+            p0, p1, r = overlaps[pid].pairs(self.bins[0], self.bins[-1], upper=upper)
+            scene_idx.append(np.full(p0.shape, i, dtype=np.int32))
+            idx0.append(p0)
+            idx1.append(p1)
+            ratio.append(r)
+        self.scene_idx = np.concatenate(scene_idx) if scene_idx else np.zeros(0, np.int32)
+        self.idx0 = np.concatenate(idx0) if idx0 else np.zeros(0, np.int64)
+        self.idx1 = np.concatenate(idx1) if idx1 else np.zeros(0, np.int64)
+        self.ratio = np.concatenate(ratio) if ratio else np.zeros(0, np.float32)
+
+        # sort pairs by bucket.
+        bucket = np.clip(np.searchsorted(self.bins, self.ratio, side='right') - 1, 0, len(bins) - 2)
+        order = np.argsort(bucket, kind='stable')
+        self.scene_idx, self.idx0, self.idx1, self.ratio = \
+            self.scene_idx[order], self.idx0[order], self.idx1[order], self.ratio[order]
+        bucket = bucket[order]
+        self.bucket_ptr = np.searchsorted(bucket, np.arange(len(bins))).astype(np.int64)
+
+        # per-pair weights and cumulative weights within buckets.
+        if scene_weights == 'uniform':
+            pair_num = np.bincount(self.scene_idx, minlength=len(self.pids)).astype(np.float64)
+            weights = 1. / np.maximum(pair_num, 1)
+        elif scene_weights is not None:
+            weights = np.array([scene_weights.get(pid, 0.) for pid in self.pids], dtype=np.float64)
+        else:
+            weights = np.ones(len(self.pids))
+        pair_weights = weights[self.scene_idx] if self.scene_idx.shape[0] > 0 else np.zeros(0)
+        self.cum_weights = []
+        for b in range(len(bins) - 1):
+            self.cum_weights.append(np.cumsum(pair_weights[self.bucket_ptr[b]:self.bucket_ptr[b + 1]]))
+
+        bucket_valid = np.array([val.shape[0] > 0 and val[-1] > 0 for val in self.cum_weights])
+        bin_weights = np.ones(len(bins) - 1) if bin_weights is None else \
+            np.asarray(bin_weights, dtype=np.float64)
+        bin_weights = bin_weights * bucket_valid
+        if bin_weights.sum() <= 0:
+            raise ValueError('No pairs to sample.')
+        self.bin_prob = bin_weights / bin_weights.sum()
+
+    def __len__(self):
+        return self.ratio.shape[0]
+
+    def bucket_sizes(self):
+        return np.diff(self.bucket_ptr)
+
+    def get_rng(self, epoch=0):
+        return np.random.default_rng([self.seed, self.worker_id, epoch])
+
+    def sample(self, batch_size, rng):
+        """Draw a batch.
+        Returns:
+            scene_idx: indices into self.pids.
+            idx0, idx1: image indices.
+            ratio: overlap ratios.
+        """
+        counts = rng.multinomial(batch_size, self.bin_prob)
+        picked = []
+        for b, count in enumerate(counts):
+            if count == 0:
+                continue
+            cum_weights = self.cum_weights[b]
+            pos = np.searchsorted(cum_weights, rng.random(count) * cum_weights[-1], side='right')
+            picked.append(self.bucket_ptr[b] + np.minimum(pos, cum_weights.shape[0] - 1))
+        picked = rng.permutation(np.concatenate(picked))
+        return self.scene_idx[picked], self.idx0[picked], self.idx1[picked], self.ratio[picked]
+
+    def batches(self, batch_size, num_batches=None, epoch=0):
+        """Stream batches, see sample.
+        Args:
+            batch_size: batch size.
+            num_batches: number of batches, infinite if None.
+            epoch: epoch number, to draw different streams across epochs.
+        """
+        rng = self.get_rng(epoch)
+        count = 0
+        while num_batches is None or count < num_batches:
+            yield self.sample(batch_size, rng)
+            count += 1
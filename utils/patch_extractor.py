@@ -6,75 +6,122 @@ OpenCV helper.
 
 from __future__ import print_function
 
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import cv2
 
+# OpenCV remap requires both map dimensions to be smaller than SHRT_MAX.
+MAX_REMAP_DIM = 32766
+
+_OUTPUT_GRIDS = {}
+
+
+def get_output_grid(patch_size):
+    """Get the (cached) sampling grid of a patch.
+    Args:
+        patch_size: patch size.
+    Returns:
+        output_grid: (patch_size^2)x3 homogeneous grid coordinates, normalized to [-1, +1).
+    """
+    output_grid = _OUTPUT_GRIDS.get(patch_size)
+    if output_grid is None:
+        pixel_idx = np.arange(np.square(patch_size))
+        output_grid = np.ones((pixel_idx.shape[0], 3), dtype=np.float32)
+        output_grid[:, 0] = (pixel_idx % patch_size) * 1. / patch_size * 2 - 1
+        output_grid[:, 1] = (pixel_idx // patch_size) * 1. / patch_size * 2 - 1
+        output_grid.flags.writeable = False
+        _OUTPUT_GRIDS[patch_size] = output_grid
+    return output_grid
+
 
 class PatchExtractor(object):
     """"OpenCV SIFT wrapper."""
 
-    def __init__(self, patch_size=32):
+    def __init__(self, patch_size=32, num_threads=1):
+        """
+        Args:
+            patch_size: patch size.
+            num_threads: number of threads to sample patch chunks concurrently.
+        """
         self.patch_size = patch_size
+        self.num_threads = num_threads
+        self.output_grid = get_output_grid(patch_size)
 
-    def get_interest_region(self, gray_img, kpts):
+    def get_affine_mats(self, kpts, H, W):
+        """Construct the affine transformation matrices of all keypoints.
+        Args:
+            kpts: Nx6 keypoint transformation.
+            H, W: image height and width.
+        Returns:
+            affine_mats: Nx3x2 affine transformation matrices.
+        """
+        # keep the scalar type promotion of per-keypoint construction so that results stay identical.
+        kpts = kpts.astype(np.result_type(kpts.dtype.type(0) * W), copy=False)
+        affine_mats = np.empty((kpts.shape[0], 3, 2), dtype=np.float32)
+        affine_mats[:, 0, 0] = kpts[:, 0] * W / 2
+        affine_mats[:, 1, 0] = kpts[:, 1] * W / 2
+        affine_mats[:, 2, 0] = kpts[:, 2] * W / 2 + W / 2
+        affine_mats[:, 0, 1] = kpts[:, 3] * H / 2
+        affine_mats[:, 1, 1] = kpts[:, 4] * H / 2
+        affine_mats[:, 2, 1] = kpts[:, 5] * H / 2 + H / 2
+        return affine_mats
+
+    def _sample(self, img, affine_mats):
+        n_pixel = self.output_grid.shape[0]
+        # get input grids, one patch per map row or, for large patches, one patch row per map row.
+        input_grid = np.matmul(self.output_grid, affine_mats)
+        row_len = n_pixel if n_pixel <= MAX_REMAP_DIM else self.patch_size
+        input_grid = np.reshape(input_grid, (-1, row_len, 2))
+        patches = cv2.remap(img, input_grid, None,
+                            interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        return np.reshape(patches, (affine_mats.shape[0], self.patch_size, self.patch_size))
+
+    def get_interest_region(self, gray_img, kpts, dtype=np.float32):
         """Get the interest region around a keypoint.
         Args:
             gray_img: Grayscale input image.
             kpts: Nx6 keypoint transformation.
+            dtype: output type, np.float32 or np.uint8. uint8 patches are sampled with the
+                fixed-point interpolation of OpenCV and may differ by one from rounded float32 ones.
         Returns:
             all_patches: An array of patches of Nx32x32.
         """
-
         kpt_n = kpts.shape[0]
+        if kpt_n == 0:
+            return None
         H = gray_img.shape[0]
         W = gray_img.shape[1]
-        batch_input_grid = []
-        all_patches = []
-        bs = 30  # limited by OpenCV remap implementation
-        for idx in range(kpt_n):
-            # construct affine transformation matrix.
-            affine_mat = np.zeros((3, 2), dtype=np.float32)
-            affine_mat[0, 0] = kpts[idx, 0] * W / 2
-            affine_mat[1, 0] = kpts[idx, 1] * W / 2
-            affine_mat[2, 0] = kpts[idx, 2] * W / 2 + W / 2
-            affine_mat[0, 1] = kpts[idx, 3] * H / 2
-            affine_mat[1, 1] = kpts[idx, 4] * H / 2
-            affine_mat[2, 1] = kpts[idx, 5] * H / 2 + H / 2
-            # get input grid.
-            input_grid = np.matmul(self.output_grid, affine_mat)
-            input_grid = np.reshape(input_grid, (-1, 1, 2))
-            batch_input_grid.append(input_grid)
-
-            if len(batch_input_grid) != 0 and len(batch_input_grid) % bs == 0 or idx == kpt_n - 1:
-                # sample image pixels.
-                batch_input_grid_ = np.concatenate(batch_input_grid, axis=0)
-                patches = cv2.remap(gray_img.astype(np.float32), batch_input_grid_,
-                                    None, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
-                patches = np.reshape(patches, (len(batch_input_grid),
-                                               self.patch_size, self.patch_size))
-                all_patches.append(patches)
-                batch_input_grid = []
-        if len(all_patches) != 0:
-            all_patches = np.concatenate(all_patches, axis=0)
+        if dtype == np.uint8:
+            img = gray_img if gray_img.dtype == np.uint8 else \
+                np.clip(np.round(gray_img), 0, 255).astype(np.uint8)
         else:
-            all_patches = None
-        return all_patches
+            img = gray_img.astype(np.float32, copy=False)
+
+        affine_mats = self.get_affine_mats(kpts, H, W)
+        n_pixel = self.output_grid.shape[0]
+        max_bs = MAX_REMAP_DIM // (1 if n_pixel <= MAX_REMAP_DIM else self.patch_size)
+        bs = min(max_bs, -(-kpt_n // max(self.num_threads, 1)))
+        chunks = [affine_mats[i:i + bs] for i in range(0, kpt_n, bs)]
 
-    def get_patches(self, gray_img, kpts):
+        if self.num_threads > 1 and len(chunks) > 1:
+            # cv2.remap releases the GIL.
+            with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+                all_patches = list(executor.map(lambda x: self._sample(img, x), chunks))
+        else:
+            all_patches = [self._sample(img, x) for x in chunks]
+        if len(all_patches) == 1:
+            return all_patches[0]
+        return np.concatenate(all_patches, axis=0)
+
+    def get_patches(self, gray_img, kpts, dtype=np.float32):
         """Get all patches around given keypoints.
         Args:
-            cv_kpts: A list of keypoints represented as cv2.KeyPoint.
+            gray_img: Grayscale input image.
+            kpts: Nx6 keypoint transformation.
+            dtype: output type, see get_interest_region.
         Return:
             all_patches: (n_kpts, 32, 32) Cropped patches.
         """
-
-        # generate sampling grids.
-        n_pixel = np.square(self.patch_size)
-        self.output_grid = np.zeros((n_pixel, 3), dtype=np.float32)
-        for i in range(n_pixel):
-            self.output_grid[i, 0] = (i % self.patch_size) * 1. / self.patch_size * 2 - 1
-            self.output_grid[i, 1] = (i // self.patch_size) * 1. / self.patch_size * 2 - 1
-            self.output_grid[i, 2] = 1
-
-        all_patches = self.get_interest_region(gray_img, kpts)
+        all_patches = self.get_interest_region(gray_img, kpts, dtype)
         return all_patches
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Prefetching iterator of image pair samples.
+
+Each (pid, idx0, idx1) of a pair stream is split into stage tasks, i.e., reading both images,
+both depth maps, and the cameras and correspondences of the pair, which run concurrently on a
+thread pool. At most prefetch samples are in flight, and pairs are only drawn from the stream as
+samples are consumed, so that a slow consumer holds back reading.
+"""
+
+from __future__ import print_function
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Queue
+
+import numpy as np
+
+from .io import load_pfm, CorrFile
+from .camera import CameraSet
+from .geom import scale_intrinsics
+from .image import load_image
+from .index import FILE_TYPES
+
+
+def sampler_pairs(sampler, batch_size, num_batches=None, epoch=0):
+    """Flatten batches of a pair_sampler.PairSampler into a (pid, idx0, idx1) stream."""
+    for scene_idx, idx0, idx1, _ in sampler.batches(batch_size, num_batches, epoch):
+        for i in range(scene_idx.shape[0]):
+            yield sampler.pids[scene_idx[i]], int(idx0[i]), int(idx1[i])
+
+
+class StageStats(object):
+    """Latency statistics of pipeline stages, kept over the last window calls of each stage."""
+
+    def __init__(self, window=10000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._times = {}
+        self._counts = {}
+
+    def add(self, stage, elapsed):
+        with self._lock:
+            if stage not in self._times:
+                self._times[stage] = deque(maxlen=self.window)
+                self._counts[stage] = 0
+            self._times[stage].append(elapsed)
+            self._counts[stage] += 1
+
+    def summary(self):
+        """Returns:
+            summary: a dictionary of (count, mean, p50, p95, max) in seconds indexed by stage.
+        """
+        with self._lock:
+            items = [(key, np.array(val), self._counts[key]) for key, val in self._times.items()]
+        summary = {}
+        for stage, times, count in items:
+            summary[stage] = {'count': count, 'mean': float(times.mean()),
+                              'p50': float(np.percentile(times, 50)),
+                              'p95': float(np.percentile(times, 95)), 'max': float(times.max())}
+        return summary
+
+
+class _SceneEntry(object):
+    """Handles of an open scene, loaded once into future, with the number of threads using them."""
+
+    def __init__(self):
+        self.future = Future()
+        self.refs = 0
+        self.evicted = False
+
+    def close(self):
+        if self.future.done() and self.future.exception() is None:
+            corr_file = self.future.result()[1]
+            if corr_file is not None:
+                corr_file.close()
+
+
+class PairPrefetcher(object):
+    """Read samples of image pairs on a thread pool ahead of the consumer, e.g.,
+        with PairPrefetcher('data', img_size=(640, 480)) as prefetcher:
+            for sample in prefetcher.iterate(sampler_pairs(sampler, 32)):
+                train_step(sample)
+            print(prefetcher.stats.summary())
+    """
+
+    def __init__(self, data_root, img_size=None, scale=None, image_type='image', depth_type='depth',
+                 parts=('image', 'depth', 'scene'), num_threads=8, prefetch=16, ordered=True,
+                 skip_errors=False, max_scenes=64, **kwargs):
+        """
+        Args:
+            data_root: root of scene data.
+            img_size, scale, kwargs: see image.read_image.
+            image_type, depth_type: file types of index.FILE_TYPES, e.g., 'blended_image',
+                'rendered_depth'.
+            parts: stages to read, of 'image', 'depth' and 'scene', i.e., cameras and correspondences.
+            num_threads: number of reading threads.
+            prefetch: maximum number of samples in flight, including those ready but not consumed.
+            ordered: whether to deliver samples in the order of pairs, otherwise as they are ready.
+            skip_errors: whether to drop samples failing to read, otherwise errors are raised.
+            max_scenes: maximum number of scenes of which cameras and correspondence files are open.
+        """
+        self.data_root = data_root
+        self.img_size = img_size
+        self.scale = scale
+        self.image_kwargs = kwargs
+        self.image_type = image_type
+        self.depth_type = depth_type
+        self.parts = parts
+        self.prefetch = prefetch
+        self.ordered = ordered
+        self.skip_errors = skip_errors
+        self.max_scenes = max_scenes
+        self.stats = StageStats()
+        self.errors = []
+        self.executor = ThreadPoolExecutor(num_threads)
+        self._scenes = OrderedDict()
+        self._scene_lock = threading.Lock()
+
+    def _path(self, pid, file_type, img_idx):
+        sub_dir, ext = FILE_TYPES[file_type]
+        return os.path.join(self.data_root, pid, sub_dir, str(img_idx).zfill(8) + ext)
+
+    def _load_scene(self, pid):
+        geolabel = os.path.join(self.data_root, pid, 'geolabel')
+        corr_path = os.path.join(geolabel, 'corr.bin')
+        return (CameraSet.load(os.path.join(geolabel, 'cameras.txt')),
+                CorrFile(corr_path) if os.path.exists(corr_path) else None)
+
+    @contextmanager
+    def scene(self, pid):
+        """Use the cameras and the correspondence file of a scene, e.g.,
+            with prefetcher.scene(pid) as (cam_set, corr_file):
+                ...
+        Handles are loaded by the first thread asking for them while others wait, kept open for
+        later samples, and closed once max_scenes other scenes are opened and no thread uses them.
+        Yields:
+            (cam_set, corr_file): CameraSet and CorrFile, or None if corr.bin does not exist.
+        """
+        with self._scene_lock:
+            entry = self._scenes.get(pid)
+            load = entry is None
+            if load:
+                entry = self._scenes[pid] = _SceneEntry()
+            else:
+                self._scenes.move_to_end(pid)
+            entry.refs += 1
+            while len(self._scenes) > self.max_scenes:
+                _, evicted = self._scenes.popitem(last=False)
+                evicted.evicted = True
+                if evicted.refs == 0:
+                    evicted.close()
+        try:
+            if load:
+                try:
+                    handles = self._load_scene(pid)
+                except BaseException as err:
+                    # failed scenes are loaded again by later samples.
+                    with self._scene_lock:
+                        if self._scenes.get(pid) is entry:
+                            del self._scenes[pid]
+                    entry.future.set_exception(err)
+                    raise
+                entry.future.set_result(handles)
+            yield entry.future.result()
+        finally:
+            with self._scene_lock:
+                entry.refs -= 1
+                if entry.evicted and entry.refs == 0:
+                    entry.close()
+
+    def _timed(self, stage, fn, *args):
+        start_time = time.time()
+        result = fn(*args)
+        self.stats.add(stage, time.time() - start_time)
+        return result
+
+    def _read_image(self, pid, img_idx):
+        with self.scene(pid) as (cam_set, _):
+            K, _, _, _, ori_img_size = cam_set[img_idx]
+        return load_image(self._path(pid, self.image_type, img_idx), K, ori_img_size,
+                          self.img_size, self.scale, **self.image_kwargs)
+
+    def _read_depth(self, pid, img_idx):
+        return load_pfm(self._path(pid, self.depth_type, img_idx))
+
+    def _read_scene(self, pid, idx0, idx1):
+        with self.scene(pid) as (cam_set, corr_file):
+            corr = None
+            if corr_file is not None:
+                record_idx = corr_file.find(idx0, idx1)
+                if record_idx >= 0:
+                    # copied here, so that pages are read on the reading thread.
+                    corr = np.array(corr_file[record_idx][2])
+            return cam_set[idx0], cam_set[idx1], corr
+
+    def _submit(self, pid, idx0, idx1):
+        """Submit the stage tasks of a sample.
+        Returns:
+            tasks: a dictionary of futures indexed by stage output.
+        """
+        tasks = {}
+        if 'image' in self.parts:
+            tasks['image0'] = self.executor.submit(self._timed, 'image', self._read_image, pid, idx0)
+            tasks['image1'] = self.executor.submit(self._timed, 'image', self._read_image, pid, idx1)
+        if 'depth' in self.parts:
+            tasks['depth0'] = self.executor.submit(self._timed, 'depth', self._read_depth, pid, idx0)
+            tasks['depth1'] = self.executor.submit(self._timed, 'depth', self._read_depth, pid, idx1)
+        if 'scene' in self.parts:
+            tasks['scene'] = self.executor.submit(self._timed, 'scene', self._read_scene, pid, idx0, idx1)
+        return tasks
+
+    def _assemble(self, pid, idx0, idx1, tasks):
+        """Assemble a sample from finished tasks.
+        Returns:
+            sample: a dictionary of
+                pid, idx0, idx1: the pair.
+                image0, image1, K0, K1: images and intrinsics rescaled to the image size.
+                depth0, depth1, depth_K0, depth_K1: depth maps and intrinsics at the depth resolution.
+                cam0, cam1: (K, t, R, dist, img_size) of CameraSet.
+                corr: Nx15 correspondences, or None if the pair has no matching record.
+        """
+        sample = {'pid': pid, 'idx0': idx0, 'idx1': idx1}
+        if 'scene' in tasks:
+            sample['cam0'], sample['cam1'], sample['corr'] = tasks['scene'].result()
+        for i in range(2):
+            if 'image%d' % i in tasks:
+                sample['image%d' % i], sample['K%d' % i] = tasks['image%d' % i].result()
+            if 'depth%d' % i in tasks:
+                depth = tasks['depth%d' % i].result()
+                sample['depth%d' % i] = depth
+                if 'cam%d' % i in sample:
+                    K, _, _, _, ori_img_size = sample['cam%d' % i]
+                    sample['depth_K%d' % i] = scale_intrinsics(K, ori_img_size, depth.shape[0:2][::-1])
+        return sample
+
+    def iterate(self, pairs):
+        """Iterate samples of pairs, see _assemble.
+        Args:
+            pairs: iterable of (pid, idx0, idx1), e.g., of sampler_pairs.
+        Yields:
+            sample: a dictionary of sample data.
+        """
+        pairs = iter(pairs)
+        ready = Queue()
+        pending = {}
+        exhausted = False
+        next_seq = 0
+        # next sequence number to deliver in order, and ready samples not delivered yet.
+        deliver_seq = 0
+        received = {}
+        try:
+            while True:
+                while not exhausted and len(pending) + len(received) < self.prefetch:
+                    try:
+                        pid, idx0, idx1 = next(pairs)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    tasks = self._submit(pid, int(idx0), int(idx1))
+                    pending[next_seq] = (pid, int(idx0), int(idx1), tasks, time.time())
+                    self._notify_when_done(next_seq, tasks, ready)
+                    next_seq += 1
+                if not pending and not received:
+                    return
+
+                wait_start = time.time()
+                while True:
+                    if self.ordered and deliver_seq in received:
+                        seq = deliver_seq
+                        break
+                    if not self.ordered and received:
+                        seq = next(iter(received))
+                        break
+                    done_seq = ready.get()
+                    pid, idx0, idx1, tasks, submit_time = pending.pop(done_seq)
+                    self.stats.add('sample', time.time() - submit_time)
+                    received[done_seq] = (pid, idx0, idx1, tasks)
+                self.stats.add('wait', time.time() - wait_start)
+
+                pid, idx0, idx1, tasks = received.pop(seq)
+                deliver_seq += 1
+                try:
+                    sample = self._assemble(pid, idx0, idx1, tasks)
+                except Exception as err:  # pylint: disable=broad-except
+                    if not self.skip_errors:
+                        raise
+                    self.errors.append({'pid': pid, 'idx0': idx0, 'idx1': idx1,
+                                        'error': '%s: %s' % (type(err).__name__, err)})
+                    continue
+                yield sample
+        finally:
+            for _, _, _, tasks, _ in pending.values():
+                for future in tasks.values():
+                    future.cancel()
+
+    @staticmethod
+    def _notify_when_done(seq, tasks, ready):
+        """Put the sequence number of a sample into ready once all its tasks are done."""
+        if not tasks:
+            ready.put(seq)
+            return
+        remaining = [len(tasks)]
+        lock = threading.Lock()
+
+        def _done(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                ready.put(seq)
+        for future in tasks.values():
+            future.add_done_callback(_done)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self._scene_lock:
+            for entry in self._scenes.values():
+                entry.close()
+            self._scenes.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Opt-in instrumentation of utils readers and geometry functions.
+
+Functions decorated by profiled record call counts, wall time, bytes read from files, bytes of
+returned arrays and, optionally, peak allocation, aggregated per function and per scene. Bytes read
+are reported by the functions themselves through add_bytes_read, e.g., only the region of a cropped
+depth map, or the headers of a correspondence file, and include those of nested calls. When
+disabled, which is the default, a decorated call costs one flag check, i.e., ~0.2us, so zero-copy
+per-record accessors, e.g., CorrFile.__getitem__, are not decorated.
+
+Profiling is enabled by enable(), or for whole runs by setting the environment variable
+GL3D_PROFILE_DIR, in which case each process writes profile.<pid>.json there at exit, merged by
+merge_profiles, e.g.,
+    GL3D_PROFILE_DIR=prof python train.py
+    python -c "from utils.profiler import merge_profiles; print(merge_profiles('prof'))"
+Only aggregated statistics are kept by default. Setting GL3D_PROFILE_TRACE=1 also keeps an event
+per call, up to max_events per process, written to trace.<pid>.json for chrome://tracing or
+Perfetto. Workers of multiprocessing pools write their profiles when they exit normally, i.e., after
+pool.close() and pool.join(), not terminate().
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import time
+import atexit
+import threading
+import functools
+import contextvars
+import tracemalloc
+
+import numpy as np
+
+# folders of scene data, of which the parent is named by the scene pid.
+SCENE_FOLDERS = set(['geolabel', 'depths', 'rendered_depths', 'img_kpts', 'undist_kpts',
+                     'undist_images', 'images', 'masks', 'ortho'])
+
+
+class _State(object):
+    enabled = False
+    trace = False
+    trace_alloc = False
+    max_events = 100000
+
+
+_state = _State()
+_lock = threading.Lock()
+_stats = {}
+_events = []
+_scene = contextvars.ContextVar('gl3d_profile_scene', default=None)
+_alloc_stack = threading.local()
+_io_stack = threading.local()
+
+
+def enable(trace=False, trace_alloc=False, max_events=100000):
+    """Enable profiling.
+    Args:
+        trace: whether to keep events of each call for dump_chrome_trace.
+        trace_alloc: whether to measure peak allocation by tracemalloc, which slows down calls.
+            Allocations of concurrent threads are attributed to the calls running meanwhile.
+        max_events: maximum number of trace events kept, each taking ~0.6KB.
+    """
+    _state.trace = trace
+    _state.trace_alloc = trace_alloc
+    _state.max_events = max_events
+    if trace_alloc and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _state.enabled = True
+
+
+def disable():
+    _state.enabled = False
+
+
+def is_enabled():
+    return _state.enabled
+
+
+def reset():
+    """Clear recorded statistics and events."""
+    with _lock:
+        _stats.clear()
+        del _events[:]
+
+
+def _reset_in_child():
+    # statistics of the parent are reported by the parent.
+    global _lock
+    _lock = threading.Lock()
+    _stats.clear()
+    del _events[:]
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_in_child)
+
+
+def _scene_of(path):
+    """Infer the scene pid from a path of scene data, e.g., <root>/<pid>/geolabel/corr.bin."""
+    if not isinstance(path, str):
+        return None
+    parts = os.path.normpath(path).split(os.sep)
+    for i in range(len(parts) - 2, 0, -1):
+        if parts[i] in SCENE_FOLDERS:
+            return parts[i - 1]
+    return None
+
+
+def _array_bytes(result, depth=2):
+    """Get bytes of arrays in a result, e.g., records of (idx0, idx1, corr) of read_corr."""
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if depth > 0 and isinstance(result, (tuple, list)):
+        return sum([_array_bytes(val, depth - 1) for val in result])
+    return 0
+
+
+def record(name, elapsed, scene=None, bytes_read=0, array_bytes=0, peak_alloc=0, start=None, args=None):
+    """Record a call.
+    Args:
+        name: function or section name.
+        elapsed: wall time in seconds.
+        scene: scene pid, defaults to the one of the current scene context.
+        start: start time of time.time(), for trace events.
+    """
+    scene = scene if scene is not None else _scene.get()
+    with _lock:
+        key = (name, scene)
+        stat = _stats.get(key)
+        if stat is None:
+            stat = _stats[key] = {'calls': 0, 'time': 0., 'max_time': 0., 'bytes_read': 0,
+                                  'array_bytes': 0, 'peak_alloc': 0}
+        stat['calls'] += 1
+        stat['time'] += elapsed
+        stat['max_time'] = max(stat['max_time'], elapsed)
+        stat['bytes_read'] += bytes_read
+        stat['array_bytes'] += array_bytes
+        stat['peak_alloc'] = max(stat['peak_alloc'], peak_alloc)
+        if _state.trace and start is not None and len(_events) < _state.max_events:
+            event_args = {'scene': scene, 'bytes_read': bytes_read, 'array_bytes': array_bytes}
+            if args:
+                event_args.update(args)
+            _events.append({'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': elapsed * 1e6,
+                            'pid': os.getpid(), 'tid': threading.get_ident(), 'args': event_args})
+
+
+def add_bytes_read(nbytes):
+    """Report bytes read from files, or mapped to be read, by the running profiled call or span.
+    Bytes are also counted in the enclosing calls of the same thread."""
+    if not _state.enabled:
+        return
+    stack = getattr(_io_stack, 'frames', None)
+    if stack:
+        stack[-1][0] += nbytes
+
+
+def _io_enter():
+    stack = getattr(_io_stack, 'frames', None)
+    if stack is None:
+        stack = _io_stack.frames = []
+    stack.append([0])
+
+
+def _io_exit():
+    stack = _io_stack.frames
+    nbytes = stack.pop()[0]
+    if stack:
+        stack[-1][0] += nbytes
+    return nbytes
+
+
+def _alloc_enter():
+    stack = getattr(_alloc_stack, 'frames', None)
+    if stack is None:
+        stack = _alloc_stack.frames = []
+    current, peak = tracemalloc.get_traced_memory()
+    # the peak is reset for this call, so that outer calls keep their peak so far.
+    for frame in stack:
+        frame[1] = max(frame[1], peak)
+    tracemalloc.reset_peak()
+    stack.append([current, current])
+
+
+def _alloc_exit():
+    stack = _alloc_stack.frames
+    _, peak = tracemalloc.get_traced_memory()
+    start, frame_peak = stack.pop()
+    for frame in stack:
+        frame[1] = max(frame[1], peak)
+    return max(frame_peak, peak) - start
+
+
+class span(object):
+    """Context manager recording a section, e.g.,
+        with span('load_scene', scene=pid):
+            ...
+    """
+
+    def __init__(self, name, scene=None, **args):
+        self.name = name
+        self.scene = scene
+        self.args = args
+
+    def __enter__(self):
+        self.active = _state.enabled
+        if self.active:
+            self.token = _scene.set(self.scene) if self.scene is not None else None
+            self.alloc = _state.trace_alloc and tracemalloc.is_tracing()
+            if self.alloc:
+                _alloc_enter()
+            _io_enter()
+            self.start = time.time()
+            self.perf_start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        if not self.active:
+            return
+        elapsed = time.perf_counter() - self.perf_start
+        peak_alloc = _alloc_exit() if self.alloc else 0
+        record(self.name, elapsed, bytes_read=_io_exit(), peak_alloc=peak_alloc, start=self.start,
+               args=self.args)
+        if self.token is not None:
+            _scene.reset(self.token)
+
+
+class scene(object):
+    """Context manager attributing calls to a scene, e.g.,
+        with scene(pid):
+            corr = read_corr(corr_path)
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+
+    def __enter__(self):
+        self.token = _scene.set(self.pid)
+        return self
+
+    def __exit__(self, *args):
+        _scene.reset(self.token)
+
+
+def profiled(name=None, path_arg=None):
+    """Decorate a function to be profiled when enabled.
+    Args:
+        name: recorded name, defaults to <module>.<qualified name>.
+        path_arg: position of the file path argument, of which the scene is inferred if not given by
+            scene().
+    """
+    def _decorate(fn):
+        fn_name = name if name is not None else \
+            '%s.%s' % (fn.__module__.rsplit('.', 1)[-1], fn.__qualname__)
+
+        @functools.wraps(fn)
+        def _wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return fn(*args, **kwargs)
+            alloc = _state.trace_alloc and tracemalloc.is_tracing()
+            if alloc:
+                _alloc_enter()
+            _io_enter()
+            start = time.time()
+            perf_start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - perf_start
+                peak_alloc = _alloc_exit() if alloc else 0
+                bytes_read = _io_exit()
+            file_scene = None
+            if path_arg is not None and len(args) > path_arg and _scene.get() is None:
+                file_scene = _scene_of(args[path_arg])
+            record(fn_name, elapsed, file_scene, bytes_read, _array_bytes(result), peak_alloc, start)
+            return result
+        return _wrapper
+    return _decorate
+
+
+def summary(by='function'):
+    """Summarize recorded calls.
+    Args:
+        by: 'function' to aggregate over scenes, 'scene' to aggregate over functions, or 'both'.
+    Returns:
+        summary: a dictionary of statistics indexed by function name, scene pid or
+            '<function>@<scene>', where calls without scene are indexed by None or '<function>'.
+    """
+    with _lock:
+        items = [(key, dict(val)) for key, val in _stats.items()]
+    return _aggregate(items, by)
+
+
+def _aggregate(items, by):
+    result = {}
+    for (fn_name, scene_pid), stat in items:
+        if by == 'function':
+            key = fn_name
+        elif by == 'scene':
+            key = scene_pid
+        else:
+            key = fn_name if scene_pid is None else '%s@%s' % (fn_name, scene_pid)
+        if key not in result:
+            result[key] = dict(stat)
+            continue
+        agg = result[key]
+        for field in ('calls', 'time', 'bytes_read', 'array_bytes'):
+            agg[field] += stat[field]
+        agg['max_time'] = max(agg['max_time'], stat['max_time'])
+        agg['peak_alloc'] = max(agg['peak_alloc'], stat['peak_alloc'])
+    return result
+
+
+def dump_json(path):
+    """Save statistics per function and scene, which can be merged by merge_profiles."""
+    with _lock:
+        stats = [{'name': key[0], 'scene': key[1], 'stats': val} for key, val in _stats.items()]
+    with open(path, 'w') as fout:
+        json.dump({'pid': os.getpid(), 'stats': stats}, fout, indent=1)
+
+
+def dump_chrome_trace(path):
+    """Save trace events, recorded if enabled with trace=True, in the Chrome trace format."""
+    with _lock:
+        events = list(_events)
+    with open(path, 'w') as fout:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fout)
+
+
+def merge_profiles(prof_dir, by='both'):
+    """Merge profile.<pid>.json of processes, see summary.
+    Returns:
+        summary: merged statistics.
+    """
+    items = []
+    for basename in sorted(os.listdir(prof_dir)):
+        if not (basename.startswith('profile.') and basename.endswith('.json')):
+            continue
+        with open(os.path.join(prof_dir, basename)) as fin:
+            for val in json.load(fin)['stats']:
+                items.append(((val['name'], val['scene']), val['stats']))
+    return _aggregate(items, by)
+
+
+def _dump_at_exit(prof_dir):
+    pid = os.getpid()
+    if not _stats and not _events:
+        return
+    dump_json(os.path.join(prof_dir, 'profile.%d.json' % pid))
+    if _state.trace:
+        dump_chrome_trace(os.path.join(prof_dir, 'trace.%d.json' % pid))
+
+
+def _register_dump(prof_dir):
+    from multiprocessing.util import Finalize, register_after_fork
+    atexit.register(_dump_at_exit, prof_dir)
+    # forked multiprocessing workers exit by os._exit, without running atexit callbacks.
+    register_after_fork(_state, lambda _: Finalize(None, _dump_at_exit, args=(prof_dir,), exitpriority=0))
+
+
+if os.environ.get('GL3D_PROFILE_DIR'):
+    os.makedirs(os.environ['GL3D_PROFILE_DIR'], exist_ok=True)
+    enable(trace=os.environ.get('GL3D_PROFILE_TRACE', '0') == '1',
+           trace_alloc=os.environ.get('GL3D_PROFILE_ALLOC', '0') == '1')
+    _register_dump(os.environ['GL3D_PROFILE_DIR'])
@@ -0,0 +1,448 @@
+#!/usr/bin/env python
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Scene loader sharing decoded scenes across processes.
+
+Each scene is decoded once into a shared memory block, which holds the cameras, the corr index,
+packed masks and keypoints. Worker processes attach to the block by name and read zero-copy NumPy
+views. A registry in shared memory counts references of scenes and evicts least recently used
+scenes without references once the memory budget is exceeded. Scenes being decoded by a process
+which died or exceeded the load timeout are decoded again by the next process asking for them.
+
+The loader must be created in the main process and handed to workers at process creation, e.g., as
+an argument of multiprocessing.Process or of a Pool initializer, since it holds a lock.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import uuid
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .io import CorrFile, MaskFile, read_kpt, hash_int_pairs
+from .camera import CameraSet
+
+EMPTY, LOADING, READY = 0, 1, 2
+
+# loader is the OS process id decoding a LOADING scene, and last_used its start time.
+REGISTRY_DTYPE = np.dtype([('pid', 'S64'), ('state', '<i4'), ('refcount', '<i4'),
+                           ('generation', '<i8'), ('last_used', '<f8'), ('nbytes', '<i8'),
+                           ('loader', '<i8')])
+
+ALIGN = 64
+
+
+def _open_shm(name, create=False, size=0):
+    """Open a shared memory block, which is not unlinked by the resource tracker on process exit."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    # Python < 3.13 registers every opened block to the resource tracker.
+    shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    from multiprocessing import resource_tracker
+    resource_tracker.unregister(shm._name, 'shared_memory')  # pylint: disable=protected-access
+    return shm
+
+
+def _unlink_shm(name):
+    """Unlink a shared memory block opened by _open_shm, if it exists."""
+    try:
+        shm = _open_shm(name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    if sys.version_info < (3, 13):
+        # unlink unregisters the block on Python < 3.13, so register it back first.
+        from multiprocessing import resource_tracker
+        resource_tracker.register(shm._name, 'shared_memory')  # pylint: disable=protected-access
+    shm.unlink()
+
+
+def _process_alive(os_pid):
+    """Check whether a process exists and is not a zombie."""
+    try:
+        os.kill(os_pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    try:
+        with open('/proc/%d/stat' % os_pid) as fin:
+            # a killed process not reaped by its parent yet, e.g., of a multiprocessing pool.
+            return fin.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (OSError, IndexError):
+        return True
+
+
+def decode_scene(scene_root, parts=('cams', 'corr', 'mask', 'kpts'), mask_size=32):
+    """Decode a scene into flat arrays.
+    Args:
+        scene_root: scene directory.
+        parts: parts to decode.
+        mask_size: mask size.
+    Returns:
+        arrays: a dictionary of arrays.
+    """
+    arrays = {}
+    cam_set = CameraSet.load(os.path.join(scene_root, 'geolabel', 'cameras.txt'))
+    if 'cams' in parts:
+        for key in ['ids', 'K', 'K_inv', 't', 'R', 'dist', 'img_size', 'centers']:
+            arrays['cams_' + key] = getattr(cam_set, key)
+    if 'corr' in parts:
+        corr_path = os.path.join(scene_root, 'geolabel', 'corr.bin')
+        if os.path.exists(corr_path):
+            arrays['corr_index'] = CorrFile(corr_path).index
+    if 'mask' in parts:
+        mask_path = os.path.join(scene_root, 'geolabel', 'mask.bin')
+        if os.path.exists(mask_path):
+            mask_file = MaskFile(mask_path, size=mask_size, packed=True)
+            pairs = mask_file.pairs()
+            keys = hash_int_pairs(pairs[:, 0], pairs[:, 1])
+            order = np.argsort(keys, kind='stable')
+            arrays['mask_keys'] = keys[order]
+            arrays['mask_packed'] = np.asarray(mask_file.packed_masks)[order]
+    if 'kpts' in parts:
+        n_img = int(cam_set.ids.max()) + 1 if len(cam_set) > 0 else 0
+        kpts = []
+        for i in range(n_img):
+            kpt_path = os.path.join(scene_root, 'img_kpts', str(i).zfill(8) + '.bin')
+            kpts.append(read_kpt(kpt_path) if os.path.exists(kpt_path) else np.zeros((0, 6), np.float32))
+        arrays['kpts_offsets'] = np.concatenate(
+            [[0], np.cumsum([val.shape[0] for val in kpts])]).astype(np.int64)
+        arrays['kpts'] = np.concatenate(kpts, axis=0) if kpts else np.zeros((0, 6), np.float32)
+    return arrays
+
+
+def _layout(arrays):
+    """Compute the block layout.
+    Returns:
+        header: encoded manifest.
+        manifest: list of (name, dtype, shape, offset).
+        size: block size.
+    """
+    manifest = []
+    offset = 0
+    for name in sorted(arrays.keys()):
+        val = arrays[name]
+        manifest.append((name, val.dtype.str, list(val.shape), offset))
+        offset += -(-val.nbytes // ALIGN) * ALIGN
+    header = json.dumps(manifest).encode('UTF-8')
+    data_offset = -(-(8 + len(header)) // ALIGN) * ALIGN
+    manifest = [(name, dtype, shape, off + data_offset) for name, dtype, shape, off in manifest]
+    header = json.dumps(manifest).encode('UTF-8')
+    # the header length may change with shifted offsets, enlarge the header area if needed.
+    while 8 + len(header) > data_offset:
+        data_offset += ALIGN
+        manifest = [(name, dtype, shape, off + ALIGN) for name, dtype, shape, off in manifest]
+        header = json.dumps(manifest).encode('UTF-8')
+    return header, manifest, max(data_offset + offset, 1)
+
+
+def write_block(name, arrays):
+    """Write arrays into a new shared memory block.
+    Returns:
+        shm: the created SharedMemory.
+    """
+    header, manifest, size = _layout(arrays)
+    shm = _open_shm(name, create=True, size=size)
+    buf = shm.buf
+    buf[0:8] = np.array([len(header)], dtype='<u8').tobytes()
+    buf[8:8 + len(header)] = header
+    for key, dtype, shape, offset in manifest:
+        view = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+        view[...] = arrays[key]
+        del view
+    return shm
+
+
+def read_block(shm):
+    """Get zero-copy views of a shared memory block.
+    Returns:
+        arrays: a dictionary of read-only arrays.
+    """
+    header_len = int(np.frombuffer(shm.buf, dtype='<u8', count=1)[0])
+    manifest = json.loads(bytes(shm.buf[8:8 + header_len]).decode('UTF-8'))
+    arrays = {}
+    for key, dtype, shape, offset in manifest:
+        view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        view.flags.writeable = False
+        arrays[key] = view
+    return arrays
+
+
+class SharedScene(object):
+    """Zero-copy views of a decoded scene."""
+
+    def __init__(self, pid, arrays, mask_size=32):
+        self.pid = pid
+        self.arrays = arrays
+        self.mask_size = mask_size
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    def __contains__(self, key):
+        return key in self.arrays
+
+    def kpts(self, img_idx):
+        """Get the Nx6 keypoints of an image."""
+        offsets = self.arrays['kpts_offsets']
+        return self.arrays['kpts'][offsets[img_idx]:offsets[img_idx + 1]]
+
+    def mask(self, idx0, idx1):
+        """Get the flattened bool mask of an image pair, None if not exists."""
+        keys = self.arrays['mask_keys']
+        key = hash_int_pairs(idx0, idx1)
+        pos = int(np.searchsorted(keys, key))
+        if pos >= keys.shape[0] or keys[pos] != key:
+            return None
+        return np.unpackbits(self.arrays['mask_packed'][pos],
+                             count=self.mask_size * self.mask_size * 2).astype(bool)
+
+
+class SharedSceneLoader(object):
+    """Decode scenes once into shared memory and share them across processes."""
+
+    def __init__(self, data_root, budget_bytes=8 << 30, max_scenes=4096,
+                 parts=('cams', 'corr', 'mask', 'kpts'), mask_size=32, poll_interval=0.01,
+                 load_timeout=600., ctx=None):
+        """
+        Args:
+            data_root: root of scene data.
+            budget_bytes: memory budget of decoded scenes.
+            max_scenes: maximum number of scenes held at the same time.
+            parts: parts of scenes to decode, see decode_scene.
+            mask_size: mask size.
+            poll_interval: interval in seconds to wait for scenes being decoded by other processes.
+            load_timeout: time in seconds after which a scene still being decoded by another
+                process is decoded again, as is a scene of which the decoding process died.
+            ctx: multiprocessing context of workers, defaults to the global one.
+        """
+        self.data_root = data_root
+        self.budget_bytes = budget_bytes
+        self.parts = tuple(parts)
+        self.mask_size = mask_size
+        self.poll_interval = poll_interval
+        self.load_timeout = load_timeout
+        self.prefix = 'gl3d' + uuid.uuid4().hex[:8]
+        self.lock = (multiprocessing if ctx is None else ctx).Lock()
+        self._owner_pid = os.getpid()
+        self._registry_shm = _open_shm(self.prefix, create=True,
+                                       size=max_scenes * REGISTRY_DTYPE.itemsize)
+        self.registry = np.ndarray((max_scenes,), dtype=REGISTRY_DTYPE, buffer=self._registry_shm.buf)
+        self.registry[...] = np.zeros((), dtype=REGISTRY_DTYPE)
+        self._attached = {}
+        self._attached_pid = os.getpid()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ['_registry_shm', 'registry', '_attached', '_attached_pid']:
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._registry_shm = _open_shm(self.prefix)
+        self.registry = np.ndarray((self._registry_shm.size // REGISTRY_DTYPE.itemsize,),
+                                   dtype=REGISTRY_DTYPE, buffer=self._registry_shm.buf)
+        self._attached = {}
+        self._attached_pid = os.getpid()
+
+    def _local(self):
+        """Get blocks attached by this process, which are not inherited by forked workers."""
+        if self._attached_pid != os.getpid():
+            self._attached = {}
+            self._attached_pid = os.getpid()
+        return self._attached
+
+    def _block_name(self, slot):
+        return '%s_%d_%d' % (self.prefix, slot, self.registry['generation'][slot])
+
+    def _find(self, pid):
+        slots = np.flatnonzero((self.registry['pid'] == pid.encode('UTF-8')) &
+                               (self.registry['state'] != EMPTY))
+        return int(slots[0]) if slots.shape[0] > 0 else -1
+
+    def _clear_slot(self, slot):
+        """Clear a registry slot, keeping its generation so that block names are never reused."""
+        generation = self.registry['generation'][slot]
+        self.registry[slot] = np.zeros((), dtype=REGISTRY_DTYPE)
+        self.registry['generation'][slot] = generation
+
+    def _evict_one(self, keep=-1):
+        """Evict the least recently used scene without references. Must hold the lock.
+        Returns:
+            evicted: whether a scene was evicted.
+        """
+        registry = self.registry
+        candidates = np.flatnonzero((registry['state'] == READY) & (registry['refcount'] == 0))
+        candidates = candidates[candidates != keep]
+        if candidates.shape[0] == 0:
+            return False
+        slot = int(candidates[np.argmin(registry['last_used'][candidates])])
+        _unlink_shm(self._block_name(slot))
+        self._clear_slot(slot)
+        return True
+
+    def _evict(self, need, keep):
+        """Evict scenes until need more bytes fit into the budget, or no scene can be evicted. Must
+        hold the lock."""
+        registry = self.registry
+        while int(registry['nbytes'][registry['state'] != EMPTY].sum()) + need > self.budget_bytes:
+            if not self._evict_one(keep):
+                return
+
+    def _stale(self, slot):
+        """Check whether a LOADING scene is abandoned by its decoding process. Must hold the lock."""
+        loader = int(self.registry['loader'][slot])
+        return not _process_alive(loader) or \
+            time.time() - self.registry['last_used'][slot] > self.load_timeout
+
+    def _owns(self, slot, generation):
+        """Check whether this process is still decoding a slot. Must hold the lock."""
+        return self.registry['state'][slot] == LOADING and \
+            self.registry['generation'][slot] == generation and \
+            self.registry['loader'][slot] == os.getpid()
+
+    def acquire(self, pid):
+        """Acquire a scene, decoding it if no process has done so.
+        Returns:
+            scene: SharedScene.
+        """
+        registry = self.registry
+        while True:
+            with self.lock:
+                slot = self._find(pid)
+                if slot >= 0 and registry['state'][slot] == READY:
+                    registry['refcount'][slot] += 1
+                    registry['last_used'][slot] = time.time()
+                    name = self._block_name(slot)
+                    break
+                if slot >= 0 and self._stale(slot):
+                    # the block may have been created before the decoding process died.
+                    _unlink_shm(self._block_name(slot))
+                    self._clear_slot(slot)
+                    slot = -1
+                if slot < 0:
+                    empty = np.flatnonzero(registry['state'] == EMPTY)
+                    if empty.shape[0] == 0 and self._evict_one():
+                        empty = np.flatnonzero(registry['state'] == EMPTY)
+                    if empty.shape[0] == 0:
+                        raise RuntimeError('Too many scenes held at the same time.')
+                    slot = int(empty[0])
+                    self._clear_slot(slot)
+                    registry['pid'][slot] = pid.encode('UTF-8')
+                    registry['state'][slot] = LOADING
+                    registry['loader'][slot] = os.getpid()
+                    registry['last_used'][slot] = time.time()
+                    registry['generation'][slot] += 1
+                    generation = registry['generation'][slot]
+                    name = self._block_name(slot)
+                    loading = True
+                else:
+                    loading = False
+            if not loading:
+                # decoded by another process.
+                time.sleep(self.poll_interval)
+                continue
+            try:
+                arrays = decode_scene(os.path.join(self.data_root, pid), self.parts, self.mask_size)
+                shm = write_block(name, arrays)
+                del arrays
+            except BaseException:
+                _unlink_shm(name)
+                with self.lock:
+                    if self._owns(slot, generation):
+                        self._clear_slot(slot)
+                raise
+            with self.lock:
+                if not self._owns(slot, generation):
+                    # taken over by another process after the load timeout.
+                    shm.close()
+                    _unlink_shm(name)
+                    continue
+                self._evict(shm.size, slot)
+                registry['nbytes'][slot] = shm.size
+                registry['refcount'][slot] = 1
+                registry['last_used'][slot] = time.time()
+                registry['state'][slot] = READY
+            shm.close()
+            break
+
+        attached = self._local()
+        if pid in attached and attached[pid][0].name.lstrip('/') == name:
+            entry = attached[pid]
+            entry[1] += 1
+        else:
+            shm = _open_shm(name)
+            entry = [shm, 1, SharedScene(pid, read_block(shm), self.mask_size)]
+            attached[pid] = entry
+        return entry[2]
+
+    def release(self, pid):
+        """Release a scene. Views of the scene should not be used afterwards."""
+        with self.lock:
+            slot = self._find(pid)
+            if slot >= 0:
+                self.registry['refcount'][slot] = max(self.registry['refcount'][slot] - 1, 0)
+        attached = self._local()
+        entry = attached.get(pid)
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del attached[pid]
+                entry[2].arrays = {}
+                try:
+                    entry[0].close()
+                except BufferError:
+                    # views are still referenced, the mapping is released when they are freed.
+                    pass
+
+    def scene(self, pid):
+        """Context manager of acquire and release."""
+        loader = self
+
+        class _SceneContext(object):
+            def __enter__(self):
+                return loader.acquire(pid)
+
+            def __exit__(self, *args):
+                loader.release(pid)
+        return _SceneContext()
+
+    def stats(self):
+        """Get the registry summary.
+        Returns:
+            stats: a dictionary of scenes, references and bytes held.
+        """
+        with self.lock:
+            valid = self.registry['state'] != EMPTY
+            return {'scenes': int(valid.sum()), 'bytes': int(self.registry['nbytes'][valid].sum()),
+                    'refcount': {val['pid'].decode('UTF-8'): int(val['refcount'])
+                                 for val in self.registry[valid]}}
+
+    def close(self):
+        """Detach, and in the creating process, unlink all blocks."""
+        attached = self._local()
+        owner = self._owner_pid == os.getpid()
+        for pid in list(attached.keys()):
+            entry = attached.pop(pid)
+            entry[2].arrays = {}
+            try:
+                entry[0].close()
+            except BufferError:
+                pass
+        if owner:
+            with self.lock:
+                for slot in np.flatnonzero(self.registry['state'] != EMPTY):
+                    _unlink_shm(self._block_name(int(slot)))
+        registry_shm = self._registry_shm
+        del self.registry
+        registry_shm.close()
+        if owner:
+            _unlink_shm(registry_shm.name.lstrip('/'))
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Spatial index of keypoints for radius, k-NN and reprojection queries.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+
+
+def kpt_positions(kpts, img_size):
+    """Get pixel positions of keypoints.
+    Args:
+        kpts: Nx6 keypoints in normalized coordinates, as read by io.read_kpt.
+        img_size: image size (width, height).
+    Returns:
+        xy: Nx2 (x, y) pixel positions.
+    """
+    hs = np.asarray(img_size, dtype=np.float64) / 2
+    return np.stack([kpts[:, 2] * hs[0] + hs[0], kpts[:, 5] * hs[1] + hs[1]], axis=-1)
+
+
+class KeypointIndex(object):
+    """Uniform grid hash of 2D points.
+
+    Points are sorted by their grid cells, of which the ranges are kept in a dense offset table,
+    so that the points of any cell are found in O(1).
+    """
+
+    def __init__(self, xy, cell_size=8., max_cells=1 << 22):
+        """
+        Args:
+            xy: Nx2 (x, y) positions, e.g., of kpt_positions.
+            cell_size: cell size in pixels, best around the query radius.
+            max_cells: maximum number of cells, the cell size is enlarged beyond it.
+        """
+        self.xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        if self.xy.shape[0] > 0:
+            self.origin = self.xy.min(axis=0)
+            extent = self.xy.max(axis=0) - self.origin
+        else:
+            self.origin = np.zeros(2)
+            extent = np.zeros(2)
+        cell_size = float(cell_size)
+        while np.prod(np.floor(extent / cell_size) + 1) > max_cells:
+            cell_size *= 2
+        self.cell_size = cell_size
+        self.grid_shape = (np.floor(extent / cell_size) + 1).astype(np.int64)  # (nx, ny)
+
+        cells = self._cells(self.xy)
+        self.order = np.argsort(cells[:, 1] * self.grid_shape[0] + cells[:, 0], kind='stable')
+        cell_ids = (cells[:, 1] * self.grid_shape[0] + cells[:, 0])[self.order]
+        self.cell_ptr = np.searchsorted(cell_ids, np.arange(int(np.prod(self.grid_shape)) + 1))
+        self.sorted_xy = self.xy[self.order]
+        self._tree = None
+
+    def __len__(self):
+        return self.xy.shape[0]
+
+    def _cells(self, xy):
+        return np.floor((xy - self.origin) / self.cell_size).astype(np.int64)
+
+    def query_radius(self, xy, radius):
+        """Find all points within a radius of each query.
+        Args:
+            xy: Mx2 query positions.
+            radius: search radius.
+        Returns:
+            query_idx: K-d query indices, sorted.
+            point_idx: K-d indices of points.
+            dist: K-d distances.
+        """
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        cells = self._cells(xy)
+        span = int(np.ceil(radius / self.cell_size))
+        query_idx, point_idx, dist = [], [], []
+        nx, ny = self.grid_shape
+        for dy in range(-span, span + 1):
+            for dx in range(-span, span + 1):
+                cx = cells[:, 0] + dx
+                cy = cells[:, 1] + dy
+                valid = np.flatnonzero((cx >= 0) & (cx < nx) & (cy >= 0) & (cy < ny))
+                cell_ids = cy[valid] * nx + cx[valid]
+                start = self.cell_ptr[cell_ids]
+                count = self.cell_ptr[cell_ids + 1] - start
+                total = int(count.sum())
+                if total == 0:
+                    continue
+                # expand (query, cell range) to candidate pairs.
+                q = np.repeat(valid, count)
+                offset = np.repeat(start - np.concatenate([[0], np.cumsum(count)[:-1]]), count)
+                p = offset + np.arange(total)
+                d = np.sqrt(np.sum(np.square(self.sorted_xy[p] - xy[q]), axis=-1))
+                keep = d <= radius
+                query_idx.append(q[keep])
+                point_idx.append(self.order[p[keep]])
+                dist.append(d[keep])
+        if not query_idx:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0)
+        query_idx = np.concatenate(query_idx)
+        point_idx = np.concatenate(point_idx)
+        dist = np.concatenate(dist)
+        order = np.lexsort((dist, query_idx))
+        return query_idx[order], point_idx[order], dist[order]
+
+    def query_knn(self, xy, k=1, max_radius=None):
+        """Find the k nearest points of each query.
+        Args:
+            xy: Mx2 query positions.
+            k: number of neighbors.
+            max_radius: search radius. If None, exact neighbors are found by scipy's cKDTree.
+        Returns:
+            idx: Mxk indices of points sorted by distance, -1 if fewer than k points are found.
+            dist: Mxk distances, inf if not found.
+        """
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        m = xy.shape[0]
+        idx = np.full((m, k), -1, dtype=np.int64)
+        dist = np.full((m, k), np.inf)
+        if max_radius is None:
+            if len(self) > 0:
+                if self._tree is None:
+                    from scipy.spatial import cKDTree
+                    self._tree = cKDTree(self.xy)
+                found_dist, found = self._tree.query(xy, k=k)
+                found = found.reshape(m, k)
+                dist[:] = found_dist.reshape(m, k)
+                idx[:] = np.where(found < len(self), found, -1)
+            return idx, dist
+        query_idx, point_idx, d = self.query_radius(xy, max_radius)
+        # rank of each pair within its query, pairs being sorted by (query, distance).
+        first = np.searchsorted(query_idx, query_idx, side='left')
+        rank = np.arange(query_idx.shape[0]) - first
+        keep = rank < k
+        idx[query_idx[keep], rank[keep]] = point_idx[keep]
+        dist[query_idx[keep], rank[keep]] = d[keep]
+        return idx, dist
+
+    def match(self, xy, radius, mutual=True):
+        """Match query positions, e.g., reprojected by geom.warp, to their nearest points.
+        Args:
+            xy: Mx2 query (x, y) positions in the image of the indexed points. Note that geom.warp
+                returns (row, column) positions at the depth resolution, i.e., pos1[:, ::-1] * ratio.
+            radius: maximum reprojection distance.
+            mutual: whether to only keep pairs of which the point is also nearest to the query.
+        Returns:
+            query_idx: K-d query indices.
+            point_idx: K-d matched point indices.
+            dist: K-d distances.
+        """
+        query_idx, point_idx, dist = self.query_radius(xy, radius)
+        if query_idx.shape[0] == 0:
+            return query_idx, point_idx, dist
+        # the nearest point of each query, pairs being sorted by (query, distance).
+        first = np.ones(query_idx.shape[0], dtype=bool)
+        first[1:] = query_idx[1:] != query_idx[:-1]
+        if mutual:
+            # the nearest query of each point, by sorting pairs by (point, distance).
+            order = np.lexsort((dist, point_idx))
+            nearest = np.ones(order.shape[0], dtype=bool)
+            nearest[1:] = point_idx[order][1:] != point_idx[order][:-1]
+            point_nearest = np.zeros(query_idx.shape[0], dtype=bool)
+            point_nearest[order[nearest]] = True
+            first &= point_nearest
+        return query_idx[first], point_idx[first], dist[first]
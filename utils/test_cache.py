@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Tests of cache.py, including concurrent writers.
+
+    python -m unittest discover -s utils -t . -p 'test_*.py'
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.cache import LabelCache
+
+CTX = multiprocessing.get_context('fork')
+
+
+def _put_keys(cache_dir, keys, seed, max_bytes):
+    """Put a distinct result of each key, of which the value identifies the writer."""
+    cache = LabelCache(cache_dir, max_bytes=max_bytes, scan_interval=1)
+    for key in keys:
+        cache.put(key, (np.full(1000, seed, np.int32), np.array([seed])))
+
+
+class LabelCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def leftovers(self):
+        """List temporary or trashed entries."""
+        return [val for sub_dir in os.listdir(self.cache_dir)
+                for val in os.listdir(os.path.join(self.cache_dir, sub_dir)) if '.' in val]
+
+    def test_round_trip(self):
+        cache = LabelCache(self.cache_dir)
+        pos = np.random.rand(10, 2).astype(np.float32)
+        cache.put('a' * 40, pos)
+        cache.put('b' * 40, (pos, np.arange(3)))
+        cache.put('c' * 40, {'pos': pos, 'valid': pos[:, 0] > 0.5})
+        np.testing.assert_array_equal(cache.get('a' * 40), pos)
+        self.assertIsInstance(cache.get('a' * 40), np.memmap)
+        result = cache.get('b' * 40)
+        self.assertIsInstance(result, tuple)
+        np.testing.assert_array_equal(result[1], np.arange(3))
+        result = cache.get('c' * 40)
+        self.assertEqual(sorted(result.keys()), ['pos', 'valid'])
+        self.assertEqual(result['valid'].dtype, np.bool_)
+        self.assertIsNone(cache.get('d' * 40))
+
+    def test_non_numeric(self):
+        cache = LabelCache(self.cache_dir)
+        for result in [None, np.array([None, 1]), ('x', np.arange(3)), {'a': [np.arange(2), np.arange(3)]}]:
+            with self.assertRaises(TypeError):
+                cache.put('a' * 40, result)
+        self.assertEqual(cache.entries(), [])
+        self.assertEqual(self.leftovers(), [])
+        calls = []
+        with self.assertRaises(TypeError):
+            cache.get_or_compute(lambda: calls.append(1), 'none')
+        self.assertEqual(calls, [1])
+
+    def test_key_invalidation(self):
+        cache = LabelCache(self.cache_dir)
+        input_path = os.path.join(self.tmp_dir, 'depth.pfm')
+        with open(input_path, 'wb') as fout:
+            fout.write(b'\0' * 100)
+        calls = []
+
+        def _compute():
+            calls.append(1)
+            return np.arange(len(calls) * 10)
+
+        def _get(params=None):
+            return cache.get_or_compute(_compute, 'warp', [input_path], params)
+
+        self.assertEqual(len(_get()), 10)
+        self.assertEqual(len(_get()), 10)
+        self.assertEqual(len(calls), 1)
+        # changed size.
+        with open(input_path, 'ab') as fout:
+            fout.write(b'\0')
+        self.assertEqual(len(_get()), 20)
+        # same size, changed mtime.
+        stat = os.stat(input_path)
+        os.utime(input_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual(len(_get()), 30)
+        self.assertEqual(len(_get()), 30)
+        # changed parameters, including numpy values.
+        self.assertEqual(len(_get({'depth_thld': np.float64(0.05)})), 40)
+        self.assertEqual(len(_get({'depth_thld': 0.05})), 40)
+        self.assertEqual(len(_get({'depth_thld': 0.1})), 50)
+        self.assertNotEqual(cache.key('warp', [input_path]), cache.key('undist', [input_path]))
+        self.assertEqual(len(calls), 5)
+
+    def test_lru_eviction(self):
+        cache = LabelCache(self.cache_dir, scan_interval=1)
+        cache.put('0' * 40, np.zeros(1000))
+        entry_bytes = cache.entries()[0][1]
+        cache.clear()
+
+        cache.max_bytes = int(entry_bytes * 3.5)
+        keys = ['%d' % i * 40 for i in range(4)]
+        now = time.time()
+        for i, key in enumerate(keys[0:3]):
+            cache.put(key, np.full(1000, i, np.float64))
+            meta_path = os.path.join(cache._path(key), LabelCache.META)  # pylint: disable=protected-access
+            os.utime(meta_path, (now - 30 + 10 * i, now - 30 + 10 * i))
+        self.assertEqual(len(cache.entries()), 3)
+        # accessing the oldest entry makes the second one the least recently used.
+        held = cache.get(keys[0])
+        cache.put(keys[3], np.full(1000, 3, np.float64))
+        self.assertEqual(sorted([val[2] for val in cache.entries()]), [keys[0], keys[2], keys[3]])
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertLessEqual(sum([val[1] for val in cache.entries()]), cache.max_bytes)
+        # arrays memory-mapped before eviction stay readable.
+        cache.max_bytes = 0
+        cache.put(keys[1], np.full(1000, 1, np.float64))
+        self.assertEqual(cache.entries(), [])
+        self.assertEqual(float(held.sum()), 0)
+        self.assertEqual(self.leftovers(), [])
+
+    def test_concurrent_put(self):
+        keys = ['%02x' % i * 20 for i in range(20)]
+        for max_bytes in [None, 50000]:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            cache = LabelCache(self.cache_dir)
+            procs = [CTX.Process(target=_put_keys, args=(self.cache_dir, keys, seed, max_bytes))
+                     for seed in range(1, 5)]
+            for proc in procs:
+                proc.start()
+            # readers see either no entry or a complete entry of a single writer.
+            num_read = 0
+            writing = True
+            while writing:
+                writing = any([proc.is_alive() for proc in procs])
+                for key in keys:
+                    result = cache.get(key)
+                    if result is None:
+                        continue
+                    seed = int(result[1][0])
+                    self.assertIn(seed, range(1, 5))
+                    self.assertEqual(result[0].shape, (1000,))
+                    self.assertTrue(np.all(result[0] == seed))
+                    num_read += 1
+            self.assertGreater(num_read, 0)
+            for proc in procs:
+                proc.join(30)
+                self.assertEqual(proc.exitcode, 0)
+            self.assertEqual(self.leftovers(), [])
+            if max_bytes is None:
+                self.assertEqual(sorted([val[2] for val in cache.entries()]), keys)
+            else:
+                self.assertLessEqual(sum([val[1] for val in cache.entries()]), max_bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""
+Copyright 2019, Zixin Luo, HKUST.
+Tests of shm_loader.py across processes.
+
+    python -m unittest discover -s utils -t . -p 'test_*.py'
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import signal
+import tempfile
+import unittest
+import multiprocessing
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark.fixtures import make_scene
+from utils import shm_loader
+from utils.shm_loader import SharedSceneLoader, LOADING, READY
+
+CTX = multiprocessing.get_context('fork')
+
+
+def _hold_scene(loader, pid, results, release):
+    """Acquire a scene, report a checksum of its keypoints and hold it until release is set."""
+    scene = loader.acquire(pid)
+    results.put((os.getpid(), float(scene['kpts'].sum())))
+    release.wait(30)
+    del scene
+    loader.release(pid)
+    loader.close()
+
+
+def _slow_acquire(loader, pid, delay, results):
+    """Acquire a scene of which decoding takes delay seconds, forever if None."""
+    decode_scene = shm_loader.decode_scene
+
+    def _decode(*args):
+        time.sleep(3600 if delay is None else delay)
+        return decode_scene(*args)
+    shm_loader.decode_scene = _decode
+    scene = loader.acquire(pid)
+    results.put(float(scene['kpts'].sum()))
+    del scene
+    loader.release(pid)
+    loader.close()
+
+
+class SharedSceneLoaderTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data_root = tempfile.mkdtemp()
+        cls.pids = ['s%d' % i for i in range(4)]
+        for i, pid in enumerate(cls.pids):
+            make_scene(os.path.join(cls.data_root, pid), n_images=3, depth_size=(8, 8), kpt_num=200,
+                       corr_num=50, n_corr_pairs=2, seed=i)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.data_root, ignore_errors=True)
+
+    def setUp(self):
+        self.loaders = []
+
+    def tearDown(self):
+        for loader in self.loaders:
+            prefix = loader.prefix
+            loader.close()
+            if os.path.isdir('/dev/shm'):
+                self.assertEqual([val for val in os.listdir('/dev/shm') if val.startswith(prefix)], [])
+
+    def make_loader(self, **kwargs):
+        loader = SharedSceneLoader(self.data_root, parts=('cams', 'kpts'), ctx=CTX, **kwargs)
+        self.loaders.append(loader)
+        return loader
+
+    def checksum(self, pid):
+        return float(shm_loader.decode_scene(os.path.join(self.data_root, pid), ('kpts',))['kpts'].sum())
+
+    def held(self, loader):
+        return set(loader.stats()['refcount'].keys())
+
+    def test_slot_limit(self):
+        loader = self.make_loader(max_scenes=2)
+        for pid in self.pids[0:2]:
+            with loader.scene(pid):
+                pass
+        with loader.scene(self.pids[0]):
+            pass
+        # a new scene evicts only the least recently used one.
+        with loader.scene(self.pids[2]):
+            pass
+        self.assertEqual(self.held(loader), set([self.pids[0], self.pids[2]]))
+        loader.acquire(self.pids[0])
+        loader.acquire(self.pids[2])
+        with self.assertRaises(RuntimeError):
+            loader.acquire(self.pids[3])
+        loader.release(self.pids[0])
+        loader.release(self.pids[2])
+
+    def test_refcount(self):
+        loader = self.make_loader()
+        results = CTX.Queue()
+        release = CTX.Event()
+        procs = [CTX.Process(target=_hold_scene, args=(loader, self.pids[0], results, release))
+                 for _ in range(4)]
+        for proc in procs:
+            proc.start()
+        checksums = [results.get(timeout=30)[1] for _ in procs]
+        self.assertEqual(checksums, [self.checksum(self.pids[0])] * 4)
+        stats = loader.stats()
+        self.assertEqual(stats['refcount'], {self.pids[0]: 4})
+        # decoded once, i.e., by the first slot generation.
+        self.assertEqual(int(loader.registry['generation'].max()), 1)
+        release.set()
+        for proc in procs:
+            proc.join(30)
+            self.assertEqual(proc.exitcode, 0)
+        self.assertEqual(loader.stats()['refcount'], {self.pids[0]: 0})
+
+    def test_budget_eviction(self):
+        loader = self.make_loader()
+        with loader.scene(self.pids[0]):
+            pass
+        loader.budget_bytes = loader.stats()['bytes'] + 1
+        scene0 = loader.acquire(self.pids[0])
+        # held scenes are kept beyond the budget.
+        with loader.scene(self.pids[1]):
+            self.assertEqual(self.held(loader), set(self.pids[0:2]))
+        self.assertEqual(float(scene0['kpts'].sum()), self.checksum(self.pids[0]))
+        del scene0
+        loader.release(self.pids[0])
+        with loader.scene(self.pids[2]) as scene:
+            self.assertEqual(float(scene['kpts'].sum()), self.checksum(self.pids[2]))
+        self.assertEqual(self.held(loader), set([self.pids[2]]))
+
+    def wait_loading(self, loader, pid):
+        for _ in range(3000):
+            with loader.lock:
+                slot = loader._find(pid)  # pylint: disable=protected-access
+                if slot >= 0 and loader.registry['state'][slot] == LOADING:
+                    return
+            time.sleep(0.01)
+        self.fail('scene is not being decoded')
+
+    def test_killed_loader(self):
+        loader = self.make_loader()
+        results = CTX.Queue()
+        for reap in [True, False]:
+            proc = CTX.Process(target=_slow_acquire, args=(loader, self.pids[0], None, results))
+            proc.start()
+            self.wait_loading(loader, self.pids[0])
+            os.kill(proc.pid, signal.SIGKILL)
+            if reap:
+                proc.join()
+            with loader.scene(self.pids[0]) as scene:
+                self.assertEqual(float(scene['kpts'].sum()), self.checksum(self.pids[0]))
+            proc.join()
+            with loader.lock:
+                slot = loader._find(self.pids[0])  # pylint: disable=protected-access
+                self.assertEqual(loader.registry['state'][slot], READY)
+                self.assertEqual(loader.registry['loader'][slot], os.getpid())
+            # evicted, to be decoded again in the next round.
+            loader.budget_bytes = 0
+            with loader.scene(self.pids[1]):
+                pass
+            loader.budget_bytes = 8 << 30
+
+    def test_load_timeout(self):
+        loader = self.make_loader(load_timeout=0.2)
+        results = CTX.Queue()
+        proc = CTX.Process(target=_slow_acquire, args=(loader, self.pids[0], 1., results))
+        proc.start()
+        self.wait_loading(loader, self.pids[0])
+        with loader.scene(self.pids[0]) as scene:
+            self.assertEqual(float(scene['kpts'].sum()), self.checksum(self.pids[0]))
+        # the slow process discards its own block and uses the scene decoded meanwhile.
+        self.assertEqual(results.get(timeout=30), self.checksum(self.pids[0]))
+        proc.join(30)
+        self.assertEqual(proc.exitcode, 0)
+        self.assertEqual(loader.stats()['refcount'], {self.pids[0]: 0})
+
+
+if __name__ == '__main__':
+    unittest.main()